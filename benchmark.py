@@ -0,0 +1,493 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from contextlib import nullcontext, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import http_cache
+import metrics
+import rate_limiter
+from download_vehicle_specs import download_pdfs_by_pattern_from_url
+from extract_vehicle_lineup import download_car_images, extract_vehicle_lineup, fetch_car_descriptions
+from scan_and_match_pdfs import scan_and_match_many
+from run_marker_batch import run_marker_on_matched_pdfs
+from replace_md_images import batch_replace_md_images
+from md_index import MarkdownIndex, default_index_path, load_catalog_metadata
+from pipeline import run_pipeline
+
+# 替身站点的路径与正式站点的结构一致，README中的--pattern/--file-pattern可以原样使用
+LISTING_PATH = '/request/webcatalog/welcab/'
+LINEUP_PATH = '/lineup/'
+PDF_DIR = '/pages/contents/request/webcatalog/'
+PDF_PATTERN = r'^/pages/contents/request/webcatalog/.+\.pdf$'
+FILE_PATTERN = r'^.+welcab.+\.pdf$'
+CARTYPE = '福祉車両'
+URL_PREFIX = 'http://img.example/site/'
+SEARCH_QUERIES = ['寸法', '燃費 WLTC', '乗車定員', '車両重量', '最小回転半径', '車いす']
+
+# 合成PDF的头部记录页数和各页的改版号，marker替身从这里读取
+PDF_PAGES_RE = re.compile(rb'%bench-pages=(\d+)')
+PDF_REVS_RE = re.compile(rb'%bench-revs=([\d,]+)')
+
+def make_stub_pdf(pages, revs=None, body=b''):
+    """
+    生成marker替身能读取的合成PDF。
+    Args:
+        pages (int): 页数
+        revs (list): 各页的改版号，改版号变化的页输出内容不同（用于页面缓存的测试），默认全为0
+        body (bytes): 填充内容，用于控制文件大小
+    """
+    header = b'%PDF-1.4\n%bench-pages=' + str(pages).encode() + b'\n'
+    if revs:
+        header += b'%bench-revs=' + ','.join(str(rev) for rev in revs).encode() + b'\n'
+    return header + body + b'\n%%EOF\n'
+
+def read_stub_pdf(pdf_path):
+    """
+    Returns:
+        tuple: (页数, 各页的改版号)
+    """
+    with open(pdf_path, 'rb') as f:
+        head = f.read(512)
+    pages = int(PDF_PAGES_RE.search(head).group(1))
+    m = PDF_REVS_RE.search(head)
+    revs = [int(rev) for rev in m.group(1).split(b',')] if m else [0] * pages
+    return pages, revs
+
+STUB_MARKER = r'''#!{python}
+# benchmark.py生成的marker_single替身：按页数等待，输出与marker分页输出相同布局的markdown和图片
+# BENCH_MARKER_HEADINGS: all（默认）每页有标题；none 没有标题；revised 只有改版号不为0的页有标题
+# BENCH_MARKER_LOG: 指定时把每次调用的参数追加写入该文件
+import os, re, sys, json, time
+args = sys.argv[1:]
+pdf_path = args[0]
+output_dir = args[args.index('--output_dir') + 1]
+with open(pdf_path, 'rb') as f:
+    head = f.read(512)
+pages = int(re.search(rb'%bench-pages=(\d+)', head).group(1))
+m = re.search(rb'%bench-revs=([\d,]+)', head)
+revs = [int(rev) for rev in m.group(1).split(b',')] if m else [0] * pages
+page_range = args[args.index('--page_range') + 1] if '--page_range' in args else None
+page_ids = list(range(pages))
+if page_range:
+    page_ids = []
+    for part in page_range.split(','):
+        start, _, end = part.partition('-')
+        page_ids.extend(range(int(start), int(end or start) + 1))
+if os.environ.get('BENCH_MARKER_LOG'):
+    with open(os.environ['BENCH_MARKER_LOG'], 'a', encoding='utf-8') as f:
+        f.write(json.dumps({{'pdf_path': pdf_path, 'output_dir': output_dir, 'page_range': page_range}}) + '\n')
+# 模拟加载模型的内存占用
+ballast = b'\x01' * (int(os.environ.get('BENCH_MARKER_MB', '0')) * 1024 * 1024)
+time.sleep(float(os.environ.get('BENCH_MARKER_SECONDS_PER_PAGE', '0')) * len(page_ids))
+headings = os.environ.get('BENCH_MARKER_HEADINGS', 'all')
+base = os.path.splitext(os.path.basename(pdf_path))[0]
+folder = os.path.join(output_dir, base)
+os.makedirs(folder, exist_ok=True)
+parts = []
+toc = []
+for i in page_ids:
+    image = f'_page_{{i}}_Picture_0.jpeg'
+    with open(os.path.join(folder, image), 'wb') as f:
+        f.write(b'\xff\xd8\xff\xe0' + base.encode() + b'%d-%d' % (i, revs[i]))
+    body = f'<span id="page-{{i}}-0"></span>\n\n'
+    if headings == 'all' or (headings == 'revised' and revs[i]):
+        body += f'## {{base}} {{i + 1}}\n\n'
+        toc.append({{'title': f'{{base}} {{i + 1}}', 'heading_level': 2, 'page_id': i}})
+    body += (f'{{base}} {{i + 1}}ページ（改訂{{revs[i]}}）。\n\n'
+             f'| 寸法 | 全長{{4000 + i}}mm |\n| 燃費 | {{10 + i % 7}}.{{i % 10}}km/L (WLTCモード) |\n'
+             f'| 乗車定員 | {{4 + i % 4}}名 |\n| 車両重量 | {{1500 + 10 * i}}kg |\n\n![]({{image}})')
+    parts.append('{{%d}}' % i + '-' * 48 + '\n\n' + body)
+with open(os.path.join(folder, base + '.md'), 'w', encoding='utf-8') as f:
+    f.write('\n\n'.join(parts))
+with open(os.path.join(folder, base + '_meta.json'), 'w', encoding='utf-8') as f:
+    json.dump({{'table_of_contents': toc, 'page_stats': [{{'page_id': i}} for i in page_ids]}}, f, indent=4)
+'''
+
+class SyntheticSite:
+    """
+    基准测试用的本地替身站点：说明书列表页、车辆一览页、车辆页面、车辆图片和PDF都按参数合成。
+    每个请求先等待约latency秒；按error_rate返回503，按cut_rate在PDF传输到一半时断开连接。
+    PDF带ETag，支持If-None-Match和Range续传，与正式站点一样可以走条件请求和断点续传。
+    """
+
+    def __init__(self, catalogs=50, pages=8, pdf_kb=256, latency=0.02, error_rate=0.0, cut_rate=0.0, seed=0):
+        self.catalogs = catalogs
+        self.pages = pages
+        self.pdf_kb = pdf_kb
+        self.latency = latency
+        self.error_rate = error_rate
+        self.cut_rate = cut_rate
+        self.cars = [f'Car{i:03d}' for i in range(catalogs)]
+        self.codes = {car.lower(): car for car in self.cars}
+        self.stats = {'requests': 0, 'errors': 0, 'cuts': 0, 'bytes': 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pdfs = {}
+        self._server = None
+        self.base_url = None
+
+    def pdf_name(self, car):
+        return f'{car.lower()}_welcab_2025.pdf'
+
+    def pdf_bytes(self, name):
+        """按文件名确定性地生成PDF内容，页数在catalogs之间错开，便于观察最长优先调度"""
+        with self._lock:
+            if name not in self._pdfs:
+                i = int(re.search(r'(\d+)', name).group(1))
+                pages = max(1, self.pages + (i % 5) - 2)
+                data = make_stub_pdf(pages, body=random.Random(name).randbytes(max(0, self.pdf_kb * 1024 - 64)))
+                self._pdfs[name] = (data, '"%s"' % hashlib.sha256(data).hexdigest()[:32])
+            return self._pdfs[name]
+
+    def listing_html(self):
+        items = ''.join(f'<li><div class="name">{car}</div><a href="{PDF_DIR}{self.pdf_name(car)}">PDF</a></li>'
+                        for car in self.cars)
+        return f'<html><body><ul>{items}</ul></body></html>'
+
+    def lineup_html(self):
+        items = ''.join(f'<dl><dt class="tjp-car-detail-link__car-name">{car}</dt>'
+                        f'<img alt="{car}" src="/car/{car.lower()}/{car.lower()}.jpg"></dl>' for car in self.cars)
+        return f'<html><body>{items}</body></html>'
+
+    def car_html(self, car):
+        return (f'<html><body><p class="tjp-text tjp-text--size-m-s tjp-text--normal">{car}の紹介文</p>'
+                f'<iframe src="//www.youtube.com/embed/bench{car.lower()}"></iframe></body></html>')
+
+    def chance(self, p):
+        if p <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < p
+
+    def jitter(self):
+        with self._lock:
+            return self.latency * self._rng.uniform(0.5, 1.5)
+
+    def count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def start(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def send_body(self, status, body, content_type, headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+                site.count('bytes', len(body))
+
+            def do_GET(self):
+                site.count('requests')
+                if site.latency:
+                    time.sleep(site.jitter())
+                if site.chance(site.error_rate):
+                    site.count('errors')
+                    self.send_body(503, b'busy', 'text/plain', {'Retry-After': '0'})
+                    return
+                path = self.path.split('?')[0]
+                if path == LISTING_PATH:
+                    self.send_body(200, site.listing_html().encode('utf-8'), 'text/html; charset=utf-8')
+                elif path == LINEUP_PATH:
+                    self.send_body(200, site.lineup_html().encode('utf-8'), 'text/html; charset=utf-8')
+                elif path.startswith(PDF_DIR) and path.endswith('.pdf'):
+                    self.send_pdf(os.path.basename(path))
+                elif path.startswith('/car/') and path.endswith('.jpg'):
+                    self.send_body(200, b'\xff\xd8\xff\xe0' + path.encode(), 'image/jpeg')
+                elif path.strip('/') in site.codes:
+                    self.send_body(200, site.car_html(site.codes[path.strip('/')]).encode('utf-8'),
+                                   'text/html; charset=utf-8')
+                else:
+                    self.send_body(404, b'not found', 'text/plain')
+
+            def send_pdf(self, name):
+                data, etag = site.pdf_bytes(name)
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                start = 0
+                m = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+                if m and self.headers.get('If-Range', etag) == etag:
+                    if int(m.group(1)) >= len(data):
+                        # 与正式站点一样，超出文件末尾的Range返回416
+                        self.send_body(416, b'', 'text/plain', {'Content-Range': f'bytes */{len(data)}'})
+                        return
+                    start = int(m.group(1))
+                body = data[start:]
+                self.send_response(206 if start else 200)
+                self.send_header('Content-Type', 'application/pdf')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.send_header('Accept-Ranges', 'bytes')
+                if start:
+                    self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+                self.end_headers()
+                if len(body) > 1 and site.chance(site.cut_rate):
+                    # 传输到一半断开，客户端应从.part续传
+                    site.count('cuts')
+                    self.wfile.write(body[:len(body) // 2])
+                    site.count('bytes', len(body) // 2)
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+                site.count('bytes', len(body))
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self._server.server_address[1]}'
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def install_stub_marker(bin_dir, seconds_per_page=0.0, memory_mb=0):
+    """生成marker_single替身并加到PATH最前面，转换阶段的子进程会调用它"""
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, 'marker_single')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(STUB_MARKER.format(python=sys.executable))
+    os.chmod(path, 0o755)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    os.environ['BENCH_MARKER_SECONDS_PER_PAGE'] = str(seconds_per_page)
+    os.environ['BENCH_MARKER_MB'] = str(memory_mb)
+    return path
+
+def dir_size(folder, suffix=''):
+    total = 0
+    n = 0
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if name.endswith(suffix):
+                total += os.path.getsize(os.path.join(root, name))
+                n += 1
+    return n, total
+
+def run_stage(name, func, quiet=True):
+    """
+    运行一个阶段并统计：耗时、期间新增的各项指标样本的分位数。
+    Args:
+        func: 返回 (处理数量, 字节数) 的函数
+    Returns:
+        dict: {"stage", "items", "bytes", "elapsed", "items_per_s", "mb_per_s", "latency": {指标名: 分位数}}
+    """
+    m = metrics.get_metrics()
+    before = m.snapshot()
+    started = time.monotonic()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull) if quiet else nullcontext():
+        items, nbytes = func()
+    elapsed = time.monotonic() - started
+    latency = m.timings(since=before)
+    result = {
+        'stage': name,
+        'items': items,
+        'bytes': nbytes,
+        'elapsed': elapsed,
+        'items_per_s': items / elapsed if elapsed > 0 else None,
+        'mb_per_s': nbytes / 1048576 / elapsed if elapsed > 0 and nbytes else None,
+        'latency': latency,
+    }
+    metrics.emit('bench.stage', **result)
+    return result
+
+def run_benchmark(workdir, site, workers=8, per_host=8, marker_slots=2, rewrite_workers=2, queries=50,
+                  repeat=1, pipeline=False, quiet=True):
+    """
+    在workdir中依次运行 下载→车辆一览→匹配→转换→改写图片链接→全文索引，每个阶段单独计时。
+    repeat大于1时在同一目录再运行几轮，测量增量（无变化）时的开销；pipeline为True时再用流水线跑一遍完整流程。
+    Returns:
+        list: 各阶段的run_stage结果
+    """
+    download_dir = os.path.join(workdir, 'catalogs')
+    markdown_dir = os.path.join(workdir, 'markdown')
+    match_db = os.path.join(workdir, 'matches.sqlite')
+    listing_url = site.base_url + LISTING_PATH
+    results = []
+
+    def download():
+        saved = [r for r in download_pdfs_by_pattern_from_url(listing_url, PDF_PATTERN, download_dir, workers, per_host)
+                 if r[2]]
+        return len(saved), sum(os.path.getsize(r[2]) for r in saved)
+
+    def lineup():
+        items = extract_vehicle_lineup(site.base_url + LINEUP_PATH, download_images=False)
+        for item in items:
+            item['img_path'] = os.path.join(workdir, 'lineup', item['car_name'], os.path.basename(item['img_path']))
+        download_car_images(items, workers)
+        records = fetch_car_descriptions(items, workers, base_url=site.base_url)
+        return len(records), 0
+
+    def match():
+        scan_and_match_many([(listing_url, CARTYPE)], download_dir, FILE_PATTERN,
+                            index_path=os.path.join(workdir, 'scan_index.json'), db_path=match_db)
+        return site.catalogs, 0
+
+    def convert():
+        # 按内存预算并行运行marker_single替身：每个进程按1GB模型内存、每页1MB估算
+        failed = run_marker_on_matched_pdfs(download_dir, FILE_PATTERN, markdown_dir,
+                                            memory_budget_mb=marker_slots * (1024 + site.pages + 2),
+                                            memory_per_page_mb=1, model_memory_mb=1024)
+        if failed:
+            print(f"转换失败 {len(failed)} 个", file=sys.stderr)
+        return dir_size(download_dir, '.pdf')
+
+    def rewrite():
+        batch_replace_md_images(markdown_dir, URL_PREFIX, rewrite_workers)
+        return dir_size(markdown_dir, '.md')
+
+    def index():
+        md_index = MarkdownIndex(default_index_path(markdown_dir))
+        try:
+            metadata = load_catalog_metadata(os.path.join(markdown_dir, '.marker_manifest.sqlite'), match_db=match_db)
+            md_index.update(markdown_dir, metadata)
+            for i in range(queries):
+                md_index.search(SEARCH_QUERIES[i % len(SEARCH_QUERIES)], limit=20)
+            return md_index.stats()['pages'], 0
+        finally:
+            md_index.close()
+
+    stages = [('download', download), ('lineup', lineup), ('match', match), ('convert', convert),
+              ('rewrite', rewrite), ('index', index)]
+    for round_no in range(1, repeat + 1):
+        for name, func in stages:
+            label = name if round_no == 1 else f'{name}#{round_no}'
+            results.append(run_stage(label, func, quiet))
+
+    if pipeline:
+        def run_full_pipeline():
+            stats = run_pipeline(listing_url, PDF_PATTERN, os.path.join(workdir, 'pipeline_catalogs'), FILE_PATTERN,
+                                 os.path.join(workdir, 'pipeline_markdown'), URL_PREFIX, workers, per_host,
+                                 md_index=True)
+            return stats.counts.get('rewrite', 0), 0
+        results.append(run_stage('pipeline', run_full_pipeline, quiet))
+    return results
+
+def print_report(results, site):
+    print(f"{'阶段':<12}{'数量':>8}{'耗时(s)':>10}{'个/s':>10}{'MB/s':>9}")
+    for r in results:
+        mbps = f"{r['mb_per_s']:.2f}" if r['mb_per_s'] else '-'
+        ips = f"{r['items_per_s']:.1f}" if r['items_per_s'] else '-'
+        print(f"{r['stage']:<12}{r['items']:>8}{r['elapsed']:>10.2f}{ips:>10}{mbps:>9}")
+        for key, t in sorted(r['latency'].items()):
+            print(f"    {key:<16} n={t['count']:<6} p50 {t['p50'] * 1000:8.1f}ms  p90 {t['p90'] * 1000:8.1f}ms  "
+                  f"p99 {t['p99'] * 1000:8.1f}ms  max {t['max'] * 1000:8.1f}ms")
+    s = site.stats
+    print(f"替身站点: 请求 {s['requests']} 次, 注入503 {s['errors']} 次, 中途断开 {s['cuts']} 次, "
+          f"发送 {s['bytes'] / 1048576:.1f}MB")
+    rss = metrics.peak_rss_mb()
+    if rss is not None:
+        print(f"峰值内存: 本进程 {rss:.0f}MB, 子进程 {metrics.peak_rss_mb(children=True):.0f}MB")
+
+def compare_with_baseline(results, baseline_path, tolerance):
+    """
+    与之前保存的结果比较各阶段的吞吐量，下降超过tolerance的阶段视为退化。
+    Returns:
+        list: 退化的阶段名
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {r['stage']: r for r in json.load(f)['stages']}
+    regressions = []
+    for r in results:
+        base = baseline.get(r['stage'])
+        if not base or not base.get('items_per_s') or not r['items_per_s']:
+            continue
+        ratio = r['items_per_s'] / base['items_per_s']
+        flag = ''
+        if ratio < 1 - tolerance:
+            regressions.append(r['stage'])
+            flag = '  <-- 退化'
+        print(f"{r['stage']:<12} {base['items_per_s']:.1f} -> {r['items_per_s']:.1f} 个/s ({ratio:.0%}){flag}")
+    return regressions
+
+if __name__ == '__main__':
+    '''
+    python benchmark.py --catalogs 100 --pages 12 --pdf-kb 512 --latency-ms 30 --error-rate 0.05 --cut-rate 0.05
+    保存结果并与之前的结果比较：
+    python benchmark.py --json bench.json
+    python benchmark.py --compare bench.json --tolerance 0.2
+    '''
+    parser = argparse.ArgumentParser(description='用本地替身站点和marker替身跑完整流程，测量各阶段吞吐量、延迟分位数和峰值内存')
+    parser.add_argument('--catalogs', type=int, default=50, help='列表页上的说明书数量')
+    parser.add_argument('--pages', type=int, default=8, help='每本说明书的平均页数')
+    parser.add_argument('--pdf-kb', type=int, default=256, help='每个PDF的大小(KB)')
+    parser.add_argument('--latency-ms', type=float, default=20, help='替身站点每个请求的平均延迟(ms)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回503的请求比例')
+    parser.add_argument('--cut-rate', type=float, default=0.0, help='PDF传输中途断开的比例')
+    parser.add_argument('--seed', type=int, default=0, help='错误注入的随机种子')
+    parser.add_argument('--marker-seconds-per-page', type=float, default=0.01, help='marker替身每页的耗时(秒)')
+    parser.add_argument('--marker-mb', type=int, default=0, help='marker替身每个进程占用的内存(MB)')
+    parser.add_argument('--marker-slots', type=int, default=2, help='同时运行的marker替身进程数')
+    parser.add_argument('--workers', type=int, default=8, help='下载和抓取页面的线程数')
+    parser.add_argument('--per-host', type=int, default=8, help='每个主机的最大并发下载数')
+    parser.add_argument('--rewrite-workers', type=int, default=2, help='改写图片链接的进程数')
+    parser.add_argument('--queries', type=int, default=50, help='全文检索的查询次数')
+    parser.add_argument('--repeat', type=int, default=1, help='在同一目录重复运行的轮数，第2轮起测量增量运行')
+    parser.add_argument('--pipeline', action='store_true', help='再用pipeline.py的流水线跑一遍完整流程')
+    parser.add_argument('--workdir', help='工作目录（保留结果），默认使用临时目录并在结束后删除')
+    parser.add_argument('--verbose', action='store_true', help='显示各阶段自己的输出')
+    parser.add_argument('--json', help='把结果保存为JSON，可作为之后--compare的基准')
+    parser.add_argument('--compare', help='与之前--json保存的结果比较吞吐量')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='吞吐量下降超过该比例视为退化')
+    rate_limiter.add_scheduler_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+    # 基准测试默认不限速，测量的是代码本身；需要时用--rate模拟正式环境
+    rate_limiter.configure(args.rate or 10000, args.max_concurrency, args.max_retries)
+    metrics.configure_from_args(args)
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix='bench-', dir=args.workdir)
+    http_cache.configure(cache_dir=os.path.join(workdir, 'http_cache'))
+    install_stub_marker(os.path.join(workdir, 'bin'), args.marker_seconds_per_page, args.marker_mb)
+    site = SyntheticSite(args.catalogs, args.pages, args.pdf_kb, args.latency_ms / 1000.0,
+                         args.error_rate, args.cut_rate, args.seed)
+    try:
+        with site:
+            print(f"替身站点: {site.base_url}，工作目录: {workdir}")
+            results = run_benchmark(workdir, site, args.workers, args.per_host, args.marker_slots,
+                                    args.rewrite_workers, args.queries, args.repeat, args.pipeline,
+                                    quiet=not args.verbose)
+        print_report(results, site)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({'config': vars(args), 'server': site.stats, 'stages': results,
+                           'peak_rss_mb': metrics.peak_rss_mb(),
+                           'children_peak_rss_mb': metrics.peak_rss_mb(children=True)}, f, ensure_ascii=False, indent=2)
+        regressions = compare_with_baseline(results, args.compare, args.tolerance) if args.compare else []
+    finally:
+        metrics.close()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if regressions:
+        raise SystemExit(1)
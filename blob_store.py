@@ -0,0 +1,108 @@
+import os
+import json
+import shutil
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    content_length INTEGER
+);
+'''
+
+class BlobStore:
+    """
+    按内容sha256存放PDF的仓库，各车辆目录下的文件只是指向仓库的硬链接（跨文件系统时用符号链接）。
+    目录结构:
+        root/objects/ab/abcdef...
+        root/url_index.sqlite URL -> sha256、etag、last_modified、content_length
+    URL索引放在SQLite中，每次下载只写一行；流水线和download_vehicle_specs.py等多个进程可以共用同一个仓库。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, 'url_index.sqlite')
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        # 下载线程共用一个连接，由_lock串行化；其他进程写入时最多等待30秒
+        self.conn = sqlite3.connect(self.index_path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self._import_json_index()
+
+    def _import_json_index(self):
+        """导入旧版本的url_index.json（只在SQLite索引为空时导入一次）"""
+        json_path = os.path.join(self.root, 'url_index.json')
+        if not os.path.exists(json_path) or self.conn.execute('SELECT 1 FROM urls LIMIT 1').fetchone():
+            return
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO urls VALUES (?, ?, ?, ?, ?)', [
+                (url, entry['sha256'], entry.get('etag'), entry.get('last_modified'), entry.get('content_length'))
+                for url, entry in index.items() if entry.get('sha256')])
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, 'objects', sha256[:2], sha256)
+
+    def lookup_url(self, url):
+        """
+        返回URL已知且仓库中存在的内容记录，否则返回None。
+        Returns:
+            dict: {"sha256", "etag", "last_modified", "content_length"}
+        """
+        with self._lock:
+            row = self.conn.execute('SELECT sha256, etag, last_modified, content_length FROM urls WHERE url = ?',
+                                    (url,)).fetchone()
+        if row and os.path.exists(self.blob_path(row['sha256'])):
+            return dict(row)
+        return None
+
+    def add(self, filepath, url, manifest):
+        """
+        把刚下载完成的文件收入仓库（内容已存在时丢弃这份副本），再链接回原路径。
+        Args:
+            filepath (str): 下载完成的文件
+            url (str): 来源URL
+            manifest (dict): download_pdf写入的清单，至少包含sha256
+        Returns:
+            str: 仓库中的blob路径
+        """
+        sha256 = manifest['sha256']
+        blob = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        with self._lock:
+            if not os.path.exists(blob):
+                shutil.move(filepath, blob)
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?)',
+                                  (url, sha256, manifest.get('etag'), manifest.get('last_modified'),
+                                   manifest.get('content_length')))
+        self.link(sha256, filepath)
+        return blob
+
+    def link(self, sha256, dest_path):
+        """把blob链接到dest_path，已存在的文件会被原子替换"""
+        blob = self.blob_path(sha256)
+        if os.path.exists(dest_path) and os.path.samefile(blob, dest_path):
+            return
+        os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
+        tmp_path = dest_path + '.link'
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(blob, tmp_path)
+        except OSError:
+            os.symlink(os.path.abspath(blob), tmp_path)
+        os.replace(tmp_path, dest_path)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
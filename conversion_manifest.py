@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS conversions (
+    sha256 TEXT NOT NULL,
+    options_key TEXT NOT NULL,
+    pdf_path TEXT NOT NULL,
+    output_subdir TEXT NOT NULL,
+    status TEXT NOT NULL,
+    page_count INTEGER,
+    duration REAL,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (sha256, options_key)
+);
+CREATE INDEX IF NOT EXISTS idx_conversions_pdf_path ON conversions (pdf_path);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+'''
+
+def make_options_key(options):
+    """把转换参数序列化为稳定的字符串，参数变化时视为需要重新转换"""
+    return json.dumps(options, sort_keys=True, ensure_ascii=False)
+
+def sha256_of_file(path):
+    """计算文件内容的sha256"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class ConversionManifest:
+    """
+    记录PDF转换状态的本地SQLite清单，按 (PDF内容sha256, 转换参数) 唯一标识一次转换。
+    status: running / done / failed。running表示上次运行中断。
+    """
+
+    def __init__(self, db_path):
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def file_sha256(self, path):
+        """
+        取文件的sha256；大小和mtime未变时直接使用缓存，避免每次重读大PDF。
+        """
+        st = os.stat(path)
+        row = self.conn.execute('SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path = ?', (path,)).fetchone()
+        if row and row['size'] == st.st_size and row['mtime_ns'] == st.st_mtime_ns:
+            return row['sha256']
+        digest = sha256_of_file(path)
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)',
+                              (path, st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def get(self, sha256, options_key):
+        row = self.conn.execute('SELECT * FROM conversions WHERE sha256 = ? AND options_key = ?',
+                                (sha256, options_key)).fetchone()
+        return dict(row) if row else None
+
+    def has_other_version(self, pdf_path, sha256, options_key):
+        """同一路径是否记录过其他内容（即PDF已被更新）"""
+        row = self.conn.execute('SELECT 1 FROM conversions WHERE pdf_path = ? AND options_key = ? AND sha256 != ?',
+                                (pdf_path, options_key, sha256)).fetchone()
+        return row is not None
+
+    def _upsert(self, sha256, options_key, pdf_path, output_subdir, status, page_count=None, duration=None, error=None):
+        with self.conn:
+            self.conn.execute('''
+                INSERT INTO conversions (sha256, options_key, pdf_path, output_subdir, status, page_count, duration, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (sha256, options_key) DO UPDATE SET
+                    pdf_path = excluded.pdf_path,
+                    output_subdir = excluded.output_subdir,
+                    status = excluded.status,
+                    page_count = COALESCE(excluded.page_count, conversions.page_count),
+                    duration = excluded.duration,
+                    error = excluded.error,
+                    updated_at = excluded.updated_at
+            ''', (sha256, options_key, pdf_path, output_subdir, status, page_count, duration, error, time.time()))
+
+    def mark_running(self, sha256, options_key, pdf_path, output_subdir, page_count=None):
+        self._upsert(sha256, options_key, pdf_path, output_subdir, 'running', page_count)
+
+    def mark_done(self, sha256, options_key, pdf_path, output_subdir, duration=None, page_count=None):
+        self._upsert(sha256, options_key, pdf_path, output_subdir, 'done', page_count, duration)
+
+    def mark_failed(self, sha256, options_key, pdf_path, output_subdir, duration=None, error=None):
+        self._upsert(sha256, options_key, pdf_path, output_subdir, 'failed', None, duration, error)
+
+    def summary(self):
+        """各状态的数量、总耗时和总页数"""
+        rows = self.conn.execute('''
+            SELECT status, COUNT(*) AS n, COALESCE(SUM(duration), 0) AS duration, COALESCE(SUM(page_count), 0) AS pages
+            FROM conversions GROUP BY status
+        ''').fetchall()
+        return {row['status']: dict(row) for row in rows}
+
+    def seconds_per_page(self, options_key):
+        """
+        历史上已完成转换的平均每页耗时，用于预估新任务的耗时。
+        Returns:
+            float: 秒/页，没有历史记录时返回None
+        """
+        row = self.conn.execute('''
+            SELECT SUM(duration) AS duration, SUM(page_count) AS pages FROM conversions
+            WHERE options_key = ? AND status = 'done' AND page_count > 0 AND duration > 0
+        ''', (options_key,)).fetchone()
+        if not row['pages']:
+            return None
+        return row['duration'] / row['pages']
+
+    def close(self):
+        self.conn.close()
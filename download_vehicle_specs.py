@@ -1,10 +1,21 @@
 import os
+import json
+import time
+import hashlib
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from urllib.parse import urljoin, urlparse
-from bs4 import BeautifulSoup
 import validators
 import re
 
+import http_cache
+import metrics
+import rate_limiter
+from blob_store import BlobStore
+from html_parser import iter_listing_entries
+
 def is_valid_url(url):
     """Check if the URL is valid"""
     return validators.url(url)
@@ -14,20 +25,253 @@ def get_filename_from_url(url):
     parsed = urlparse(url)
     return os.path.basename(parsed.path) or 'downloaded_file.pdf'
 
-def download_pdf(url, output_dir='downloads'):
+def create_session(pool_size=10):
+    """
+    Create a keep-alive HTTP session whose connection pool is shared by all download threads
+
+    Args:
+        pool_size (int): Max number of pooled connections per host
+
+    Returns:
+        requests.Session: Session with a pooled HTTPAdapter mounted for http/https
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class DownloadStats:
+    """统计下载文件数、字节数和耗时，用于在结束时报告吞吐量（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.downloaded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def add(self, status, nbytes=0):
+        with self._lock:
+            setattr(self, status, getattr(self, status) + 1)
+            self.bytes += nbytes
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        mb = self.bytes / (1024 * 1024)
+        print(f"下载完成: {self.downloaded} 个, 跳过: {self.skipped} 个, 失败: {self.failed} 个, "
+              f"共 {mb:.1f} MB, 耗时 {elapsed:.1f}s, "
+              f"吞吐量 {mb / elapsed:.2f} MB/s, {self.downloaded / elapsed:.2f} 个/s")
+        metrics.emit('download.summary', downloaded=self.downloaded, skipped=self.skipped, failed=self.failed,
+                     bytes=self.bytes, elapsed=elapsed)
+
+def get_manifest_path(filepath):
+    """Return the path of the sidecar manifest that records a downloaded file's validators"""
+    return filepath + '.meta.json'
+
+def load_manifest(filepath):
+    """
+    Load the sidecar manifest of a downloaded file
+
+    Returns:
+        dict: {"url", "etag", "last_modified", "content_length", "sha256", "complete"} or None
+    """
+    try:
+        with open(get_manifest_path(filepath), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_manifest(filepath, manifest):
+    """Atomically write the sidecar manifest (temp file + rename)"""
+    manifest_path = get_manifest_path(filepath)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def sha256_of_file(path, hasher=None):
+    """Compute (or continue) the sha256 of a file's content"""
+    hasher = hasher or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher
+
+class IncompleteTransfer(IOError):
+    """The connection ended before the full body was received"""
+
+def _total_length(response):
+    """Total size of the remote file from Content-Range (206) or Content-Length (200)"""
+    content_range = response.headers.get('content-range', '')
+    m = re.match(r'bytes (\d+)-\d+/(\d+)', content_range)
+    if m:
+        return int(m.group(2))
+    length = response.headers.get('content-length')
+    return int(length) if length and length.isdigit() else None
+
+def _finalize_part(url, filepath, part_path, sha256, blob_store):
+    """Rename a complete ".part" into place and mark its manifest complete"""
+    os.replace(part_path, filepath)
+    manifest = load_manifest(filepath) or {'url': url}
+    manifest.update(content_length=os.path.getsize(filepath), sha256=sha256, complete=True)
+    save_manifest(filepath, manifest)
+    if blob_store:
+        blob_store.add(filepath, url, manifest)
+
+def _transfer_pdf(url, filepath, session, stats, blob_store):
+    """
+    Run one conditional / resumable GET for download_pdf.
+    Errors before the body arrives have already been retried by rate_limiter and propagate as is;
+    a body cut off mid-stream raises IncompleteTransfer so that download_pdf resumes it.
+    """
+    part_path = filepath + '.part'
+    manifest = load_manifest(filepath)
+
+    headers = {}
+    resume_from = 0
+    have_file = os.path.exists(filepath)
+    if have_file and manifest and manifest.get('complete'):
+        # 本地文件完整时发送条件请求，未变化的说明书不传输任何正文
+        if manifest.get('content_length') in (None, os.path.getsize(filepath)):
+            if manifest.get('etag'):
+                headers['If-None-Match'] = manifest['etag']
+            if manifest.get('last_modified'):
+                headers['If-Modified-Since'] = manifest['last_modified']
+    elif os.path.exists(part_path) and manifest and not manifest.get('complete'):
+        part_size = os.path.getsize(part_path)
+        content_length = manifest.get('content_length')
+        if content_length is not None and part_size >= content_length:
+            # 正文已写完、改名前中断：大小一致则直接完成，再按完整文件发送条件请求；否则丢弃重新下载
+            if part_size == content_length:
+                _finalize_part(url, filepath, part_path, sha256_of_file(part_path).hexdigest(), blob_store)
+                print(f"Recovered completed download: {filepath}")
+                return _transfer_pdf(url, filepath, session, stats, blob_store)
+            os.remove(part_path)
+        else:
+            # 上次中断的下载：用Range续传，If-Range保证远端文件未变
+            validator = manifest.get('etag') or manifest.get('last_modified')
+            if validator:
+                resume_from = part_size
+                headers['Range'] = f'bytes={resume_from}-'
+                headers['If-Range'] = validator
+
+    # Download the file
+    response = rate_limiter.request(session, 'GET', url, headers=headers, stream=True, timeout=30)
+    if response.status_code == 304:
+        response.close()
+        print(f"File not modified, skip: {filepath}")
+        stats.add('skipped')
+        return filepath
+    if response.status_code == 416 and resume_from:
+        # .part已包含整个文件（清单中没有记录大小时）：大小与远端一致则完成，否则丢弃后不带Range重新下载
+        response.close()
+        m = re.match(r'bytes \*/(\d+)', response.headers.get('content-range', ''))
+        if m and int(m.group(1)) == resume_from:
+            _finalize_part(url, filepath, part_path, sha256_of_file(part_path).hexdigest(), blob_store)
+            print(f"Recovered completed download: {filepath}")
+            stats.add('skipped')
+            return filepath
+        os.remove(part_path)
+        print(f"Range not satisfiable, restarting download: {filepath}")
+        return _transfer_pdf(url, filepath, session, stats, blob_store)
+    response.raise_for_status()
+
+    # Check if the response is a PDF
+    content_type = response.headers.get('content-type', '').lower()
+    if 'pdf' not in content_type:
+        print(f"Warning: URL {url} doesn't point to a PDF file")
+        response.close()
+        stats.add('failed')
+        return None
+
+    total_length = _total_length(response)
+    if have_file and manifest is None and total_length == os.path.getsize(filepath):
+        # 旧版本下载的文件没有清单：大小一致则直接补写清单，不再重新下载
+        response.close()
+        manifest = {
+            'url': url,
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+            'content_length': total_length,
+            'sha256': sha256_of_file(filepath).hexdigest(),
+            'complete': True,
+        }
+        save_manifest(filepath, manifest)
+        if blob_store:
+            blob_store.add(filepath, url, manifest)
+        print(f"File already exists, skip: {filepath}")
+        stats.add('skipped')
+        return filepath
+
+    hasher = hashlib.sha256()
+    if response.status_code == 206 and response.headers.get('content-range', '').startswith(f'bytes {resume_from}-'):
+        sha256_of_file(part_path, hasher)
+        mode = 'ab'
+        print(f"Resuming download at byte {resume_from}: {filepath}")
+    else:
+        mode = 'wb'
+    save_manifest(filepath, {
+        'url': url,
+        'etag': response.headers.get('etag'),
+        'last_modified': response.headers.get('last-modified'),
+        'content_length': total_length,
+        'sha256': None,
+        'complete': False,
+    })
+
+    # Save the file
+    nbytes = 0
+    try:
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=65536):
+                if chunk:
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    nbytes += len(chunk)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        # 读取正文时超时/断开（requests把读超时报告为ConnectionError）
+        raise IncompleteTransfer(f"transfer interrupted after {nbytes} bytes: {e}") from e
+    size = os.path.getsize(part_path)
+    if total_length is not None and size != total_length:
+        raise IncompleteTransfer(f"incomplete transfer: got {size} of {total_length} bytes")
+    _finalize_part(url, filepath, part_path, hasher.hexdigest(), blob_store)
+
+    print(f"Successfully downloaded: {filepath}")
+    print(f"PDF URL: {url}")
+    stats.add('downloaded', nbytes)
+    return filepath
+
+def download_pdf(url, output_dir='downloads', session=None, stats=None, blob_store=None):
     """
     Download a PDF file from a given URL and save it to the specified directory
-    Only download if the file does not already exist.
+    The body is streamed into "<file>.part" and renamed into place only when complete.
+    A sidecar "<file>.meta.json" keeps ETag, Last-Modified, Content-Length and sha256 so that
+    re-runs revalidate with If-None-Match/If-Modified-Since, and interrupted transfers resume
+    with a Range request.
+    Requests go through the shared rate limiter (per-host rate, adaptive concurrency, Retry-After);
+    connection errors are retried there only; a transfer cut off mid-stream is retried here and
+    resumes from the ".part" file.
+    With a blob store, files are kept once per sha256 and linked into output_dir. A URL whose
+    content is already in the store is linked first and then revalidated with the stored
+    ETag/Last-Modified, so its body is only transferred again when it changed upstream.
 
     Args:
         url (str): URL of the PDF file to download
         output_dir (str): Directory to save the downloaded file
+        session (requests.Session): Shared session to reuse connections (optional)
+        stats (DownloadStats): Collects downloaded bytes for throughput reporting (optional)
+        blob_store (BlobStore): Content-addressed store shared by all car folders (optional)
         
     Returns:
         str: Path to the downloaded file if successful, None otherwise
     """
+    if stats is None:
+        stats = DownloadStats()
     if not is_valid_url(url):
         print(f"Error: Invalid URL: {url}")
+        stats.add('failed')
         return None
         
     try:
@@ -37,92 +281,158 @@ def download_pdf(url, output_dir='downloads'):
         # Get the filename from URL
         filename = get_filename_from_url(url)
         filepath = os.path.join(output_dir, filename)
-        # 新增：如果文件已存在则跳过下载
-        if os.path.exists(filepath):
-            print(f"File already exists, skip: {filepath}")
-            return filepath
-
-        # Download the file
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
-        
-        # Check if the response is a PDF
-        content_type = response.headers.get('content-type', '').lower()
-        if 'pdf' not in content_type:
-            print(f"Warning: URL {url} doesn't point to a PDF file")
-            return None
-        
-        # Save the file
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    
-        print(f"Successfully downloaded: {filepath}")
-        print(f"PDF URL: {url}")
-        return filepath
+        known = blob_store.lookup_url(url) if blob_store else None
+        if known:
+            # 该URL的内容已在仓库中（例如多个车型共用的说明书）：先链接，再用仓库记录的ETag/Last-Modified
+            # 发送条件请求，304时不传输正文，说明书改版（200）时照常下载并收入仓库
+            blob_store.link(known['sha256'], filepath)
+            save_manifest(filepath, dict(known, url=url, complete=True))
+        scheduler = rate_limiter.get_scheduler()
+        for attempt in range(scheduler.max_retries + 1):
+            try:
+                return _transfer_pdf(url, filepath, session, stats, blob_store)
+            except (requests.exceptions.ChunkedEncodingError, IncompleteTransfer) as e:
+                # 正文传输中断：.part和清单已保存，重试时用Range从断点续传。
+                # 连接失败等请求阶段的错误已由rate_limiter重试过，这里不再重试
+                if attempt == scheduler.max_retries:
+                    raise
+                print(f"Transfer interrupted ({e}), resuming: {url}")
+                scheduler.host(url).on_failure()
+                scheduler.sleep_before_retry(url, attempt)
         
     except Exception as e:
         print(f"Error downloading {url}: {str(e)}")
+        stats.add('failed')
         return None
 
-def parse_vehicle_specs_from_html(html, base_url, output_dir='downloads'):
+def iter_pdf_downloads(tasks, workers=1, per_host=4, session=None, blob_store=None, stats=None):
+    """
+    并发下载多个PDF，按完成顺序逐个产出结果，便于下游边下载边处理。
+    所有线程共享一个keep-alive会话，并限制每个主机的并发连接数。
+    Args:
+        tasks (list): [(car_name, pdf_url, output_dir), ...]
+        workers (int): 下载线程数
+        per_host (int): 每个主机的最大并发下载数
+        session (requests.Session): 共享会话，不传则新建
+        blob_store (BlobStore): 按内容去重的PDF仓库（可选）
+        stats (DownloadStats): 下载统计（可选）
+    Yields:
+        tuple: (task在tasks中的序号, (car_name, pdf_url, saved_path))
+    """
+    workers = max(1, workers)
+    per_host = max(1, per_host)
+    session = session or create_session(pool_size=max(workers, per_host))
+    stats = stats or DownloadStats()
+    host_limits = {}
+    host_lock = threading.Lock()
+
+    def host_semaphore(url):
+        host = urlparse(url).netloc
+        with host_lock:
+            if host not in host_limits:
+                host_limits[host] = threading.BoundedSemaphore(per_host)
+            return host_limits[host]
+
+    def run(task):
+        car_name, pdf_url, car_dir = task
+        with host_semaphore(pdf_url), metrics.timer('download.pdf', url=pdf_url) as m:
+            saved_path = download_pdf(pdf_url, car_dir, session=session, stats=stats, blob_store=blob_store)
+            m['status'] = 'ok' if saved_path else 'failed'
+            m['bytes'] = os.path.getsize(saved_path) if saved_path else 0
+        return car_name, pdf_url, saved_path
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run, task): i for i, task in enumerate(tasks)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def download_pdfs_concurrently(tasks, workers=1, per_host=4, session=None, blob_store=None):
+    """
+    并发下载多个PDF，结束时报告总吞吐量。
+    Args:
+        tasks (list): [(car_name, pdf_url, output_dir), ...]
+        workers (int): 下载线程数
+        per_host (int): 每个主机的最大并发下载数
+        session (requests.Session): 共享会话，不传则新建
+        blob_store (BlobStore): 按内容去重的PDF仓库（可选）
+    Returns:
+        list: [(car_name, pdf_url, saved_path), ...]，顺序与tasks一致
+    """
+    stats = DownloadStats()
+    results = [None] * len(tasks)
+    for i, result in iter_pdf_downloads(tasks, workers, per_host, session, blob_store, stats):
+        results[i] = result
+    stats.report()
+    return results
+
+def parse_vehicle_specs_from_html(html, base_url, output_dir='downloads', workers=1, per_host=4, blob_store=None):
     """
     解析HTML，提取车辆名和PDF链接并下载PDF。
     Args:
         html (str): 包含车辆信息的HTML内容
         base_url (str): 用于拼接PDF完整URL的基础URL
         output_dir (str): PDF保存目录
+        workers (int): 并发下载线程数
+        per_host (int): 每个主机的最大并发下载数
+        blob_store (BlobStore): 按内容去重的PDF仓库（可选）
     Returns:
         list: [(car_name, pdf_url, saved_path), ...]
     """
-    soup = BeautifulSoup(html, 'html.parser')
-    results = []
-    for li in soup.find_all('li'):
-        name_div = li.find('div', class_='name')
-        if not name_div:
+    tasks = []
+    for entry in iter_listing_entries(html):
+        car_name = entry['car_name']
+        if car_name is None:
             continue
-        car_name = name_div.get_text(strip=True)
-        pdf_a = li.find('a', href=True, class_='thumb_cell')
-        if not pdf_a:
-            # 兼容catalog_link下的主链接
-            pdf_a = li.select_one('div.catalog_link a.main[href$=".pdf"]')
-        if not pdf_a:
+        # 兼容catalog_link下的主链接
+        pdf_href = entry['thumb_link'] or entry['catalog_link']
+        if not pdf_href:
             continue
-        pdf_url = urljoin(base_url, pdf_a['href'])
-        # 下载PDF，文件名用“车辆名_原始文件名”
-        filename = f"{car_name}_{get_filename_from_url(pdf_url)}"
-        filepath = os.path.join(output_dir, filename)
-        saved_path = download_pdf(pdf_url, output_dir)
-        results.append((car_name, pdf_url, saved_path))
-    return results
+        pdf_url = urljoin(base_url, pdf_href)
+        tasks.append((car_name, pdf_url, output_dir))
+    return download_pdfs_concurrently(tasks, workers, per_host, blob_store=blob_store)
 
-def download_pdfs_by_pattern_from_url(page_url, pattern, output_dir='downloads'):
+def collect_pdf_tasks_from_url(page_url, pattern, output_dir='downloads', session=None):
     """
-    从指定网页下载所有匹配pattern的PDF文件，并提取对应的车辆名。
+    解析网页中所有匹配pattern的PDF链接及对应的车辆名，生成下载任务。
     Args:
         page_url (str): 网页URL
         pattern (str): PDF链接的正则表达式
         output_dir (str): 保存目录
+        session (requests.Session): 共享会话（可选）
     Returns:
-        list: [(car_name, pdf_url, saved_path), ...]
+        list: [(car_name, pdf_url, car_dir), ...]
     """
-    resp = requests.get(page_url, timeout=30)
+    resp = http_cache.fetch(page_url, session)
     resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, 'html.parser')
-    results = []
-    for li in soup.find_all('li'):
-        name_div = li.find('div', class_='name')
-        car_name = name_div.get_text(strip=True) if name_div else 'unknown'
-        for a in li.find_all('a', href=True):
-            href = a['href']
-            if re.match(pattern, href):
+    regex = re.compile(pattern)
+    tasks = []
+    for entry in iter_listing_entries(resp.text):
+        car_name = entry['car_name'] if entry['car_name'] is not None else 'unknown'
+        for href in entry['links']:
+            if regex.match(href):
                 pdf_url = urljoin(page_url, href)
                 # 保存到以车辆名为名的子目录
                 car_dir = os.path.join(output_dir, car_name)
-                saved_path = download_pdf(pdf_url, car_dir)
-                results.append((car_name, pdf_url, saved_path))
-    return results
+                tasks.append((car_name, pdf_url, car_dir))
+    return tasks
+
+def download_pdfs_by_pattern_from_url(page_url, pattern, output_dir='downloads', workers=1, per_host=4,
+                                      blob_store=None):
+    """
+    从指定网页下载所有匹配pattern的PDF文件，并提取对应的车辆名。
+    Args:
+        page_url (str): 网页URL
+        pattern (str): PDF链接的正则表达式
+        output_dir (str): 保存目录
+        workers (int): 并发下载线程数
+        per_host (int): 每个主机的最大并发下载数
+        blob_store (BlobStore): 按内容去重的PDF仓库（可选）
+    Returns:
+        list: [(car_name, pdf_url, saved_path), ...]
+    """
+    session = create_session(pool_size=max(workers, per_host))
+    tasks = collect_pdf_tasks_from_url(page_url, pattern, output_dir, session)
+    return download_pdfs_concurrently(tasks, workers, per_host, session=session, blob_store=blob_store)
 
 def main():
     import argparse
@@ -132,13 +442,31 @@ def main():
     parser.add_argument('--base-url', help='拼接PDF链接的基础URL')
     parser.add_argument('--pattern', help='PDF链接的正则表达式')
     parser.add_argument('--output-dir', default='downloads', help='保存目录')
+    parser.add_argument('--workers', type=int, default=1, help='并发下载线程数')
+    parser.add_argument('--per-host', type=int, default=4, help='每个主机的最大并发下载数')
+    parser.add_argument('--blob-store', help='按内容sha256去重的PDF仓库目录，车辆目录下的文件为指向仓库的链接')
+    http_cache.add_cache_arguments(parser)
+    rate_limiter.add_scheduler_arguments(parser)
+    metrics.add_metrics_arguments(parser)
     args = parser.parse_args()
+    http_cache.configure_from_args(args)
+    rate_limiter.configure_from_args(args)
+    metrics.configure_from_args(args)
+    blob_store = BlobStore(args.blob_store) if args.blob_store else None
+    try:
+        download_from_args(args, blob_store)
+    finally:
+        if blob_store is not None:
+            blob_store.close()
 
+def download_from_args(args, blob_store=None):
+    """按命令行参数下载：列表页+pattern、本地HTML或单个PDF URL"""
     ##args.url = 'https://xxx/request/webcatalog/welcab/'
     ##args.pattern = '^/pages/contents/request/webcatalog/.+\\.pdf$'
     ##args.output_dir = '/Volumes/Seagate/work/robot/webcatalog/catalogs'
     if args.pattern and args.url:
-        results = download_pdfs_by_pattern_from_url(args.url, args.pattern, args.output_dir)
+        results = download_pdfs_by_pattern_from_url(args.url, args.pattern, args.output_dir,
+                                                    args.workers, args.per_host, blob_store)
         for car_name, pdf_url, saved_path in results:
             print(f"{car_name}: {pdf_url} => {saved_path}")
         return
@@ -148,11 +476,12 @@ def main():
         if not args.base_url:
             print('Error: 解析HTML时必须提供--base-url')
             return
-        results = parse_vehicle_specs_from_html(html, args.base_url, args.output_dir)
+        results = parse_vehicle_specs_from_html(html, args.base_url, args.output_dir,
+                                                args.workers, args.per_host, blob_store)
         for car_name, pdf_url, saved_path in results:
             print(f"{car_name}: {pdf_url} => {saved_path}")
     elif args.url:
-        download_pdf(args.url, args.output_dir)
+        download_pdf(args.url, args.output_dir, blob_store=blob_store)
     else:
         print('请提供--url或--html-file参数')
 
@@ -160,3 +489,5 @@ if __name__ == "__main__":
     '''
     python download_vehicle_specs.py --url https://toyota.jp/request/webcatalog/ --output-dir /Volumes/Seagate/work/robot/webcatalog/catalogs0728'''
     main()
+    rate_limiter.print_summary()
+    metrics.close()
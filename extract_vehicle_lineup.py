@@ -1,146 +1,159 @@
-import requests
-from bs4 import BeautifulSoup
 import re
 import os
+import csv
+import sys
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import http_cache
+import metrics
+import rate_limiter
+from download_vehicle_specs import create_session
+from html_parser import parse_html
+
+# 车辆页面、图片相对链接的站点根地址，可用--base-url换成测试站点
+BASE_URL = 'https://toyota.jp'
 
 car_map = {
     'ランドクルーザー 300': 'landcruiser300',
     'コペン GR SPORT': 'copen',
 }
 
-def extract_vehicle_lineup(url):
+def iter_vehicle_lineup(html, image_folder='', download_images=True, base_url=None):
     """
-    访问指定网站，提取所有车辆名称和专属页面URL pattern（car_code），并下载车辆图片到以车名命名的文件夹。
+    解析车辆列表HTML，逐个产出车辆名称和专属页面URL pattern（car_code），并下载车辆图片到以车名命名的文件夹。
+    URL和本地文件两种输入共用此函数。
     Args:
-        url (str): 车辆列表页面的URL
-    Returns:
-        list of dict: [{"car_name": str, "car_code": str}]
+        html (str): 车辆列表页面HTML
+        image_folder (str): 图片保存的根目录，图片保存在 image_folder/车名/ 下
+        download_images (bool): 是否立即逐个下载图片；为False时只记录img_url/img_path，可用download_car_images并发下载
+        base_url (str): 站点根地址，默认 BASE_URL
+    Yields:
+        dict: {"car_name": str, "car_code": str, "car_url": str, "img_url": str, "img_path": str}
     """
-    resp = requests.get(url, timeout=30)
-    resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, 'html.parser')
-    results = []
-    for dt in soup.find_all('dt', class_='tjp-car-detail-link__car-name'):
-        car_name = dt.get_text(strip=True)
-        parent = dt.parent
-        img = parent.find('img', alt=car_name)
+    base_url = (base_url or BASE_URL).rstrip('/')
+    # 查找所有车辆名称标签
+    for dt in parse_html(html).select('dt.tjp-car-detail-link__car-name'):
+        car_name = dt.text()
+        img = next((tag for tag in dt.parent.select('img[alt]') if tag.attr('alt') == car_name), None)
         car_code = None
         img_url = None
         car_url = None
-        if img and img.has_attr('src'):
-            m = re.search(r'/car/(\w+)/', img['src'])
+        img_filename = None
+        if img and img.attr('src') is not None:
+            m = re.search(r'/car/(\w+)/', img.attr('src'))
             if m:
                 car_code = m.group(1)
-            img_url = img['src']
+            img_url = img.attr('src')
             # 处理图片链接可能缺少协议的情况
             if img_url.startswith('//'):
                 img_url = 'https:' + img_url
             elif img_url.startswith('/'):
-                img_url = 'https://toyota.jp' + img_url
+                img_url = base_url + img_url
             # 生成车辆页面 URL
             if car_code:
-                car_url = f"https://toyota.jp/{car_code}"
+                car_url = f"{base_url}/{car_code}"
             # 下载图片
             if img_url:
-                folder = car_name
-                os.makedirs(folder, exist_ok=True)
+                folder = os.path.join(image_folder, car_name)
                 img_filename = os.path.join(folder, f"{car_code or car_name}.jpg")
+            if img_url and download_images:
+                os.makedirs(folder, exist_ok=True)
                 try:
-                    img_resp = requests.get(img_url, timeout=30)
-                    img_resp.raise_for_status()
+                    img_resp = fetch_with_retries(img_url)
                     with open(img_filename, 'wb') as f:
                         f.write(img_resp.content)
                 except Exception as e:
                     print(f"图片下载失败: {img_url}, 错误: {e}")
-        results.append({
+        yield {
             'car_name': car_name,
             'car_code': car_code,
-            'car_url': car_url
-        })
-    return results
+            'car_url': car_url,
+            'img_url': img_url,
+            'img_path': img_filename
+        }
 
-def extract_vehicle_lineup_from_file(html_file_path):
+def extract_vehicle_lineup(url, download_images=True, base_url=None):
+    """
+    访问指定网站，提取所有车辆名称和专属页面URL pattern（car_code），并下载车辆图片到以车名命名的文件夹。
+    Args:
+        url (str): 车辆列表页面的URL
+        download_images (bool): 是否立即逐个下载图片；为False时只记录img_url/img_path，可用download_car_images并发下载
+        base_url (str): 站点根地址，默认取列表页面URL的协议和主机
+    Returns:
+        list of dict: [{"car_name": str, "car_code": str, "car_url": str, "img_url": str, "img_path": str}]
+    """
+    resp = http_cache.fetch(url)
+    resp.raise_for_status()
+    if base_url is None:
+        parsed = urlparse(url)
+        base_url = f"{parsed.scheme}://{parsed.netloc}"
+    return list(iter_vehicle_lineup(resp.text, '', download_images, base_url))
+
+def extract_vehicle_lineup_from_file(html_file_path, download_images=True, base_url=None):
     """
     从本地HTML文件读取内容，提取所有车辆名称和专属页面URL pattern（car_code），并下载车辆图片到以车名命名的文件夹。
     Args:
         html_file_path (str): HTML文件路径
+        download_images (bool): 是否立即逐个下载图片；为False时只记录img_url/img_path，可用download_car_images并发下载
+        base_url (str): 站点根地址，默认 BASE_URL
     Returns:
-        list of dict: [{"car_name": str, "car_code": str}]
+        list of dict: [{"car_name": str, "car_code": str, "car_url": str, "img_url": str, "img_path": str}]
     """
     with open(html_file_path, 'r', encoding='utf-8') as f:
         html_content = f.read()
-    soup = BeautifulSoup(html_content, 'html.parser')
-    results = []
-    # 查找所有车辆名称标签
-    for dt in soup.find_all('dt', class_='tjp-car-detail-link__car-name'):
-        car_name = dt.get_text(strip=True)
-        parent = dt.parent
-        img = parent.find('img', alt=car_name)
-        car_code = None
-        img_url = None
-        car_url = None
-        if img and img.has_attr('src'):
-            m = re.search(r'/car/(\w+)/', img['src'])
-            if m:
-                car_code = m.group(1)
-            img_url = img['src']
-            # 处理图片链接可能缺少协议的情况
-            if img_url.startswith('//'):
-                img_url = 'https:' + img_url
-            elif img_url.startswith('/'):
-                img_url = 'https://toyota.jp' + img_url
-            # 生成车辆页面 URL
-            if car_code:
-                car_url = f"https://toyota.jp/{car_code}"
-            # 下载图片
-            if img_url:
-                folder = 'output/' + car_name
-                os.makedirs(folder, exist_ok=True)
-                img_filename = os.path.join(folder, f"{car_code or car_name}.jpg")
-                try:
-                    img_resp = requests.get(img_url, timeout=30)
-                    img_resp.raise_for_status()
-                    with open(img_filename, 'wb') as f:
-                        f.write(img_resp.content)
-                except Exception as e:
-                    print(f"图片下载失败: {img_url}, 错误: {e}")
-        results.append({
-            'car_name': car_name,
-            'car_code': car_code,
-            'car_url': car_url
-        })
-    return results
+    return list(iter_vehicle_lineup(html_content, 'output', download_images, base_url))
 
-def get_car_description(car_code, car_name=None):
+def fetch_with_retries(url, session=None, retries=3, timeout=30, use_cache=False):
+    """
+    GET请求，经由共享的限速器发送：按主机限速，遇到网络错误或429/5xx时带抖动退避重试（遵守Retry-After），最多retries次。
+    use_cache为True时经由共享的磁盘HTTP缓存获取（用于页面，不用于图片）。
+    Returns:
+        requests.Response 或 http_cache.CachedResponse
+    """
+    if use_cache:
+        resp = http_cache.fetch(url, session, timeout, max_retries=retries)
+    else:
+        resp = rate_limiter.request(session, 'GET', url, timeout=timeout, max_retries=retries)
+    resp.raise_for_status()
+    return resp
+
+def get_car_description(car_code, car_name=None, session=None, retries=3, base_url=None):
     """
     根据 car_code 拼接 URL，访问页面并提取车辆描述。
+    页面不存在或请求失败时，按 car_map 换用映射的 car_code 再试一次。
     Args:
         car_code (str): 车辆代码
         car_name (str): 车辆名称（用于 car_map 兜底）
+        session (requests.Session): 共享会话（可选）
+        retries (int): 每个URL的最大重试次数
+        base_url (str): 站点根地址，默认 BASE_URL
     Returns:
         dict: {"description": str, "not_found": bool}
     """
-    url = f"https://toyota.jp/{car_code}"
-    try:
-        resp = requests.get(url, timeout=30)
-        resp.raise_for_status()
-        soup = BeautifulSoup(resp.text, 'html.parser')
+    candidates = [car_code]
+    if car_name and car_name in car_map and car_map[car_name] != car_code:
+        candidates.append(car_map[car_name])
+    for code in candidates:
+        url = f"{(base_url or BASE_URL).rstrip('/')}/{code}"
+        try:
+            resp = fetch_with_retries(url, session, retries, use_cache=True)
+        except Exception:
+            continue
         # 检查是否为错误页面
         if "大変申し訳ありませんが、該当ページがございません。" in resp.text:
-            if car_name and car_name in car_map:
-                mapped_code = car_map[car_name]
-                if mapped_code != car_code:
-                    return get_car_description(mapped_code, car_name)
-            return {"description": None, "not_found": True, "video_url": None, "video_id": None, "video_not_found": True}
-        p_tag = soup.find('p', class_='tjp-text tjp-text--size-m-s tjp-text--normal')
-        description = p_tag.get_text(strip=True) if p_tag else None
+            continue
+        doc = parse_html(resp.text)
+        p_tag = doc.select_one('p.tjp-text.tjp-text--size-m-s.tjp-text--normal')
+        description = p_tag.text() if p_tag else None
         # 查找介绍视频链接
         video_url = None
         video_id = None
         video_not_found = 'NotExist'
         # 查找所有 a 和 iframe 标签
-        for tag in soup.find_all(['a', 'iframe']):
-            href = tag.get('href') or tag.get('src')
+        for tag in doc.select('a, iframe'):
+            href = tag.attr('href') or tag.attr('src')
             if href and 'youtube.com/embed/' in href:
                 m = re.search(r'youtube\.com/embed/([\w-]+)', href)
                 if m:
@@ -161,34 +174,112 @@ def get_car_description(car_code, car_name=None):
             "video_id": video_id,
             "video_not_found": video_not_found
         }
-    except Exception as e:
-        if car_name and car_name in car_map:
-            mapped_code = car_map[car_name]
-            if mapped_code != car_code:
-                return get_car_description(mapped_code, car_name)
-        return {"description": None, "not_found": True, "video_url": None, "video_id": None, "video_not_found": True}
+    return {"description": None, "not_found": True, "video_url": None, "video_id": None, "video_not_found": True}
+
+def download_car_images(items, workers=8, session=None, retries=3):
+    """
+    并发下载extract_*(download_images=False)返回的车辆图片。
+    Args:
+        items (list): 包含img_url、img_path的车辆信息
+        workers (int): 并发线程数
+        session (requests.Session): 共享会话（可选）
+        retries (int): 最大重试次数
+    """
+    session = session or create_session(pool_size=workers)
+
+    def download(item):
+        img_url, img_filename = item.get('img_url'), item.get('img_path')
+        if not img_url or not img_filename:
+            return
+        try:
+            img_resp = fetch_with_retries(img_url, session, retries)
+            os.makedirs(os.path.dirname(img_filename) or '.', exist_ok=True)
+            with open(img_filename, 'wb') as f:
+                f.write(img_resp.content)
+        except Exception as e:
+            print(f"图片下载失败: {img_url}, 错误: {e}", file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(download, items))
+
+def fetch_car_descriptions(items, workers=8, session=None, retries=3, base_url=None):
+    """
+    并发获取车辆描述，结果顺序与items一致。
+    Returns:
+        list of dict: 每个车辆信息合并了get_car_description的结果
+    """
+    session = session or create_session(pool_size=workers)
+
+    def fetch(item):
+        return dict(item, **get_car_description(item['car_code'], item['car_name'], session, retries, base_url))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(fetch, items))
+
+LINEUP_FIELDS = ['car_name', 'car_code', 'car_url', 'img_url', 'img_path',
+                 'description', 'not_found', 'video_url', 'video_id', 'video_not_found']
+
+def write_lineup_records(records, output=None, fmt='jsonl'):
+    """
+    把车辆信息按原始顺序写为JSONL或CSV。
+    Args:
+        records (list): fetch_car_descriptions的结果
+        output (str): 输出文件路径，不传则写到标准输出
+        fmt (str): jsonl 或 csv
+    """
+    f = open(output, 'w', newline='', encoding='utf-8') if output else sys.stdout
+    try:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, fieldnames=LINEUP_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    finally:
+        if output:
+            f.close()
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description='Extract vehicle lineup info from HTML file')
-    parser.add_argument('--file', required=False, help='HTML文件路径')
+    parser.add_argument('--file', default='/Volumes/Seagate/work/robot/webcatalog/toyota_lineup.txt', help='HTML文件路径')
+    parser.add_argument('--workers', type=int, default=8, help='并发请求数')
+    parser.add_argument('--retries', type=int, default=3, help='每个请求的最大重试次数')
+    parser.add_argument('--format', choices=['text', 'jsonl', 'csv'], default='text', help='输出格式')
+    parser.add_argument('--output', help='jsonl/csv输出文件，不指定则输出到标准输出')
+    parser.add_argument('--base-url', default=BASE_URL, help=f'车辆页面和图片相对链接的站点根地址，默认 {BASE_URL}')
+    http_cache.add_cache_arguments(parser)
+    rate_limiter.add_scheduler_arguments(parser)
+    metrics.add_metrics_arguments(parser)
     args = parser.parse_args()
-    args.file = '/Volumes/Seagate/work/robot/webcatalog/toyota_lineup.txt'
-    lineup = extract_vehicle_lineup_from_file(args.file)
+    http_cache.configure_from_args(args)
+    rate_limiter.configure_from_args(args)
+    metrics.configure_from_args(args)
+    session = create_session(pool_size=args.workers)
+    with open(args.file, 'r', encoding='utf-8') as f:
+        html_content = f.read()
     # 去重 car_name 和 car_code
     unique = []
     seen = set()
-    for item in lineup:
+    for item in iter_vehicle_lineup(html_content, 'output', download_images=False, base_url=args.base_url):
         key = (item['car_name'], item['car_code'])
         if key not in seen:
             unique.append(item)
             seen.add(key)
-    for idx, item in enumerate(unique, 1):
-        print(f"{idx}. {item['car_name']}: {item['car_code']}")
-        print(f"    页面: {item.get('car_url')}")
-        desc_info = get_car_description(item['car_code'], item['car_name'])
-        print(f"    描述: {desc_info['description']}")
-        print(f"    页面不存在: {desc_info['not_found']}")
-        print(f"    视频链接: {desc_info['video_url']}")
-        print(f"    视频ID: {desc_info['video_id']}")
-        print(f"    视频不存在: {desc_info['video_not_found']}")
+    download_car_images(unique, args.workers, session, args.retries)
+    records = fetch_car_descriptions(unique, args.workers, session, args.retries, args.base_url)
+    if args.format != 'text':
+        write_lineup_records(records, args.output, args.format)
+    else:
+        for idx, item in enumerate(records, 1):
+            print(f"{idx}. {item['car_name']}: {item['car_code']}")
+            print(f"    页面: {item.get('car_url')}")
+            print(f"    描述: {item['description']}")
+            print(f"    页面不存在: {item['not_found']}")
+            print(f"    视频链接: {item['video_url']}")
+            print(f"    视频ID: {item['video_id']}")
+            print(f"    视频不存在: {item['video_not_found']}")
+    metrics.emit('lineup.summary', cars=len(records), not_found=sum(1 for r in records if r['not_found']))
+    rate_limiter.print_summary(file=sys.stderr)
+    metrics.close()
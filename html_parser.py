@@ -0,0 +1,131 @@
+import os
+from functools import lru_cache
+
+# 优先使用C实现的解析器：selectolax(lexbor) > lxml > BeautifulSoup(html.parser)
+BACKENDS = ('selectolax', 'lxml', 'bs4')
+
+def available_backend(preferred=None):
+    """
+    返回可用的解析后端名称。
+    Args:
+        preferred (str): 指定后端，不传时读取环境变量 CARMODEL_HTML_PARSER，再按BACKENDS顺序选择已安装的
+    """
+    preferred = preferred or os.environ.get('CARMODEL_HTML_PARSER')
+    candidates = [preferred] if preferred else BACKENDS
+    for name in candidates:
+        try:
+            if name == 'selectolax':
+                import selectolax.lexbor  # noqa: F401
+            elif name == 'lxml':
+                import lxml.html  # noqa: F401
+                import cssselect  # noqa: F401
+            elif name == 'bs4':
+                import bs4  # noqa: F401
+            else:
+                raise ValueError(f"未知的HTML解析后端: {name}")
+            return name
+        except ImportError:
+            if preferred:
+                raise
+    raise ImportError('没有可用的HTML解析后端，请安装 selectolax、lxml+cssselect 或 beautifulsoup4')
+
+class Node:
+    """不同解析后端的统一节点接口：select/select_one/text/attr/parent"""
+
+    def __init__(self, backend, node):
+        self.backend = backend
+        self.node = node
+
+    def select(self, css):
+        return [Node(self.backend, n) for n in _select(self.backend, self.node, css)]
+
+    def select_one(self, css):
+        for n in _select(self.backend, self.node, css):
+            return Node(self.backend, n)
+        return None
+
+    def text(self):
+        """等同于BeautifulSoup的get_text(strip=True)"""
+        if self.backend == 'selectolax':
+            return self.node.text(strip=True)
+        if self.backend == 'lxml':
+            return ''.join(s.strip() for s in self.node.itertext())
+        return self.node.get_text(strip=True)
+
+    def attr(self, name, default=None):
+        if self.backend == 'selectolax':
+            attributes = self.node.attributes
+            value = attributes.get(name)
+            if value is None and name in attributes:
+                value = ''  # 没有值的属性（如<a href>），与lxml/bs4一致返回空字符串
+        else:
+            value = self.node.get(name)
+        if isinstance(value, list):  # bs4把class等多值属性解析为列表
+            value = ' '.join(value)
+        return default if value is None else value
+
+    @property
+    def parent(self):
+        if self.backend == 'selectolax':
+            parent = self.node.parent
+        elif self.backend == 'lxml':
+            parent = self.node.getparent()
+        else:
+            parent = self.node.parent
+        return Node(self.backend, parent) if parent is not None else None
+
+@lru_cache(maxsize=None)
+def _compiled(backend, css):
+    """预编译CSS选择器，每个选择器在进程内只编译一次"""
+    if backend == 'lxml':
+        from lxml.cssselect import CSSSelector
+        return CSSSelector(css)
+    if backend == 'bs4':
+        import soupsieve
+        return soupsieve.compile(css)
+    return css  # selectolax(lexbor)内部缓存选择器
+
+def _select(backend, node, css):
+    selector = _compiled(backend, css)
+    if backend == 'selectolax':
+        return node.css(selector)
+    if backend == 'lxml':
+        return selector(node)
+    return selector.select(node)
+
+def parse_html(html, backend=None):
+    """
+    解析HTML文本，返回根节点。
+    Args:
+        html (str): HTML文本
+        backend (str): selectolax / lxml / bs4，默认自动选择最快的可用后端
+    Returns:
+        Node
+    """
+    backend = available_backend(backend)
+    if backend == 'selectolax':
+        from selectolax.lexbor import LexborHTMLParser
+        return Node(backend, LexborHTMLParser(html).root)
+    if backend == 'lxml':
+        import lxml.html
+        return Node(backend, lxml.html.document_fromstring(html))
+    from bs4 import BeautifulSoup
+    return Node(backend, BeautifulSoup(html, 'html.parser'))
+
+def iter_listing_entries(html, backend=None):
+    """
+    解析说明书列表页中的每个<li>。
+    Yields:
+        dict: {"car_name": str或None, "links": [href, ...], "thumb_link": href或None, "catalog_link": href或None}
+            thumb_link 为 a.thumb_cell，catalog_link 为 div.catalog_link 下指向PDF的主链接
+    """
+    for li in parse_html(html, backend).select('li'):
+        name_div = li.select_one('div.name')
+        thumb = li.select_one('a.thumb_cell[href]')
+        catalog = li.select_one('div.catalog_link a.main[href$=".pdf"]')
+        yield {
+            'car_name': name_div.text() if name_div else None,
+            'links': [a.attr('href') for a in li.select('a[href]')],
+            'thumb_link': thumb.attr('href') if thumb else None,
+            'catalog_link': catalog.attr('href') if catalog else None,
+        }
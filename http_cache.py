@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+
+import rate_limiter
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'carmodel', 'http')
+
+class OfflineCacheMiss(requests.RequestException):
+    """离线模式下请求了缓存中没有的URL"""
+
+class CachedResponse:
+    """缓存的HTTP响应，提供与requests.Response相同的常用属性"""
+
+    def __init__(self, url, status_code, headers, content, encoding=None, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.content = content
+        self.encoding = encoding
+        self.from_cache = from_cache
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+class HttpCache:
+    """
+    以URL为键的磁盘HTTP缓存，供所有脚本抓取列表页和详情页时共用。
+    - ttl秒内直接返回缓存；过期后带If-None-Match/If-Modified-Since重新验证，304时沿用缓存
+    - 缓存总大小超过max_bytes时按最近访问时间淘汰
+    - offline模式只回放缓存，不发出任何请求
+    """
+
+    def __init__(self, cache_dir=None, ttl=0, max_bytes=512 * 1024 * 1024, offline=False):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        folder = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(folder, key + '.body'), os.path.join(folder, key + '.json')
+
+    def _load(self, url):
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return None, None
+        # 更新访问时间，供LRU淘汰使用
+        try:
+            os.utime(body_path)
+        except OSError:
+            pass
+        return meta, content
+
+    def _write_atomic(self, path, data):
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _store(self, url, resp):
+        body_path, meta_path = self._paths(url)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        old_size = os.path.getsize(body_path) if os.path.exists(body_path) else 0
+        meta = {
+            'url': url,
+            'status_code': resp.status_code,
+            'headers': dict(resp.headers),
+            'encoding': resp.encoding,
+            'etag': resp.headers.get('etag'),
+            'last_modified': resp.headers.get('last-modified'),
+            'stored_at': time.time(),
+        }
+        self._write_atomic(body_path, resp.content)
+        self._write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(resp.content) - old_size
+        self.evict()
+        return meta
+
+    def _touch_meta(self, url, meta):
+        _, meta_path = self._paths(url)
+        meta['stored_at'] = time.time()
+        self._write_atomic(meta_path, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def evict(self):
+        """缓存超过max_bytes时，按最近访问时间从旧到新删除"""
+        with self._lock:
+            if self._total_bytes is not None and self._total_bytes <= self.max_bytes:
+                return
+            entries = []
+            for root, dirs, files in os.walk(self.cache_dir):
+                for f in files:
+                    if f.endswith('.body'):
+                        path = os.path.join(root, f)
+                        try:
+                            st = os.stat(path)
+                        except OSError:
+                            continue
+                        entries.append((st.st_mtime, st.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                for victim in (path, path[:-len('.body')] + '.json'):
+                    try:
+                        os.remove(victim)
+                    except OSError:
+                        pass
+                total -= size
+            self._total_bytes = total
+
+    def get(self, url, session=None, timeout=30, max_retries=None):
+        """
+        取得URL的响应，优先使用缓存。未命中或需重新验证时通过全局限速器发送请求。
+        Args:
+            max_retries (int): 覆盖限速器的默认重试次数（可选）
+        Returns:
+            CachedResponse
+        """
+        meta, content = self._load(url)
+        cached = None
+        if meta is not None:
+            cached = CachedResponse(url, meta['status_code'], meta['headers'], content, meta.get('encoding'), True)
+            if self.offline or time.time() - meta['stored_at'] < self.ttl:
+                return cached
+        if self.offline:
+            raise OfflineCacheMiss(f"离线模式下缓存中没有: {url}")
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        resp = rate_limiter.request(session, 'GET', url, headers=headers, timeout=timeout, max_retries=max_retries)
+        if resp.status_code == 304 and cached is not None:
+            self._touch_meta(url, meta)
+            return cached
+        if resp.status_code == 200:
+            self._store(url, resp)
+        return CachedResponse(url, resp.status_code, resp.headers, resp.content, resp.encoding)
+
+_default_cache = HttpCache(
+    cache_dir=os.environ.get('CARMODEL_HTTP_CACHE') or None,
+    ttl=float(os.environ.get('CARMODEL_HTTP_CACHE_TTL', '0')),
+    offline=os.environ.get('CARMODEL_OFFLINE') == '1',
+)
+
+def configure(cache_dir=None, ttl=None, max_bytes=None, offline=None):
+    """修改全局缓存的设置，未传的参数保持不变"""
+    if cache_dir is not None:
+        _default_cache.cache_dir = cache_dir
+        _default_cache._total_bytes = None
+    if ttl is not None:
+        _default_cache.ttl = ttl
+    if max_bytes is not None:
+        _default_cache.max_bytes = max_bytes
+    if offline is not None:
+        _default_cache.offline = offline
+
+def fetch(url, session=None, timeout=30, max_retries=None):
+    """通过全局缓存获取页面"""
+    return _default_cache.get(url, session, timeout, max_retries)
+
+def add_cache_arguments(parser):
+    """给命令行加上缓存相关参数"""
+    parser.add_argument('--cache-dir', help=f'HTTP缓存目录，默认 {DEFAULT_CACHE_DIR}')
+    parser.add_argument('--cache-ttl', type=float, help='缓存有效期（秒），过期后用ETag/Last-Modified重新验证，默认0')
+    parser.add_argument('--cache-max-mb', type=int, help='缓存大小上限（MB），超过后按最近访问时间淘汰')
+    parser.add_argument('--offline', action='store_true', default=None, help='离线模式：只回放缓存的页面')
+
+def configure_from_args(args):
+    configure(args.cache_dir, args.cache_ttl,
+              args.cache_max_mb * 1024 * 1024 if args.cache_max_mb else None, args.offline)
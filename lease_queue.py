@@ -0,0 +1,301 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+
+def make_job_key(sha256, options_key):
+    """任务在队列中的标识：PDF内容sha256 + 转换参数的摘要"""
+    return f"{sha256}_{hashlib.sha1(options_key.encode('utf-8')).hexdigest()[:8]}"
+
+def default_node_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def _write_json_atomic(path, data):
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def _fs_now(clock_path):
+    """共享文件系统的当前时间：更新时钟文件后读取其mtime，不受本机时钟偏差影响"""
+    with open(clock_path, 'a'):
+        pass
+    os.utime(clock_path)
+    return os.stat(clock_path).st_mtime
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+class LeaseQueue:
+    """
+    只依赖共享文件系统的分布式任务队列，多台机器挂载同一目录即可分担转换。
+    queue_dir/
+        leases/<key>.lease  租约：O_EXCL原子创建，持有期间由心跳线程定期更新mtime
+        done/<key>.json     完成标记：done写入后任何节点都不再领取；failed记录失败次数，未达到max_attempts时仍会重新领取
+        nodes/<node>.json   每个节点的状态，结束时合并
+    租约超过lease_ttl秒没有心跳即视为节点已崩溃，其他节点通过rename抢占后重新领取。
+    时间一律取共享文件系统上的mtime，不受各机器时钟偏差影响。
+    """
+
+    def __init__(self, queue_dir, node_id=None, lease_ttl=600, max_attempts=3):
+        self.queue_dir = queue_dir
+        self.node_id = node_id or default_node_id()
+        self.lease_ttl = lease_ttl
+        self.max_attempts = max_attempts
+        self.lease_dir = os.path.join(queue_dir, 'leases')
+        self.done_dir = os.path.join(queue_dir, 'done')
+        self.node_dir = os.path.join(queue_dir, 'nodes')
+        for folder in (self.lease_dir, self.done_dir, self.node_dir):
+            os.makedirs(folder, exist_ok=True)
+        self._held = {}  # key -> token
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+        self.status = {
+            'node_id': self.node_id,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'started_at': time.time(),
+            'finished_at': None,
+            'jobs': {},  # key -> {"pdf_path", "status", "duration"}
+        }
+        self._save_status()
+
+    def _lease_path(self, key):
+        return os.path.join(self.lease_dir, key + '.lease')
+
+    def _done_path(self, key):
+        return os.path.join(self.done_dir, key + '.json')
+
+    def fs_now(self):
+        """共享文件系统的当前时间：更新本节点时钟文件后读取其mtime"""
+        return _fs_now(os.path.join(self.node_dir, self.node_id + '.clock'))
+
+    def is_done(self, key):
+        """任务是否不再需要领取：已成功，或失败次数达到max_attempts"""
+        marker = _read_json(self._done_path(key))
+        if marker is None:
+            return False
+        if marker.get('status') == 'failed':
+            return marker.get('attempts', 1) >= self.max_attempts
+        return True
+
+    def _create_lease(self, key, info):
+        token = uuid.uuid4().hex
+        try:
+            fd = os.open(self._lease_path(key), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(dict(info, node_id=self.node_id, token=token, acquired_at=time.time()), f, ensure_ascii=False)
+        return token
+
+    def _take_over_expired(self, key):
+        """
+        把已过期的租约改名移走；多个节点同时抢占时只有一个rename成功。
+        Returns:
+            bool: 是否移走了过期租约
+        """
+        path = self._lease_path(key)
+        try:
+            if self.fs_now() - os.stat(path).st_mtime <= self.lease_ttl:
+                return False
+            stale_path = f'{path}.stale.{uuid.uuid4().hex}'
+            os.rename(path, stale_path)
+        except FileNotFoundError:
+            return True  # 租约刚被释放，可以直接重新领取
+        # rename之前持有者可能刚好发出心跳：租约仍然有效时放回原处
+        if self.fs_now() - os.stat(stale_path).st_mtime <= self.lease_ttl:
+            try:
+                os.link(stale_path, path)
+            except OSError:
+                pass
+            os.remove(stale_path)
+            return False
+        lease = _read_json(stale_path) or {}
+        print(f"租约已过期，接管节点 {lease.get('node_id')} 的任务: {lease.get('pdf_path', key)}")
+        os.remove(stale_path)
+        return True
+
+    def acquire(self, key, info=None):
+        """
+        尝试领取任务。
+        Args:
+            key (str): 任务标识（make_job_key）
+            info (dict): 写入租约的附加信息，如pdf_path
+        Returns:
+            bool: 领取成功时为True；任务已完成、失败次数已达上限或被其他节点持有时为False
+        """
+        if self.is_done(key):
+            return False
+        token = self._create_lease(key, info or {})
+        if token is None:
+            if not self._take_over_expired(key):
+                return False
+            token = self._create_lease(key, info or {})
+            if token is None:
+                return False
+        # 其他节点可能在检查之后刚好完成并释放了租约
+        if self.is_done(key):
+            os.remove(self._lease_path(key))
+            return False
+        with self._lock:
+            self._held[key] = token
+        self._start_heartbeat()
+        return True
+
+    def holds(self, key):
+        """租约是否仍属于本节点"""
+        with self._lock:
+            token = self._held.get(key)
+        lease = _read_json(self._lease_path(key))
+        return token is not None and lease is not None and lease.get('token') == token
+
+    def _start_heartbeat(self):
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+            self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(max(1.0, self.lease_ttl / 3)):
+            with self._lock:
+                held = list(self._held)
+            for key in held:
+                if self.holds(key):
+                    try:
+                        os.utime(self._lease_path(key))
+                        continue
+                    except OSError:
+                        pass
+                print(f"警告: 租约已丢失（可能已被其他节点接管）: {key}")
+                with self._lock:
+                    self._held.pop(key, None)
+
+    def complete(self, key, status, pdf_path=None, duration=None, error=None):
+        """
+        写入完成标记并释放租约。done是最终状态；failed累计失败次数，
+        未达到max_attempts时之后的运行（任何节点）会重新领取，用于OOM、进程被杀等临时失败。
+        Args:
+            status (str): done 或 failed
+        """
+        if not self.holds(key):
+            print(f"警告: 租约已不属于本节点，不写入完成标记: {pdf_path or key}")
+        else:
+            previous = _read_json(self._done_path(key)) or {}
+            attempts = previous.get('attempts', 1) + 1 if previous.get('status') == 'failed' else 1
+            _write_json_atomic(self._done_path(key), {
+                'key': key,
+                'status': status,
+                'attempts': attempts,
+                'node_id': self.node_id,
+                'pdf_path': pdf_path,
+                'duration': duration,
+                'error': error,
+                'finished_at': time.time(),
+            })
+            try:
+                os.remove(self._lease_path(key))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._held.pop(key, None)
+        self.status['jobs'][key] = {'pdf_path': pdf_path, 'status': status, 'duration': duration}
+        self._save_status()
+
+    def release(self, key):
+        """放弃租约但不写完成标记，任务可被其他节点重新领取"""
+        if self.holds(key):
+            try:
+                os.remove(self._lease_path(key))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._held.pop(key, None)
+
+    def _save_status(self):
+        _write_json_atomic(os.path.join(self.node_dir, self.node_id + '.json'), self.status)
+
+    def close(self):
+        """停止心跳，释放仍持有的租约并记录结束时间"""
+        self._stop.set()
+        with self._lock:
+            held = list(self._held)
+        for key in held:
+            self.release(key)
+        self.status['finished_at'] = time.time()
+        self._save_status()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def merge_status(queue_dir, lease_ttl=600):
+    """
+    合并所有节点的状态和完成标记。
+    Returns:
+        dict: {"nodes": {node_id: {"done", "failed", "duration", "finished"}}, "done": int, "failed": int,
+               "leased": int, "expired": int}
+    """
+    nodes = {}
+    node_dir = os.path.join(queue_dir, 'nodes')
+    for name in sorted(os.listdir(node_dir)) if os.path.isdir(node_dir) else []:
+        if not name.endswith('.json'):
+            continue
+        status = _read_json(os.path.join(node_dir, name))
+        if not status:
+            continue
+        jobs = status.get('jobs', {}).values()
+        nodes[status['node_id']] = {
+            'done': sum(1 for job in jobs if job['status'] == 'done'),
+            'failed': sum(1 for job in jobs if job['status'] == 'failed'),
+            'duration': sum(job['duration'] or 0 for job in jobs),
+            'finished': status.get('finished_at') is not None,
+        }
+    merged = {'nodes': nodes, 'done': 0, 'failed': 0, 'leased': 0, 'expired': 0}
+    done_dir = os.path.join(queue_dir, 'done')
+    for name in os.listdir(done_dir) if os.path.isdir(done_dir) else []:
+        marker = _read_json(os.path.join(done_dir, name))
+        if marker and marker.get('status') in ('done', 'failed'):
+            merged[marker['status']] += 1
+    lease_dir = os.path.join(queue_dir, 'leases')
+    if os.path.isdir(node_dir):
+        # 与租约的mtime比较时同样使用共享文件系统的时间
+        now = _fs_now(os.path.join(node_dir, 'merge_status.clock'))
+    else:
+        now = time.time()
+    for name in os.listdir(lease_dir) if os.path.isdir(lease_dir) else []:
+        if name.endswith('.lease'):
+            try:
+                expired = now - os.stat(os.path.join(lease_dir, name)).st_mtime > lease_ttl
+            except OSError:
+                continue
+            merged['expired' if expired else 'leased'] += 1
+    return merged
+
+def print_merged_status(queue_dir, lease_ttl=600):
+    merged = merge_status(queue_dir, lease_ttl)
+    for node_id, row in sorted(merged['nodes'].items()):
+        state = '已结束' if row['finished'] else '运行中'
+        print(f"[{node_id}] {state}, 完成 {row['done']} 个, 失败 {row['failed']} 个, 转换耗时 {row['duration']:.1f}s")
+    print(f"队列合计: 完成 {merged['done']} 个, 失败 {merged['failed']} 个, "
+          f"转换中 {merged['leased']} 个, 租约过期 {merged['expired']} 个")
+
+if __name__ == '__main__':
+    '''
+    python lease_queue.py --queue-dir /mnt/catalogs/.marker_queue
+    '''
+    import argparse
+    parser = argparse.ArgumentParser(description='查看分布式转换队列的合并状态')
+    parser.add_argument('--queue-dir', required=True, help='共享队列目录')
+    parser.add_argument('--lease-ttl', type=int, default=600, help='租约超时秒数')
+    args = parser.parse_args()
+    print_merged_status(args.queue_dir, args.lease_ttl)
@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import hashlib
+
+def default_index_path(scan_folder):
+    """索引默认放在 ~/.cache/carmodel 下，避免写入（可能只读的）外接磁盘"""
+    key = hashlib.sha1(os.path.abspath(scan_folder).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.expanduser('~'), '.cache', 'carmodel', f'scan_index_{key}.json')
+
+class LocalFileIndex:
+    """
+    扫描目录的持久化文件名索引。
+    每个目录记录mtime和其中的文件/子目录名；刷新时目录mtime未变就直接复用缓存，
+    只需对每个目录stat一次，不必重新列出目录内容。
+    """
+
+    def __init__(self, scan_folder, index_path=None):
+        self.scan_folder = scan_folder
+        self.index_path = index_path or default_index_path(scan_folder)
+        self.dirs = {}  # 相对路径 -> {"mtime_ns", "files", "subdirs"}
+        self._match_cache = {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('scan_folder') == os.path.abspath(scan_folder):
+                self.dirs = data.get('dirs', {})
+        except (OSError, ValueError):
+            pass
+
+    def refresh(self):
+        """
+        按目录mtime增量刷新索引。
+        Returns:
+            int: 重新列出内容的目录数
+        """
+        dirs = {}
+        rescanned = 0
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            path = os.path.join(self.scan_folder, rel) if rel else self.scan_folder
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            cached = self.dirs.get(rel)
+            if cached is None or cached['mtime_ns'] != mtime_ns:
+                files, subdirs = [], []
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif entry.is_file():
+                            files.append(entry.name)
+                cached = {'mtime_ns': mtime_ns, 'files': files, 'subdirs': subdirs}
+                rescanned += 1
+            dirs[rel] = cached
+            stack.extend(os.path.join(rel, d) if rel else d for d in cached['subdirs'])
+        self.dirs = dirs
+        self._match_cache = {}
+        return rescanned
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'scan_folder': os.path.abspath(self.scan_folder), 'dirs': self.dirs}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def match(self, file_pattern):
+        """
+        找出文件名匹配的文件，并记录父文件夹名（车型名）。
+        同一会话中相同pattern的结果会被缓存。
+        Returns:
+            dict: {(car_name, file_name): full_path}
+        """
+        if file_pattern not in self._match_cache:
+            regex = re.compile(file_pattern)
+            local_file_map = {}
+            for rel, entry in self.dirs.items():
+                root = os.path.join(self.scan_folder, rel) if rel else self.scan_folder
+                folder_car_name = os.path.basename(root)
+                for f in entry['files']:
+                    if regex.search(f):
+                        local_file_map[(folder_car_name, f)] = os.path.join(root, f)
+            self._match_cache[file_pattern] = local_file_map
+        return self._match_cache[file_pattern]
+
+_indexes = {}
+
+def get_local_index(scan_folder, index_path=None):
+    """
+    取得scan_folder的索引，同一会话（进程）内只刷新一次，所有车型的检查共用。
+    """
+    key = os.path.abspath(scan_folder)
+    if key not in _indexes:
+        index = LocalFileIndex(scan_folder, index_path)
+        rescanned = index.refresh()
+        index.save()
+        print(f"本地文件索引: {len(index.dirs)} 个目录，重新列出 {rescanned} 个")
+        _indexes[key] = index
+    return _indexes[key]
@@ -0,0 +1,142 @@
+import os
+import time
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# 与 marker_single --output_format markdown --paginate_output --format_lines 相同的转换参数
+MARKER_OPTIONS = {
+    'output_format': 'markdown',
+    'paginate_output': True,
+    'format_lines': True,
+}
+
+_models = None
+
+def build_marker_cmd(pdf_path, output_dir, page_range=None):
+    """生成marker_single命令行"""
+    cmd = [
+        'marker_single',
+        pdf_path,
+        '--output_format', 'markdown',
+        '--output_dir', output_dir,
+        '--paginate_output',
+        '--format_lines'
+    ]
+    if page_range:
+        cmd += ['--page_range', page_range]
+    return cmd
+
+def convert_with_marker_single(pdf_path, output_dir, page_range=None):
+    """
+    运行一次marker_single子进程转换PDF。
+    Returns:
+        tuple: (该PDF的输出子目录, 转换耗时秒数)
+    """
+    started = time.monotonic()
+    cmd = build_marker_cmd(pdf_path, output_dir, page_range)
+    print(f"运行: {' '.join(cmd)}")
+    subprocess.run(cmd, check=True)
+    pdf_base = os.path.splitext(os.path.basename(pdf_path))[0]
+    return os.path.join(output_dir, pdf_base), time.monotonic() - started
+
+def _init_worker(threads):
+    """
+    子进程初始化：限制计算线程数后只加载一次marker的版面/OCR模型。
+    Args:
+        threads (int): 该worker可用的CPU线程数
+    """
+    global _models
+    # 必须在导入torch之前设置，否则OpenMP/MKL会按整机核数开线程，互相抢占
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    from marker.models import create_model_dict
+    _models = create_model_dict()
+    print(f"[worker {os.getpid()}] 模型已加载，线程数: {threads}", flush=True)
+
+def _convert(pdf_path, output_dir, page_range=None):
+    """
+    在worker中用已加载的模型转换一个PDF，输出布局与marker_single一致：
+    output_dir/<pdf名>/<pdf名>.md、<pdf名>_meta.json 及图片。
+    Args:
+        pdf_path (str): PDF路径
+        output_dir (str): 输出根目录
+        page_range (str): 页码范围，如 "0-9"（可选）
+    Returns:
+        tuple: (该PDF的输出子目录, 转换耗时秒数)
+    """
+    started = time.monotonic()
+    from marker.config.parser import ConfigParser
+    from marker.converters.pdf import PdfConverter
+    from marker.output import save_output
+    options = dict(MARKER_OPTIONS, output_dir=output_dir)
+    if page_range:
+        options['page_range'] = page_range
+    config_parser = ConfigParser(options)
+    converter = PdfConverter(
+        config=config_parser.generate_config_dict(),
+        artifact_dict=_models,
+        processor_list=config_parser.get_processors(),
+        renderer=config_parser.get_renderer(),
+        llm_service=config_parser.get_llm_service(),
+    )
+    rendered = converter(pdf_path)
+    out_folder = config_parser.get_output_folder(pdf_path)
+    save_output(rendered, out_folder, config_parser.get_base_filename(pdf_path))
+    return out_folder, time.monotonic() - started
+
+def default_threads_per_worker(workers):
+    """按CPU核数平均分配线程，保证所有核都被用上"""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+class MarkerWorkerPool:
+    """
+    常驻的marker转换进程池：每个worker启动时加载一次模型，之后从队列中持续领取PDF。
+    用法:
+        with MarkerWorkerPool(workers=4) as pool:
+            future = pool.submit(pdf_path, output_dir)
+    """
+
+    def __init__(self, workers, threads_per_worker=None):
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker or default_threads_per_worker(self.workers)
+        # spawn：避免fork带着已初始化的torch/CUDA状态进入子进程
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker,),
+        )
+
+    def submit(self, pdf_path, output_dir, page_range=None):
+        return self._executor.submit(_convert, pdf_path, output_dir, page_range)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+class MarkerSubprocessPool:
+    """与MarkerWorkerPool接口相同，但每个PDF单独运行一次marker_single"""
+
+    def __init__(self, workers=1):
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def submit(self, pdf_path, output_dir, page_range=None):
+        return self._executor.submit(convert_with_marker_single, pdf_path, output_dir, page_range)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,263 @@
+import os
+import csv
+import json
+import time
+import sqlite3
+import argparse
+
+DEFAULT_DB_PATH = 'matches.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS matches (
+    cartype TEXT NOT NULL,
+    car_name TEXT NOT NULL,
+    web_pdf_path TEXT NOT NULL,
+    local_pdf_path TEXT,
+    matched INTEGER NOT NULL,
+    listed INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    changed_at REAL NOT NULL,
+    run_id INTEGER NOT NULL,
+    PRIMARY KEY (cartype, car_name, web_pdf_path)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    targets TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    run_id INTEGER NOT NULL,
+    cartype TEXT NOT NULL,
+    car_name TEXT NOT NULL,
+    web_pdf_path TEXT NOT NULL,
+    change TEXT NOT NULL,
+    local_pdf_path TEXT,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_changes_run_id ON changes (run_id);
+'''
+
+# 变化类型
+CHANGE_LABELS = {
+    'new_matched': '新增(已下载)',
+    'new_missing': '新增(未下载)',
+    'now_matched': '新匹配',
+    'now_missing': '新缺失',
+    'moved': '本地路径变化',
+    'unlisted': '已从列表页移除',
+}
+
+CSV_COLUMNS = ['cartype', 'car_name', 'web_pdf_path', 'local_pdf_path', 'matched']
+
+class MatchStore:
+    """
+    网页PDF链接与本地文件匹配结果的SQLite存储，按 (cartype, car_name, web_pdf_path) 唯一，重复运行只更新不追加。
+    每次运行记录在runs中，状态发生变化的条目（新增、新匹配、新缺失、从列表页移除）记录在changes中。
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def begin_run(self, targets):
+        """
+        Args:
+            targets (list): [(url, cartype), ...]
+        Returns:
+            int: run_id
+        """
+        with self.conn:
+            cur = self.conn.execute('INSERT INTO runs (targets, started_at) VALUES (?, ?)',
+                                    (json.dumps(targets, ensure_ascii=False), time.time()))
+        return cur.lastrowid
+
+    def record_listing(self, run_id, cartype, entries):
+        """
+        写入一个列表页的匹配结果（同一事务），与上次的状态比较并记录变化。
+        Args:
+            run_id (int): begin_run返回的编号
+            cartype (str): 车型类别
+            entries (list): [(car_name, web_pdf_path, local_pdf_path或None), ...]
+        Returns:
+            list: 本次记录的变化，格式同changes()
+        """
+        now = time.time()
+        changes = []
+        seen = set()
+        with self.conn:
+            for car_name, web_pdf_path, local_pdf_path in entries:
+                key = (cartype, car_name, web_pdf_path)
+                if key in seen:
+                    continue  # 同一列表页中重复的链接
+                seen.add(key)
+                matched = 1 if local_pdf_path else 0
+                row = self.conn.execute('''
+                    SELECT matched, listed, local_pdf_path FROM matches
+                    WHERE cartype = ? AND car_name = ? AND web_pdf_path = ?
+                ''', key).fetchone()
+                if row is None or not row['listed']:
+                    change = 'new_matched' if matched else 'new_missing'
+                elif row['matched'] != matched:
+                    change = 'now_matched' if matched else 'now_missing'
+                elif matched and row['local_pdf_path'] != local_pdf_path:
+                    change = 'moved'
+                else:
+                    change = None
+                self.conn.execute('''
+                    INSERT INTO matches (cartype, car_name, web_pdf_path, local_pdf_path, matched, listed,
+                                         first_seen, last_seen, changed_at, run_id)
+                    VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?)
+                    ON CONFLICT (cartype, car_name, web_pdf_path) DO UPDATE SET
+                        local_pdf_path = excluded.local_pdf_path,
+                        matched = excluded.matched,
+                        listed = 1,
+                        last_seen = excluded.last_seen,
+                        changed_at = CASE WHEN ? THEN excluded.changed_at ELSE matches.changed_at END,
+                        run_id = excluded.run_id
+                ''', key + (local_pdf_path, matched, now, now, now, run_id, change is not None))
+                if change:
+                    changes.append(self._add_change(run_id, key, change, local_pdf_path, now))
+        return changes
+
+    def _add_change(self, run_id, key, change, local_pdf_path, at):
+        self.conn.execute('''
+            INSERT INTO changes (run_id, cartype, car_name, web_pdf_path, change, local_pdf_path, at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (run_id,) + key + (change, local_pdf_path, at))
+        return {'run_id': run_id, 'cartype': key[0], 'car_name': key[1], 'web_pdf_path': key[2], 'change': change,
+                'local_pdf_path': local_pdf_path, 'at': at}
+
+    def finish_run(self, run_id, cartypes):
+        """
+        结束一次运行：本次检查过的类别中没有再出现的条目标记为已从列表页移除。
+        只在所有列表页都成功取得后调用，避免网络错误时误标。
+        Returns:
+            list: 本次记录的变化，格式同changes()
+        """
+        now = time.time()
+        changes = []
+        with self.conn:
+            for cartype in set(cartypes):
+                rows = self.conn.execute('''
+                    SELECT car_name, web_pdf_path, local_pdf_path FROM matches
+                    WHERE cartype = ? AND listed = 1 AND run_id != ?
+                ''', (cartype, run_id)).fetchall()
+                for row in rows:
+                    key = (cartype, row['car_name'], row['web_pdf_path'])
+                    self.conn.execute('''
+                        UPDATE matches SET listed = 0, changed_at = ?
+                        WHERE cartype = ? AND car_name = ? AND web_pdf_path = ?
+                    ''', (now,) + key)
+                    changes.append(self._add_change(run_id, key, 'unlisted', row['local_pdf_path'], now))
+            self.conn.execute('UPDATE runs SET finished_at = ? WHERE run_id = ?', (now, run_id))
+        return changes
+
+    def last_run_id(self):
+        row = self.conn.execute('SELECT MAX(run_id) FROM runs WHERE finished_at IS NOT NULL').fetchone()
+        return row[0]
+
+    def changes(self, run_id=None, since=None):
+        """
+        查询变化记录。
+        Args:
+            run_id (int): 只看这次运行，默认最近一次完成的运行
+            since (float): 指定时则返回该时间戳之后的所有变化（忽略run_id）
+        Returns:
+            list: [{"run_id", "cartype", "car_name", "web_pdf_path", "change", "local_pdf_path", "at"}, ...]
+        """
+        if since is not None:
+            rows = self.conn.execute('SELECT * FROM changes WHERE at >= ? ORDER BY at', (since,)).fetchall()
+        else:
+            run_id = run_id if run_id is not None else self.last_run_id()
+            rows = self.conn.execute('SELECT * FROM changes WHERE run_id = ? ORDER BY rowid', (run_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def iter_matches(self, include_unlisted=False):
+        sql = 'SELECT * FROM matches'
+        if not include_unlisted:
+            sql += ' WHERE listed = 1'
+        for row in self.conn.execute(sql + ' ORDER BY cartype, car_name, web_pdf_path'):
+            yield dict(row)
+
+    def summary(self):
+        """
+        Returns:
+            dict: {cartype: {"total", "matched", "missing"}}，只统计仍在列表页上的条目
+        """
+        rows = self.conn.execute('''
+            SELECT cartype, COUNT(*) AS total, SUM(matched) AS matched FROM matches
+            WHERE listed = 1 GROUP BY cartype ORDER BY cartype
+        ''').fetchall()
+        return {row['cartype']: {'total': row['total'], 'matched': row['matched'],
+                                 'missing': row['total'] - row['matched']} for row in rows}
+
+    def export_csv(self, output_csv, include_unlisted=False):
+        """
+        导出为与原来相同列的CSV（cartype, car_name, web_pdf_path, local_pdf_path, matched），整体覆盖写入。
+        Returns:
+            int: 导出的行数
+        """
+        tmp_path = output_csv + '.tmp'
+        n = 0
+        with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_COLUMNS + ['first_seen', 'last_seen'])
+            for row in self.iter_matches(include_unlisted):
+                writer.writerow([row['cartype'], row['car_name'], row['web_pdf_path'], row['local_pdf_path'] or '',
+                                 bool(row['matched']), _format_time(row['first_seen']), _format_time(row['last_seen'])])
+                n += 1
+        os.replace(tmp_path, output_csv)
+        return n
+
+    def close(self):
+        self.conn.close()
+
+def _format_time(ts):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts)) if ts else ''
+
+def print_changes(changes):
+    """打印变化记录，按变化类型分组"""
+    grouped = {}
+    for change in changes:
+        grouped.setdefault(change['change'], []).append(change)
+    for kind, label in CHANGE_LABELS.items():
+        for change in grouped.get(kind, []):
+            local = f" => {change['local_pdf_path']}" if change['local_pdf_path'] else ''
+            print(f"[{label}] {change['cartype']} / {change['car_name']}: {change['web_pdf_path']}{local}")
+    counts = ', '.join(f"{CHANGE_LABELS[kind]} {len(grouped[kind])} 个" for kind in CHANGE_LABELS if kind in grouped)
+    print(f"变化: {counts or '无'}")
+
+def print_summary(store):
+    for cartype, row in store.summary().items():
+        print(f"{cartype}: 共 {row['total']} 个, 已下载 {row['matched']} 个, 缺失 {row['missing']} 个")
+
+if __name__ == '__main__':
+    '''
+    查看最近一次运行的变化：python match_store.py --db matches.sqlite --diff
+    导出CSV：python match_store.py --db matches.sqlite --export-csv output.csv
+    '''
+    parser = argparse.ArgumentParser(description='查看匹配结果的变化、导出CSV')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='匹配结果数据库路径')
+    parser.add_argument('--diff', action='store_true', help='显示一次运行的变化（默认最近一次）')
+    parser.add_argument('--run-id', type=int, help='与--diff一起使用，指定运行编号')
+    parser.add_argument('--since-days', type=float, help='与--diff一起使用，显示最近N天内的所有变化')
+    parser.add_argument('--export-csv', help='导出CSV路径')
+    parser.add_argument('--include-unlisted', action='store_true', help='导出时包含已从列表页移除的条目')
+    args = parser.parse_args()
+    store = MatchStore(args.db)
+    try:
+        if args.diff:
+            since = time.time() - args.since_days * 86400 if args.since_days is not None else None
+            print_changes(store.changes(args.run_id, since))
+        if args.export_csv:
+            n = store.export_csv(args.export_csv, args.include_unlisted)
+            print(f'CSV已导出: {args.export_csv}, {n} 行')
+        print_summary(store)
+    finally:
+        store.close()
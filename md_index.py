@@ -0,0 +1,378 @@
+import os
+import re
+import csv
+import time
+import sqlite3
+import argparse
+import unicodedata
+
+import metrics
+from page_cache import PAGE_SEPARATOR_RE
+from match_store import MatchStore
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    md_path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    car_name TEXT,
+    catalog TEXT NOT NULL,
+    cartype TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    md_path TEXT NOT NULL,
+    car_name TEXT,
+    catalog TEXT NOT NULL,
+    cartype TEXT,
+    page INTEGER NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pages_md_path ON pages (md_path);
+CREATE INDEX IF NOT EXISTS idx_pages_car_name ON pages (car_name);
+CREATE INDEX IF NOT EXISTS idx_pages_catalog ON pages (catalog);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(body, content='');
+'''
+
+# 汉字、平假名、片假名（含长音符）连续出现的片段，按二元组切分后交给FTS
+CJK_RUN_RE = re.compile(r'[ぁ-ゟ゠-ヿ㐀-䶿一-鿿豈-﫿]+')
+# 建索引时去掉的图片链接和HTML标签（marker输出中的 <span id="page-3-0"></span> 等）
+STRIP_RE = re.compile(r'!\[[^\]]*\]\([^)]*\)|<[^>]+>')
+
+def default_index_path(markdown_dir):
+    return os.path.join(markdown_dir, '.md_index.sqlite')
+
+def normalize_text(text):
+    """NFKC规范化：全角英数、半角片假名统一，使 ＷＬＴＣ 与 WLTC 能互相匹配"""
+    return unicodedata.normalize('NFKC', text)
+
+def _cjk_tokens(run, for_query=False):
+    """
+    把汉字/假名片段切成重叠的二元组：燃費率 -> 燃費 費率。
+    建索引时片段最后一个字再单独作为一个词，使单字查询也能匹配（查询时用前缀匹配）。
+    """
+    if len(run) == 1:
+        return [run]
+    tokens = [run[i:i + 2] for i in range(len(run) - 1)]
+    if not for_query:
+        tokens.append(run[-1])
+    return tokens
+
+def tokenize_for_index(text):
+    """把汉字/假名片段替换为以空格分隔的二元组，其他文字保持原样交给unicode61分词"""
+    return CJK_RUN_RE.sub(lambda m: ' ' + ' '.join(_cjk_tokens(m.group(0))) + ' ', normalize_text(text))
+
+def build_match_query(query):
+    """
+    把用户输入转为FTS5查询：空格分隔的各个词之间为AND，每个汉字/假名片段是一个二元组短语。
+    Returns:
+        tuple: (FTS5查询字符串, 用于生成摘要的词列表)
+    """
+    clauses = []
+    terms = []
+    for word in normalize_text(query).split():
+        terms.append(word)
+        pos = 0
+        parts = []
+        for m in CJK_RUN_RE.finditer(word):
+            parts.append((word[pos:m.start()], False))
+            parts.append((m.group(0), True))
+            pos = m.end()
+        parts.append((word[pos:], False))
+        for part, is_cjk in parts:
+            if is_cjk:
+                if len(part) == 1:
+                    clauses.append(f'"{part}"*')
+                else:
+                    clauses.append('"' + ' '.join(_cjk_tokens(part, for_query=True)) + '"')
+            else:
+                # 英数字部分按unicode61同样的规则切词，每个词加引号避免被当成FTS语法
+                clauses.extend('"' + token + '"' for token in re.findall(r'\w+', part))
+    return ' AND '.join(clauses), terms
+
+def make_snippet(content, terms, width=40, mark=('[', ']')):
+    """
+    在页面原文中找到第一个命中的词，截取前后width个字符并标出所有命中的词。
+    """
+    text = ' '.join(normalize_text(content).split())
+    lowered = text.lower()
+    hits = [(lowered.find(term.lower()), term) for term in terms]
+    hits = [hit for hit in hits if hit[0] >= 0]
+    start = min(hits)[0] if hits else 0
+    begin = max(0, start - width)
+    end = min(len(text), start + width + (len(min(hits)[1]) if hits else 0))
+    snippet = text[begin:end]
+    if terms:
+        pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+        snippet = pattern.sub(lambda m: f'{mark[0]}{m.group(0)}{mark[1]}', snippet)
+    return ('…' if begin > 0 else '') + snippet + ('…' if end < len(text) else '')
+
+def split_pages(markdown):
+    """
+    按marker分页输出的分隔符 {页码}---- 拆分markdown；没有分隔符时整篇作为第0页。
+    Returns:
+        list: [(页码, 去掉图片链接和HTML标签的正文), ...]，页码与marker一致（从0开始）
+    """
+    matches = list(PAGE_SEPARATOR_RE.finditer(markdown))
+    if not matches:
+        sections = [(0, markdown)]
+    else:
+        sections = [(int(m.group(1)), markdown[m.end():matches[i + 1].start() if i + 1 < len(matches) else len(markdown)])
+                    for i, m in enumerate(matches)]
+    pages = []
+    for page, text in sections:
+        text = STRIP_RE.sub(' ', text).strip()
+        if text:
+            pages.append((page, text))
+    return pages
+
+def load_catalog_metadata(manifest_path=None, match_csv=None, catalog=None, match_db=None):
+    """
+    收集每本说明书（PDF文件名去掉扩展名，即marker输出目录名）的车型名和类别。
+    车型名取转换清单中记录的PDF所在文件夹名（下载时按车型名分文件夹保存），
+    类别(cartype)取scan_and_match_pdfs.py的匹配结果（匹配结果数据库或导出的CSV）。
+    Args:
+        manifest_path (str): 转换清单路径
+        match_csv (str): 匹配结果CSV路径
+        catalog (str): 只取这一本说明书（流水线中逐个索引时使用）
+        match_db (str): 匹配结果数据库路径
+    Returns:
+        dict: {catalog: {"car_name", "cartype"}}
+    """
+    metadata = {}
+    if manifest_path and os.path.exists(manifest_path):
+        conn = sqlite3.connect(manifest_path)
+        sql, params = 'SELECT path FROM file_hashes', ()
+        if catalog is not None:
+            escaped = re.sub(r'([\\%_])', r'\\\1', catalog)
+            sql, params = sql + " WHERE path LIKE ? ESCAPE '\\'", (f'%{escaped}.%',)
+        try:
+            for (path,) in conn.execute(sql, params):
+                name = os.path.splitext(os.path.basename(path))[0]
+                if catalog is not None and name != catalog:
+                    continue
+                metadata.setdefault(name, {'car_name': None, 'cartype': None})['car_name'] = \
+                    os.path.basename(os.path.dirname(path)) or None
+        finally:
+            conn.close()
+    rows = []
+    if match_db and os.path.exists(match_db):
+        store = MatchStore(match_db)
+        try:
+            rows.extend(row for row in store.iter_matches() if row['matched'])
+        finally:
+            store.close()
+    if match_csv and os.path.exists(match_csv):
+        with open(match_csv, 'r', newline='', encoding='utf-8') as f:
+            rows.extend(csv.DictReader(f))
+    for row in rows:
+        if not row.get('local_pdf_path'):
+            continue
+        name = os.path.splitext(os.path.basename(row['local_pdf_path']))[0]
+        if catalog is not None and name != catalog:
+            continue
+        entry = metadata.setdefault(name, {'car_name': None, 'cartype': None})
+        entry['cartype'] = row.get('cartype') or entry['cartype']
+        entry['car_name'] = entry['car_name'] or row.get('car_name') or None
+    return metadata
+
+class MarkdownIndex:
+    """
+    marker输出markdown的全文索引（SQLite FTS5），每页一行，按车型名、说明书、类别和页码检索。
+    汉字/假名按二元组切分，燃費、乗車定員 等两字以上的词都能直接匹配。
+    按md文件的大小和mtime增量更新，未变化的文件不再读取。
+    """
+
+    def __init__(self, db_path):
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def _delete_pages(self, md_path):
+        rows = self.conn.execute('SELECT id, content FROM pages WHERE md_path = ?', (md_path,)).fetchall()
+        # contentless的FTS表删除时需要提供原来写入的内容
+        self.conn.executemany("INSERT INTO pages_fts (pages_fts, rowid, body) VALUES ('delete', ?, ?)",
+                              [(row['id'], tokenize_for_index(row['content'])) for row in rows])
+        self.conn.execute('DELETE FROM pages WHERE md_path = ?', (md_path,))
+
+    def index_file(self, md_path, car_name=None, catalog=None, cartype=None, st=None):
+        """
+        索引一个md文件；内容和元数据都未变化时直接跳过。
+        Args:
+            md_path (str): markdown路径
+            car_name (str): 车型名，None时沿用已有的值
+            catalog (str): 说明书名，默认取md文件名
+            cartype (str): 类别，None时沿用已有的值
+            st (os.stat_result): 已取得的stat，可省去一次系统调用
+        Returns:
+            bool: 是否重新读取并索引了内容
+        """
+        catalog = catalog or os.path.splitext(os.path.basename(md_path))[0]
+        st = st or os.stat(md_path)
+        row = self.conn.execute('SELECT * FROM files WHERE md_path = ?', (md_path,)).fetchone()
+        if row:
+            # 没有提供的元数据沿用上次的值
+            car_name = car_name or row['car_name']
+            cartype = cartype or row['cartype']
+        if row and row['size'] == st.st_size and row['mtime_ns'] == st.st_mtime_ns:
+            if (row['car_name'], row['catalog'], row['cartype']) != (car_name, catalog, cartype):
+                with self.conn:
+                    self.conn.execute('UPDATE pages SET car_name = ?, catalog = ?, cartype = ? WHERE md_path = ?',
+                                      (car_name, catalog, cartype, md_path))
+                    self.conn.execute('UPDATE files SET car_name = ?, catalog = ?, cartype = ? WHERE md_path = ?',
+                                      (car_name, catalog, cartype, md_path))
+            return False
+        with open(md_path, 'r', encoding='utf-8') as f:
+            pages = split_pages(f.read())
+        with self.conn:
+            self._delete_pages(md_path)
+            for page, content in pages:
+                cur = self.conn.execute('''
+                    INSERT INTO pages (md_path, car_name, catalog, cartype, page, content) VALUES (?, ?, ?, ?, ?, ?)
+                ''', (md_path, car_name, catalog, cartype, page, content))
+                self.conn.execute('INSERT INTO pages_fts (rowid, body) VALUES (?, ?)',
+                                  (cur.lastrowid, tokenize_for_index(content)))
+            self.conn.execute('''
+                INSERT OR REPLACE INTO files (md_path, size, mtime_ns, car_name, catalog, cartype, indexed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (md_path, st.st_size, st.st_mtime_ns, car_name, catalog, cartype, time.time()))
+        return True
+
+    def remove_file(self, md_path):
+        with self.conn:
+            self._delete_pages(md_path)
+            self.conn.execute('DELETE FROM files WHERE md_path = ?', (md_path,))
+
+    def update(self, markdown_dir, metadata=None):
+        """
+        增量更新markdown_dir下所有marker输出（<说明书>/<说明书>.md），删除已不存在的文件的索引。
+        Args:
+            markdown_dir (str): marker输出目录
+            metadata (dict): load_catalog_metadata的结果
+        Returns:
+            dict: {"files", "indexed", "removed"}
+        """
+        metadata = metadata or {}
+        seen = set()
+        indexed = 0
+        for md_path, st in iter_catalog_md_files(markdown_dir):
+            seen.add(md_path)
+            catalog = os.path.splitext(os.path.basename(md_path))[0]
+            meta = metadata.get(catalog, {})
+            if self.index_file(md_path, meta.get('car_name'), catalog, meta.get('cartype'), st):
+                indexed += 1
+        removed = 0
+        prefix = os.path.join(markdown_dir, '')
+        for (md_path,) in self.conn.execute('SELECT md_path FROM files').fetchall():
+            if md_path.startswith(prefix) and md_path not in seen:
+                self.remove_file(md_path)
+                removed += 1
+        if indexed or removed:
+            with self.conn:
+                self.conn.execute("INSERT INTO pages_fts (pages_fts) VALUES ('optimize')")
+        return {'files': len(seen), 'indexed': indexed, 'removed': removed}
+
+    def search(self, query, car_name=None, catalog=None, cartype=None, limit=20, snippet_width=40):
+        """
+        全文检索，按相关度(bm25)排序。
+        Args:
+            query (str): 检索词，空格分隔的多个词同时出现才命中
+            car_name/catalog/cartype (str): 可选的精确过滤条件
+            limit (int): 最多返回的页数
+        Returns:
+            list: [{"car_name", "catalog", "cartype", "page", "md_path", "snippet"}, ...]
+        """
+        match, terms = build_match_query(query)
+        if not match:
+            return []
+        started = time.monotonic()
+        rows = self.conn.execute('''
+            SELECT p.* FROM pages_fts JOIN pages p ON p.id = pages_fts.rowid
+            WHERE pages_fts MATCH ?
+              AND (? IS NULL OR p.car_name = ?) AND (? IS NULL OR p.catalog = ?) AND (? IS NULL OR p.cartype = ?)
+            ORDER BY bm25(pages_fts) LIMIT ?
+        ''', (match, car_name, car_name, catalog, catalog, cartype, cartype, limit)).fetchall()
+        metrics.observe('index.search', time.monotonic() - started, query=query, hits=len(rows))
+        return [{
+            'car_name': row['car_name'],
+            'catalog': row['catalog'],
+            'cartype': row['cartype'],
+            'page': row['page'],
+            'md_path': row['md_path'],
+            'snippet': make_snippet(row['content'], terms, snippet_width),
+        } for row in rows]
+
+    def stats(self):
+        files = self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+        pages = self.conn.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+        return {'files': files, 'pages': pages}
+
+    def close(self):
+        self.conn.close()
+
+def iter_catalog_md_files(markdown_dir):
+    """
+    遍历marker的输出：只取 <说明书>/<说明书>.md，跳过 .shards、_images 等内部目录。
+    Returns:
+        generator: (md_path, stat)
+    """
+    stack = [markdown_dir]
+    while stack:
+        folder = stack.pop()
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith(('.', '_')):
+                        stack.append(entry.path)
+                elif (entry.name.endswith('.md') and entry.name[:-3] == os.path.basename(folder)
+                      and entry.is_file()):
+                    yield entry.path, entry.stat()
+
+if __name__ == '__main__':
+    '''
+    建立/增量更新索引：
+    python md_index.py --markdown-dir /home/webcatalog/markdown --match-db matches.sqlite
+    检索：
+    python md_index.py --markdown-dir /home/webcatalog/markdown --query '燃費 WLTC' [--car-name アルファード --limit 10]
+    '''
+    parser = argparse.ArgumentParser(description='marker输出markdown的全文索引和检索')
+    parser.add_argument('--markdown-dir', required=True, help='marker输出目录')
+    parser.add_argument('--index-path', help='索引(SQLite)路径，默认 <markdown-dir>/.md_index.sqlite')
+    parser.add_argument('--manifest', help='转换清单路径，用于取得车型名，默认 <markdown-dir>/.marker_manifest.sqlite')
+    parser.add_argument('--match-db', help='scan_and_match_pdfs.py的匹配结果数据库，用于取得类别(cartype)')
+    parser.add_argument('--match-csv', help='匹配结果导出的CSV，用于取得类别(cartype)')
+    parser.add_argument('--query', help='检索词；不指定时只更新索引')
+    parser.add_argument('--update', action='store_true', help='检索前先增量更新索引')
+    parser.add_argument('--car-name', help='只检索该车型')
+    parser.add_argument('--catalog', help='只检索该说明书')
+    parser.add_argument('--cartype', help='只检索该类别')
+    parser.add_argument('--limit', type=int, default=20, help='最多显示的页数')
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure_from_args(args)
+    index = MarkdownIndex(args.index_path or default_index_path(args.markdown_dir))
+    try:
+        if args.query is None or args.update:
+            started = time.monotonic()
+            metadata = load_catalog_metadata(
+                args.manifest or os.path.join(args.markdown_dir, '.marker_manifest.sqlite'), args.match_csv,
+                match_db=args.match_db)
+            result = index.update(args.markdown_dir, metadata)
+            stats = index.stats()
+            metrics.emit('index.update', elapsed=time.monotonic() - started, pages=stats['pages'], **result)
+            print(f"md {result['files']} 个，重新索引 {result['indexed']} 个，删除 {result['removed']} 个，"
+                  f"共 {stats['pages']} 页，耗时 {time.monotonic() - started:.1f}s")
+        if args.query is not None:
+            started = time.monotonic()
+            hits = index.search(args.query, args.car_name, args.catalog, args.cartype, args.limit)
+            for hit in hits:
+                print(f"[{hit['cartype'] or '-'}] {hit['car_name'] or '-'} / {hit['catalog']} p.{hit['page']}")
+                print(f"    {hit['snippet']}")
+            print(f"命中 {len(hits)} 页，耗时 {(time.monotonic() - started) * 1000:.1f}ms")
+    finally:
+        index.close()
+        metrics.close()
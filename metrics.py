@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def percentile(sorted_values, q):
+    """最近秩法取分位数，sorted_values需已排序"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def peak_rss_mb(children=False):
+    """
+    进程的峰值常驻内存(MB)。children为True时是已结束子进程中最大的峰值（如marker_single）。
+    Returns:
+        float: 无法取得时返回None
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Linux上单位是KB，macOS上是字节
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss / scale
+
+class Metrics:
+    """
+    进程内的计时和计数（线程安全）。
+    observe记录耗时样本用于计算分位数；指定jsonl_path时每个事件同时写为一行JSON，
+    结束时写入汇总（各项计数、耗时分位数、峰值内存），生产运行和基准测试输出相同的指标。
+    """
+
+    def __init__(self, jsonl_path=None, script=None):
+        self.script = script or os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+        self.started = time.monotonic()
+        self.samples = {}  # name -> [seconds, ...]
+        self.counters = {}  # name -> number
+        self._lock = threading.Lock()
+        self._file = None
+        if jsonl_path:
+            self.open(jsonl_path)
+
+    def open(self, jsonl_path):
+        """追加写入JSON-lines文件，多次运行的记录可以放在同一个文件中"""
+        self.close_file()
+        os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+        self._file = open(jsonl_path, 'a', encoding='utf-8')
+
+    def emit(self, event, **fields):
+        """写出一个事件；未指定jsonl文件时什么也不做"""
+        if self._file is None:
+            return
+        record = {'ts': round(time.time(), 6), 'script': self.script, 'pid': os.getpid(), 'event': event}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + '\n')
+                self._file.flush()
+
+    def observe(self, name, seconds, **fields):
+        """记录一个耗时样本并写出事件"""
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+        self.emit(name, seconds=round(seconds, 6), **fields)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, name, **fields):
+        """
+        计时上下文；可以在块内往返回的dict里补充字段（如status、bytes）。
+        with metrics.timer('convert.pdf', pdf_path=path) as m:
+            ...
+            m['pages'] = 12
+        """
+        started = time.monotonic()
+        try:
+            yield fields
+        except BaseException:
+            fields.setdefault('status', 'error')
+            raise
+        finally:
+            self.observe(name, time.monotonic() - started, **fields)
+
+    def snapshot(self):
+        """当前各项的样本数，传给timings(since=...)可只统计之后新增的样本"""
+        with self._lock:
+            return {k: len(v) for k, v in self.samples.items()}
+
+    def timings(self, name=None, since=None):
+        """
+        Args:
+            name (str): 只返回该项
+            since (dict): snapshot()的结果，只统计之后新增的样本
+        Returns:
+            dict: {name: {"count", "total", "p50", "p90", "p99", "max"}}；指定name时只返回该项（没有样本时为None）
+        """
+        since = since or {}
+        with self._lock:
+            samples = {k: sorted(v[since.get(k, 0):]) for k, v in self.samples.items()
+                       if (name is None or k == name) and len(v) > since.get(k, 0)}
+        result = {k: {
+            'count': len(v),
+            'total': sum(v),
+            'p50': percentile(v, 50),
+            'p90': percentile(v, 90),
+            'p99': percentile(v, 99),
+            'max': v[-1],
+        } for k, v in samples.items()}
+        return result.get(name) if name is not None else result
+
+    def summary(self):
+        with self._lock:
+            counters = dict(self.counters)
+        return {
+            'elapsed': time.monotonic() - self.started,
+            'peak_rss_mb': peak_rss_mb(),
+            'children_peak_rss_mb': peak_rss_mb(children=True),
+            'counters': counters,
+            'timings': self.timings(),
+        }
+
+    def print_summary(self, file=None):
+        summary = self.summary()
+        for name, t in sorted(summary['timings'].items()):
+            print(f"[{name}] {t['count']} 次, 累计 {t['total']:.2f}s, p50 {t['p50'] * 1000:.1f}ms, "
+                  f"p90 {t['p90'] * 1000:.1f}ms, p99 {t['p99'] * 1000:.1f}ms, 最大 {t['max'] * 1000:.1f}ms", file=file)
+        for name, n in sorted(summary['counters'].items()):
+            print(f"[{name}] {n}", file=file)
+        rss = summary['peak_rss_mb']
+        children = summary['children_peak_rss_mb']
+        if rss is not None:
+            print(f"峰值内存 {rss:.0f}MB，子进程峰值 {children:.0f}MB", file=file)
+
+    def close_file(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def close(self):
+        """写出汇总事件并关闭文件"""
+        self.emit('summary', **self.summary())
+        self.close_file()
+
+_default_metrics = Metrics()
+
+def get_metrics():
+    return _default_metrics
+
+def emit(event, **fields):
+    _default_metrics.emit(event, **fields)
+
+def observe(name, seconds, **fields):
+    _default_metrics.observe(name, seconds, **fields)
+
+def count(name, n=1):
+    _default_metrics.count(name, n)
+
+def timer(name, **fields):
+    return _default_metrics.timer(name, **fields)
+
+def configure(jsonl_path=None):
+    """指定JSON-lines输出文件，未传时保持不变"""
+    if jsonl_path:
+        _default_metrics.open(jsonl_path)
+
+def add_metrics_arguments(parser):
+    """给命令行加上结构化指标输出参数"""
+    parser.add_argument('--metrics-jsonl', help='把各阶段计时和指标以JSON lines追加写入该文件，结束时写入汇总')
+
+def configure_from_args(args):
+    configure(args.metrics_jsonl)
+
+def close():
+    _default_metrics.close()
@@ -0,0 +1,338 @@
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+
+# marker分页输出中的页分隔符 {页码}------------------------------------------------
+PAGE_SEPARATOR_RE = re.compile(r'\{(\d+)\}-{48}')
+PAGE_SEPARATOR = '{{{}}}' + '-' * 48
+# 页码在缓存中的占位符：图片名 _page_3_Picture_1.jpeg、锚点 page-3-0 换成占位符后与页码无关
+PAGE_TOKEN = '@PAGE@'
+IMAGE_PAGE_RE = re.compile(r'^_page_(\d+)_')
+# 计算页面哈希时忽略的键：父节点、结构树序号等只与页面位置有关，与内容无关
+SKIP_KEYS = {'/Parent', '/P', '/StructParents', '/StructParent'}
+INHERITED_KEYS = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+# 判断页面是否依赖整本文档的上下文
+HEADING_RE = re.compile(r'^#{1,6}\s', re.M)
+ANCHOR_RE = re.compile(r'<span id="[^"]*"></span>')
+IMAGE_BLOCK_RE = re.compile(r'^!\[[^\]]*\]\([^)]*\)$')
+BLOCK_SPLIT_RE = re.compile(r'\n\s*\n')
+SENTENCE_END = ('。', '.', '!', '?', '！', '？', '」', '』')
+
+_warned_no_pypdf = False
+
+def _marker_version():
+    try:
+        from importlib.metadata import version
+        return version('marker-pdf')
+    except Exception:
+        return 'unknown'
+
+def _digest(obj, memo):
+    """
+    递归计算PDF对象的摘要。间接对象按对象号缓存，同一文档中共享的字体/图片只读取、计算一次。
+    """
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key not in memo:
+            memo[key] = b'cycle'  # 处理循环引用
+            memo[key] = _digest(obj.get_object(), memo)
+        return memo[key]
+    hasher = hashlib.sha256()
+    if isinstance(obj, StreamObject):
+        try:
+            data = obj.get_data()
+        except Exception:
+            data = obj._data  # 不支持的压缩方式，直接使用原始数据
+        hasher.update(b'S' + hashlib.sha256(data).digest())
+    if isinstance(obj, DictionaryObject):
+        hasher.update(b'D')
+        for key in sorted(obj.keys()):
+            if key in SKIP_KEYS:
+                continue
+            hasher.update(key.encode('utf-8'))
+            hasher.update(_digest(obj.raw_get(key), memo))
+    elif isinstance(obj, ArrayObject):
+        hasher.update(b'A')
+        for item in obj:
+            hasher.update(_digest(item, memo))
+    elif not isinstance(obj, StreamObject):
+        hasher.update(b'V' + repr(obj).encode('utf-8'))
+    return hasher.digest()
+
+def _inherited(page, key):
+    """取页面属性，页面上没有时沿页面树向上查找（Resources/MediaBox等可继承）"""
+    node = page
+    while node is not None:
+        if key in node:
+            return node.raw_get(key)
+        node = node.get('/Parent')
+    return None
+
+def page_hashes(pdf_path, options_key):
+    """
+    计算PDF每一页的内容哈希：内容流、资源（字体、图片）、页面尺寸、旋转和注释，
+    再加上转换参数和marker版本。需要pypdf，未安装或PDF无法解析时返回None。
+    Returns:
+        list: 按页码顺序的哈希字符串
+    """
+    global _warned_no_pypdf
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        if not _warned_no_pypdf:
+            print('未安装pypdf，页面缓存不可用（pip install pypdf）')
+            _warned_no_pypdf = True
+        return None
+    prefix = hashlib.sha256(f'{options_key}\n{_marker_version()}'.encode('utf-8')).digest()
+    try:
+        reader = PdfReader(pdf_path)
+        memo = {}
+        hashes = []
+        for page in reader.pages:
+            if page.indirect_reference is not None:
+                ref = page.indirect_reference
+                memo[(ref.idnum, ref.generation)] = b'page'  # 注释等指回本页的引用
+            hasher = hashlib.sha256(prefix)
+            for key in ('/Contents',) + INHERITED_KEYS + ('/Annots',):
+                value = page.raw_get(key) if key in page else _inherited(page, key)
+                hasher.update(key.encode('utf-8'))
+                hasher.update(_digest(value, memo) if value is not None else b'-')
+            hashes.append(hasher.hexdigest())
+        return hashes
+    except Exception as e:
+        print(f"无法计算页面哈希，不使用页面缓存: {pdf_path}, 错误: {e}")
+        return None
+
+def format_page_range(pages):
+    """把页码列表转成marker的page_range，如 [0, 1, 2, 5] -> "0-2,5" """
+    parts = []
+    pages = sorted(pages)
+    start = prev = pages[0]
+    for page in pages[1:] + [None]:
+        if page is not None and page == prev + 1:
+            prev = page
+            continue
+        parts.append(f'{start}-{prev}' if prev > start else str(start))
+        if page is not None:
+            start = prev = page
+    return ','.join(parts)
+
+def split_markdown_pages(markdown):
+    """
+    按页分隔符拆分marker的分页markdown。
+    Returns:
+        dict: {页码: 该页的markdown（不含分隔符，去掉首尾空白）}
+    """
+    matches = list(PAGE_SEPARATOR_RE.finditer(markdown))
+    pages = {}
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(markdown)
+        pages[int(m.group(1))] = markdown[m.end():end].strip()
+    return pages
+
+def page_depends_on_context(text, last_page=False):
+    """
+    页面的转换结果是否可能受其他页影响，这样的页不能与其他版本转换的页拼接：
+    有标题（marker按整本文档统计标题层级）、页首或页尾是表格（可能与相邻页的表格合并）、
+    不是最后一页且页尾是没有结束的段落（可能与下一页连成一段）。
+    Args:
+        text (str): 一页的markdown
+        last_page (bool): 是否为文档的最后一页
+    """
+    text = ANCHOR_RE.sub('', text)
+    if HEADING_RE.search(text):
+        return True
+    blocks = [block.strip() for block in BLOCK_SPLIT_RE.split(text) if block.strip()]
+    if not blocks:
+        return False
+    if blocks[0].startswith('|') or blocks[-1].startswith('|'):
+        return True
+    last = blocks[-1]
+    return not last_page and not IMAGE_BLOCK_RE.match(last) and not last.endswith(SENTENCE_END)
+
+def output_depends_on_context(subdir, pdf_base, page_count):
+    """marker输出目录（整本或部分页）中是否有依赖整本文档上下文的页"""
+    with open(os.path.join(subdir, f'{pdf_base}.md'), 'r', encoding='utf-8') as f:
+        pages = split_markdown_pages(f.read())
+    return any(page_depends_on_context(text, page_id == page_count - 1) for page_id, text in pages.items())
+
+def _normalize(text, page_id):
+    """把文本中本页的页码换成占位符"""
+    return text.replace(f'_page_{page_id}_', f'_page_{PAGE_TOKEN}_').replace(f'page-{page_id}-', f'page-{PAGE_TOKEN}-')
+
+def _denormalize(text, page_id):
+    return text.replace(PAGE_TOKEN, str(page_id))
+
+class PageCache:
+    """
+    按页面内容哈希缓存marker的转换结果（markdown、图片、meta中的页面条目）。
+    改版的说明书只有内容变化的页需要重新转换，其余页直接从缓存拼接。
+    root/
+        index.sqlite         页面哈希 -> 大小、最近使用时间，超过max_bytes时按LRU淘汰
+        pages/<h[:2]>/<h>/   page.md、page_meta.json 及图片（文件名中的页码已换成占位符）
+    marker的标题层级、跨页表格、跨页段落按整本文档处理，只有所有页都不依赖这些上下文
+    （page_depends_on_context）时才拼接，否则整本转换，保证输出与整本转换相同。
+    """
+
+    def __init__(self, root, max_bytes=2 * 1024 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, 'index.sqlite'))
+        self.conn.execute('CREATE TABLE IF NOT EXISTS pages (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                          'last_used REAL NOT NULL)')
+
+    def _page_dir(self, page_hash):
+        return os.path.join(self.root, 'pages', page_hash[:2], page_hash)
+
+    def missing_pages(self, hashes):
+        """
+        Returns:
+            list: 缓存中没有的页码
+        """
+        cached = set()
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            rows = self.conn.execute(f"SELECT hash FROM pages WHERE hash IN ({','.join('?' * len(chunk))})", chunk)
+            cached.update(row[0] for row in rows)
+        return [page_id for page_id, page_hash in enumerate(hashes)
+                if page_hash not in cached or not os.path.isdir(self._page_dir(page_hash))]
+
+    def context_free(self, hashes):
+        """缓存中已有的各页是否都不依赖整本文档的上下文（缺少的页在转换后另行检查）"""
+        for page_id, page_hash in enumerate(hashes):
+            path = os.path.join(self._page_dir(page_hash), 'page.md')
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                if page_depends_on_context(f.read(), page_id == len(hashes) - 1):
+                    return False
+        return True
+
+    def store_output(self, subdir, pdf_base, hashes):
+        """
+        把一个marker输出目录（整本或部分页）按页拆分存入缓存。
+        不在这里淘汰，以免淘汰掉其他PDF拼接时还要用的页；所有任务结束后再调用evict。
+        Args:
+            subdir (str): marker输出目录 <out>/<pdf_base>
+            pdf_base (str): PDF文件名（不含扩展名）
+            hashes (list): 整本PDF各页的哈希，输出中的页码即为下标
+        """
+        with open(os.path.join(subdir, f'{pdf_base}.md'), 'r', encoding='utf-8') as f:
+            pages = split_markdown_pages(f.read())
+        meta = {}
+        meta_path = os.path.join(subdir, f'{pdf_base}_meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        images = {}
+        for name in os.listdir(subdir):
+            m = IMAGE_PAGE_RE.match(name)
+            if m:
+                images.setdefault(int(m.group(1)), []).append(name)
+        now = time.time()
+        for page_id, text in pages.items():
+            if page_id >= len(hashes):
+                continue
+            page_dir = self._page_dir(hashes[page_id])
+            tmp_dir = page_dir + '.tmp'
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            with open(os.path.join(tmp_dir, 'page.md'), 'w', encoding='utf-8') as f:
+                f.write(_normalize(text, page_id))
+            page_meta = {'keys': list(meta), 'fields': {}, 'items': {}}
+            for key, value in meta.items():
+                if isinstance(value, list):
+                    page_meta['items'][key] = [dict(item, page_id=PAGE_TOKEN) for item in value
+                                               if isinstance(item, dict) and item.get('page_id') == page_id]
+                else:
+                    page_meta['fields'][key] = value
+            with open(os.path.join(tmp_dir, 'page_meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(page_meta, f, ensure_ascii=False)
+            size = len(text.encode('utf-8'))
+            for name in images.get(page_id, []):
+                shutil.copy2(os.path.join(subdir, name), os.path.join(tmp_dir, _normalize(name, page_id)))
+                size += os.path.getsize(os.path.join(subdir, name))
+            shutil.rmtree(page_dir, ignore_errors=True)
+            os.replace(tmp_dir, page_dir)
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO pages (hash, size, last_used) VALUES (?, ?, ?)',
+                                  (hashes[page_id], size, now))
+
+    def assemble(self, dest_subdir, pdf_base, hashes):
+        """
+        用缓存中的各页拼出与整本转换相同布局的输出目录（所有页都必须已在缓存中）。
+        先在临时目录中拼接，完成后再替换原来的输出，拼接失败时原来的输出保持不变。
+        """
+        tmp_dir = dest_subdir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        md_parts = []
+        meta = None
+        for page_id, page_hash in enumerate(hashes):
+            page_dir = self._page_dir(page_hash)
+            with open(os.path.join(page_dir, 'page.md'), 'r', encoding='utf-8') as f:
+                text = _denormalize(f.read(), page_id)
+            separator = PAGE_SEPARATOR.format(page_id)
+            md_parts.append(separator + '\n\n' + text if text else separator)
+            with open(os.path.join(page_dir, 'page_meta.json'), 'r', encoding='utf-8') as f:
+                page_meta = json.load(f)
+            if meta is None:
+                meta = dict(page_meta['fields'], **{key: [] for key in page_meta['items']})
+                meta = {key: meta[key] for key in page_meta['keys'] if key in meta}  # 保持原来的字段顺序
+            for key, items in page_meta['items'].items():
+                meta.setdefault(key, []).extend(dict(item, page_id=page_id) for item in items)
+            for name in os.listdir(page_dir):
+                if name.startswith('_page_'):
+                    dst = os.path.join(tmp_dir, _denormalize(name, page_id))
+                    try:
+                        os.link(os.path.join(page_dir, name), dst)
+                    except OSError:
+                        shutil.copy2(os.path.join(page_dir, name), dst)
+        with open(os.path.join(tmp_dir, f'{pdf_base}.md'), 'w', encoding='utf-8') as f:
+            f.write('\n\n'.join(md_parts))
+        if meta is not None:
+            with open(os.path.join(tmp_dir, f'{pdf_base}_meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, indent=4)
+        old_dir = dest_subdir + '.old'
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(dest_subdir):
+            os.replace(dest_subdir, old_dir)
+        os.replace(tmp_dir, dest_subdir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        self.touch(hashes)
+        return dest_subdir
+
+    def touch(self, hashes):
+        """把这些页标记为刚刚使用过，淘汰时最后考虑"""
+        now = time.time()
+        with self.conn:
+            self.conn.executemany('UPDATE pages SET last_used = ? WHERE hash = ?',
+                                  [(now, page_hash) for page_hash in hashes])
+
+    def evict(self):
+        """
+        缓存总大小超过max_bytes时，按最近使用时间从旧到新删除页面。
+        运行中还要拼接的页可能被删除，应在所有任务结束后调用。
+        """
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for page_hash, size in self.conn.execute('SELECT hash, size FROM pages ORDER BY last_used'):
+            if total <= self.max_bytes:
+                break
+            victims.append(page_hash)
+            total -= size
+        for page_hash in victims:
+            shutil.rmtree(self._page_dir(page_hash), ignore_errors=True)
+        with self.conn:
+            self.conn.executemany('DELETE FROM pages WHERE hash = ?', [(h,) for h in victims])
+
+    def close(self):
+        self.conn.close()
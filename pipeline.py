@@ -0,0 +1,258 @@
+import os
+import re
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from download_vehicle_specs import (DownloadStats, collect_pdf_tasks_from_url, create_session,
+                                    iter_pdf_downloads)
+import http_cache
+import metrics
+import rate_limiter
+from blob_store import BlobStore
+from marker_worker import MARKER_OPTIONS, MarkerSubprocessPool, MarkerWorkerPool
+from conversion_manifest import ConversionManifest, make_options_key
+from run_marker_batch import copy_duplicates, prepare_job, select_pdfs_to_convert
+from replace_md_images import replace_image_links_in_md
+from process_images import ImageStore
+from md_index import MarkdownIndex, default_index_path, load_catalog_metadata
+
+# 上游阶段结束的标记
+DONE = object()
+# 改写阶段每处理这么多个markdown保存一次图片仓库索引（与process_tree的批大小相同）
+IMAGE_INDEX_SAVE_EVERY = 256
+
+class StageStats:
+    """记录每个阶段处理数量和忙碌时间（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+        self.busy = {}
+
+    def add(self, stage, seconds=0.0, n=1):
+        with self._lock:
+            self.counts[stage] = self.counts.get(stage, 0) + n
+            self.busy[stage] = self.busy.get(stage, 0.0) + seconds
+        if seconds:
+            metrics.observe('pipeline.' + stage, seconds)
+
+    def report(self, elapsed):
+        for stage in ('download', 'convert', 'convert_failed', 'rewrite'):
+            print(f"{stage}: {self.counts.get(stage, 0)} 个, 累计 {self.busy.get(stage, 0.0):.1f}s")
+        print(f"流水线总耗时 {elapsed:.1f}s")
+        metrics.emit('pipeline.summary', counts=self.counts, busy=self.busy, elapsed=elapsed)
+
+def download_stage(tasks, pdf_queue, workers, per_host, session, blob_store, stats):
+    """下载阶段：每个PDF一下载完成就放入转换队列（队列满时阻塞，形成背压）"""
+    download_stats = DownloadStats()
+    try:
+        for _, (car_name, pdf_url, saved_path) in iter_pdf_downloads(tasks, workers, per_host, session,
+                                                                     blob_store, download_stats):
+            if saved_path:
+                stats.add('download')
+                pdf_queue.put(saved_path)
+    finally:
+        download_stats.report()
+        pdf_queue.put(DONE)
+
+def convert_stage(pdf_queue, md_queue, file_pattern, markdown_dir, marker_workers, manifest_path, stats):
+    """
+    转换阶段：从队列领取PDF，按转换清单判断是否需要转换，转换完成的markdown立即交给改写阶段。
+    清单的SQLite连接只在本线程内使用。
+    """
+    manifest = ConversionManifest(manifest_path or os.path.join(markdown_dir, '.marker_manifest.sqlite'))
+    options_key = make_options_key(MARKER_OPTIONS)
+    pool = MarkerWorkerPool(marker_workers) if marker_workers > 0 else MarkerSubprocessPool(1)
+    max_inflight = max(1, marker_workers) * 2
+    pending = {}  # future -> job
+    inflight = {}  # sha256 -> job
+    upstream_done = False
+    try:
+        while not upstream_done or pending:
+            # 在途任务已满时不再从队列取PDF，让背压传回下载阶段
+            if not upstream_done and len(pending) < max_inflight:
+                try:
+                    pdf_path = pdf_queue.get(timeout=0.2 if pending else None)
+                except queue.Empty:
+                    pdf_path = None
+                if pdf_path is DONE:
+                    upstream_done = True
+                elif pdf_path and re.search(file_pattern, os.path.basename(pdf_path)):
+                    for job in select_pdfs_to_convert([pdf_path], markdown_dir, manifest, options_key):
+                        running = inflight.get(job['sha256'])
+                        if running:
+                            # 相同内容正在转换中，完成后复制输出即可
+                            if job['output_subdir'] not in [running['output_subdir']] + running['duplicates']:
+                                running['duplicates'].append(job['output_subdir'])
+                            continue
+                        prepare_job(job, manifest, options_key)
+                        pending[pool.submit(job['pdf_path'], markdown_dir)] = job
+                        inflight[job['sha256']] = job
+            if not pending:
+                continue
+            finished, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = pending.pop(future)
+                inflight.pop(job['sha256'], None)
+                try:
+                    out_folder, duration = future.result()
+                except Exception as e:
+                    print(f"转换失败: {job['pdf_path']}, 错误: {e}")
+                    manifest.mark_failed(job['sha256'], options_key, job['pdf_path'], job['output_subdir'],
+                                         None, str(e))
+                    stats.add('convert_failed')
+                    continue
+                manifest.mark_done(job['sha256'], options_key, job['pdf_path'], job['output_subdir'],
+                                   duration, job['page_count'])
+                copy_duplicates(job)
+                stats.add('convert', duration)
+                print(f"转换完成: {job['pdf_path']} => {out_folder}")
+                for subdir in [job['output_subdir']] + job['duplicates']:
+                    md_path = os.path.join(subdir, os.path.basename(subdir) + '.md')
+                    if os.path.exists(md_path):
+                        md_queue.put(md_path)
+    finally:
+        # 出错退出时也要把上游队列取空，避免下载线程阻塞在put上
+        while not upstream_done:
+            upstream_done = pdf_queue.get() is DONE
+        pool.shutdown()
+        manifest.close()
+        md_queue.put(DONE)
+
+def rewrite_stage(md_queue, url_prefix, markdown_dir, stats, image_store=None, md_index=False, manifest_path=None):
+    """
+    改写阶段：只处理刚生成的markdown，不再遍历整个输出目录；有图片仓库时同时去重、压缩图片。
+    md_index为True时改写后立即加入全文索引（索引的SQLite连接只在本线程内使用）；
+    索引打不开时只打印错误、不建索引，本线程必须继续取队列，否则转换阶段会阻塞在已满的队列上。
+    """
+    index = None
+    if md_index:
+        try:
+            index = MarkdownIndex(default_index_path(markdown_dir))
+        except Exception as e:
+            print(f"全文索引不可用，本次不建索引: {e}")
+    manifest_path = manifest_path or os.path.join(markdown_dir, '.marker_manifest.sqlite')
+    unsaved = 0
+    try:
+        while True:
+            md_path = md_queue.get()
+            if md_path is DONE:
+                return
+            rewrite_one(md_path, url_prefix, markdown_dir, stats, image_store, index, manifest_path)
+            if image_store is not None:
+                # 图片仓库的索引整体重写，按批保存；结束时由ImageStore.close()保存剩余部分
+                unsaved += 1
+                if unsaved >= IMAGE_INDEX_SAVE_EVERY:
+                    unsaved = 0
+                    try:
+                        image_store.save()
+                    except Exception as e:
+                        print(f"图片仓库索引保存失败: {e}")
+    finally:
+        if index is not None:
+            index.close()
+
+def rewrite_one(md_path, url_prefix, markdown_dir, stats, image_store, index, manifest_path):
+    """改写一个markdown；出错只打印，不能让改写线程退出，否则上游会阻塞在已满的队列上"""
+    started = time.monotonic()
+    try:
+        if image_store is not None:
+            image_store.process_md_files([md_path])
+        elif url_prefix:
+            replace_image_links_in_md(md_path, url_prefix, markdown_dir)
+        if index is not None:
+            catalog = os.path.splitext(os.path.basename(md_path))[0]
+            meta = load_catalog_metadata(manifest_path, catalog=catalog).get(catalog, {})
+            index.index_file(md_path, meta.get('car_name'), catalog)
+    except Exception as e:
+        print(f"改写失败: {md_path}, 错误: {e}")
+    stats.add('rewrite', time.monotonic() - started)
+
+def run_pipeline(url, pattern, download_dir, file_pattern, markdown_dir, url_prefix=None, workers=4, per_host=4,
+                 marker_workers=0, queue_size=16, blob_store_dir=None, manifest_path=None, image_format=None,
+                 md_index=False):
+    """
+    下载→转换→改写图片链接 的流水线，各阶段之间用有界队列连接，网络和CPU时间相互重叠。
+    Args:
+        url (str): 说明书列表页面URL
+        pattern (str): PDF链接的正则表达式
+        download_dir (str): PDF保存目录
+        file_pattern (str): 需要转换的PDF文件名正则表达式
+        markdown_dir (str): marker输出目录
+        url_prefix (str): 图片url前缀，不传则不改写
+        workers (int): 下载线程数
+        per_host (int): 每个主机的最大并发下载数
+        marker_workers (int): 常驻marker worker数量，0表示逐个运行marker_single
+        queue_size (int): 阶段之间队列的容量
+        blob_store_dir (str): 按内容去重的PDF仓库目录（可选）
+        manifest_path (str): 转换清单路径（可选）
+        image_format (str): webp 或 avif，指定后图片去重压缩到 <markdown_dir>/_images 并改写为去重后的URL（需要url_prefix）
+        md_index (bool): 同时把生成的markdown加入全文索引 <markdown_dir>/.md_index.sqlite
+    """
+    started = time.monotonic()
+    stats = StageStats()
+    session = create_session(pool_size=max(workers, per_host))
+    blob_store = BlobStore(blob_store_dir) if blob_store_dir else None
+    tasks = collect_pdf_tasks_from_url(url, pattern, download_dir, session)
+    print(f"列表页共 {len(tasks)} 个PDF")
+    pdf_queue = queue.Queue(maxsize=queue_size)
+    md_queue = queue.Queue(maxsize=queue_size)
+    image_store = None
+    if image_format and url_prefix:
+        image_store = ImageStore(markdown_dir, url_prefix, fmt=image_format, workers=os.cpu_count() or 1)
+    threads = [
+        threading.Thread(target=download_stage, name='download',
+                         args=(tasks, pdf_queue, workers, per_host, session, blob_store, stats)),
+        threading.Thread(target=convert_stage, name='convert',
+                         args=(pdf_queue, md_queue, file_pattern, markdown_dir, marker_workers, manifest_path, stats)),
+        threading.Thread(target=rewrite_stage, name='rewrite',
+                         args=(md_queue, url_prefix, markdown_dir, stats, image_store, md_index, manifest_path)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if blob_store is not None:
+        blob_store.close()
+    if image_store is not None:
+        image_store.close()
+        image_store.report()
+    stats.report(time.monotonic() - started)
+    return stats
+
+if __name__ == '__main__':
+    '''
+    python pipeline.py --url https://xxxx/request/webcatalog/welcab/ --pattern '^/pages/contents/request/webcatalog/.+\\.pdf$' --download-dir /home/webcatalog/catalogs --file-pattern '^.+welcab.+\\.pdf$' --markdown-dir /home/webcatalog/markdown --url-prefix http://xxxx/site2507/
+    '''
+    parser = argparse.ArgumentParser(description='下载、转换Markdown、替换图片链接一次完成的流水线')
+    parser.add_argument('--url', required=True, help='说明书列表页面URL')
+    parser.add_argument('--pattern', required=True, help='PDF链接的正则表达式')
+    parser.add_argument('--download-dir', required=True, help='PDF保存目录')
+    parser.add_argument('--file-pattern', default=r'\.pdf$', help='需要转换的PDF文件名正则表达式')
+    parser.add_argument('--markdown-dir', required=True, help='marker输出目录')
+    parser.add_argument('--url-prefix', help='图片url前缀，不指定则不替换图片链接')
+    parser.add_argument('--workers', type=int, default=4, help='下载线程数')
+    parser.add_argument('--per-host', type=int, default=4, help='每个主机的最大并发下载数')
+    parser.add_argument('--marker-workers', type=int, default=0, help='常驻marker worker数量，0表示逐个运行marker_single')
+    parser.add_argument('--queue-size', type=int, default=16, help='阶段之间队列的容量')
+    parser.add_argument('--blob-store', help='按内容sha256去重的PDF仓库目录')
+    parser.add_argument('--manifest', help='转换清单(SQLite)路径，默认 <markdown-dir>/.marker_manifest.sqlite')
+    parser.add_argument('--image-format', choices=['webp', 'avif'], help='图片去重并压缩为该格式，md链接改写为去重后的URL（需要--url-prefix）')
+    parser.add_argument('--md-index', action='store_true', help='同时更新全文索引 <markdown-dir>/.md_index.sqlite（用md_index.py检索）')
+    http_cache.add_cache_arguments(parser)
+    rate_limiter.add_scheduler_arguments(parser)
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+    http_cache.configure_from_args(args)
+    rate_limiter.configure_from_args(args)
+    metrics.configure_from_args(args)
+    stats = run_pipeline(args.url, args.pattern, args.download_dir, args.file_pattern, args.markdown_dir,
+                         args.url_prefix, args.workers, args.per_host, args.marker_workers, args.queue_size,
+                         args.blob_store, args.manifest, args.image_format, args.md_index)
+    rate_limiter.print_summary()
+    metrics.close()
+    if stats.counts.get('convert_failed'):
+        raise SystemExit(1)
@@ -0,0 +1,291 @@
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from conversion_manifest import sha256_of_file
+from replace_md_images import ABSOLUTE_LINK_RE, IMAGE_LINK_RE, atomic_write_text, iter_md_files
+
+# 各格式的默认压缩质量
+DEFAULT_QUALITY = {'webp': 80, 'avif': 60}
+STORE_INDEX_FILENAME = 'index.json'
+
+def check_format(fmt):
+    """确认Pillow支持输出格式，AVIF需要Pillow 11.3+ 或 pillow-avif-plugin"""
+    from PIL import features
+    if fmt == 'avif' and not features.check('avif'):
+        try:
+            import pillow_avif  # noqa: F401
+        except ImportError:
+            raise RuntimeError('当前Pillow不支持AVIF，请升级Pillow或安装 pillow-avif-plugin')
+    if fmt == 'webp' and not features.check('webp'):
+        raise RuntimeError('当前Pillow不支持WebP')
+
+def _save_atomic(img, path, fmt, quality):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    img.save(tmp_path, format=fmt.upper(), quality=quality)
+    os.replace(tmp_path, path)
+
+def _process_image(src_path, dest_base, thumb_base, fmt, quality, thumb_size):
+    """
+    进程池中执行：把一张图片压缩为fmt格式并生成缩略图。
+    压缩后反而变大的图片（如很小的图标）保留原文件。
+    Args:
+        src_path (str): 原图路径
+        dest_base (str): 输出路径（不含扩展名）
+        thumb_base (str): 缩略图路径（不含扩展名）
+        fmt (str): webp 或 avif
+        quality (int): 压缩质量
+        thumb_size (int): 缩略图最长边像素，0表示不生成
+    Returns:
+        dict: {"file", "thumb", "width", "height", "bytes_in", "bytes_out"}
+    """
+    import shutil
+    from PIL import Image
+    with Image.open(src_path) as img:
+        img.load()
+        width, height = img.size
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or img.mode == 'P' else 'RGB')
+        dest_path = f'{dest_base}.{fmt}'
+        _save_atomic(img, dest_path, fmt, quality)
+        bytes_in = os.path.getsize(src_path)
+        if os.path.getsize(dest_path) >= bytes_in:
+            os.remove(dest_path)
+            dest_path = dest_base + os.path.splitext(src_path)[1].lower()
+            shutil.copyfile(src_path, dest_path + '.tmp')
+            os.replace(dest_path + '.tmp', dest_path)
+        thumb_path = dest_path
+        if thumb_size and max(width, height) > thumb_size:
+            thumb = img.copy()
+            thumb.thumbnail((thumb_size, thumb_size))
+            thumb_path = f'{thumb_base}.{fmt}'
+            _save_atomic(thumb, thumb_path, fmt, quality)
+    return {'file': dest_path, 'thumb': thumb_path, 'width': width, 'height': height,
+            'bytes_in': bytes_in, 'bytes_out': os.path.getsize(dest_path)}
+
+class ImageStore:
+    """
+    marker提取图片的后处理：整个输出目录中内容相同的图片只保存一份，
+    压缩为WebP/AVIF并生成缩略图，同时把markdown中的图片链接改写为去重后的URL。
+    store_dir/
+        <sha[:2]>/<sha>.webp          按原图sha256保存的压缩图
+        thumbs/<sha[:2]>/<sha>.webp   缩略图
+        index.json                    原图哈希缓存、已处理图片、已改写的md（增量运行）
+    """
+
+    def __init__(self, root_folder, url_prefix, store_dir=None, fmt='webp', quality=None, thumb_size=320,
+                 workers=1, link_thumbnails=False):
+        check_format(fmt)
+        self.root_folder = root_folder
+        self.url_prefix = url_prefix.rstrip('/')
+        self.store_dir = store_dir or os.path.join(root_folder, '_images')
+        rel_store = os.path.relpath(self.store_dir, root_folder)
+        if rel_store.startswith('..'):
+            raise ValueError('图片仓库目录必须位于根目录之下，才能用url前缀访问')
+        self.fmt = fmt
+        self.quality = quality or DEFAULT_QUALITY[fmt]
+        self.thumb_size = thumb_size
+        self.workers = max(1, workers)
+        self.link_thumbnails = link_thumbnails
+        self.settings = f'{fmt}:{self.quality}:{thumb_size}'
+        self.stats = {'md': 0, 'md_changed': 0, 'links': 0, 'missing': 0, 'processed': 0, 'failed': 0,
+                      'bytes_in': 0, 'bytes_out': 0}
+        self._executor = None
+        self.index = {'settings': self.settings, 'hashes': {}, 'images': {}, 'md': {}}
+        try:
+            with open(os.path.join(self.store_dir, STORE_INDEX_FILENAME), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            self.index['hashes'] = index.get('hashes', {})
+            self.index['md'] = index.get('md', {})
+            if index.get('settings') == self.settings:
+                self.index['images'] = index.get('images', {})
+        except (OSError, ValueError):
+            pass
+
+    def url_for(self, path):
+        return '{}/{}'.format(self.url_prefix, os.path.relpath(path, self.root_folder).replace(os.sep, '/'))
+
+    def _resolve(self, link, md_dir):
+        """把markdown中的图片链接解析为本地文件路径；已改写为url前缀的链接也还原为本地路径"""
+        if link.startswith(self.url_prefix + '/'):
+            path = os.path.join(self.root_folder, link[len(self.url_prefix) + 1:])
+        elif ABSOLUTE_LINK_RE.match(link):
+            return None
+        else:
+            path = os.path.join(md_dir, link)
+        path = os.path.normpath(path)
+        store_dir = os.path.abspath(self.store_dir)
+        if os.path.commonpath([os.path.abspath(path), store_dir]) == store_dir:
+            return None  # 已经指向仓库中的图片
+        return path
+
+    def _file_sha256(self, path):
+        """按 (大小, mtime) 缓存原图的sha256"""
+        st = os.stat(path)
+        key = os.path.relpath(path, self.root_folder)
+        cached = self.index['hashes'].get(key)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        digest = sha256_of_file(path)
+        self.index['hashes'][key] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def _ensure_processed(self, sources):
+        """把尚未处理的图片（{sha: 原图路径}）交给进程池压缩"""
+        todo = [(sha, path) for sha, path in sources.items()
+                if sha not in self.index['images']
+                or not os.path.exists(os.path.join(self.store_dir, self.index['images'][sha]['file']))]
+        if not todo:
+            return
+        args = [(path, os.path.join(self.store_dir, sha[:2], sha),
+                 os.path.join(self.store_dir, 'thumbs', sha[:2], sha),
+                 self.fmt, self.quality, self.thumb_size) for sha, path in todo]
+        if self.workers > 1:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            futures = [self._executor.submit(_process_image, *a) for a in args]
+            results = (future.result for future in futures)
+        else:
+            results = (lambda a=a: _process_image(*a) for a in args)
+        for (sha, path), get_result in zip(todo, results):
+            try:
+                result = get_result()
+            except Exception as e:
+                # 无法解码的图片保留原链接
+                print(f"图片处理失败: {path}, 错误: {e}")
+                self.stats['failed'] += 1
+                continue
+            for key in ('file', 'thumb'):
+                result[key] = os.path.relpath(result[key], self.store_dir)
+            self.index['images'][sha] = result
+            self.stats['processed'] += 1
+            self.stats['bytes_in'] += result['bytes_in']
+            self.stats['bytes_out'] += result['bytes_out']
+
+    def process_md_files(self, md_paths):
+        """
+        处理一批md文件：解析其中的图片、去重压缩，并改写图片链接。
+        Returns:
+            int: 内容有变化的md数
+        """
+        parsed = []
+        sources = {}
+        for md_path in md_paths:
+            with open(md_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            md_dir = os.path.dirname(md_path)
+            link_sha = {}
+            for m in IMAGE_LINK_RE.finditer(content):
+                link = m.group(1)
+                path = self._resolve(link, md_dir)
+                if path is None or link in link_sha:
+                    continue
+                if not os.path.isfile(path):
+                    self.stats['missing'] += 1
+                    continue
+                sha = self._file_sha256(path)
+                link_sha[link] = sha
+                sources.setdefault(sha, path)
+            parsed.append((md_path, content, link_sha))
+        self._ensure_processed(sources)
+
+        changed = 0
+        for md_path, content, link_sha in parsed:
+            def replacer(match):
+                image = self.index['images'].get(link_sha.get(match.group(1)))
+                if image is None:
+                    return match.group(0)
+                self.stats['links'] += 1
+                url = self.url_for(os.path.join(self.store_dir, image['file']))
+                if self.link_thumbnails and image['thumb'] != image['file']:
+                    thumb_url = self.url_for(os.path.join(self.store_dir, image['thumb']))
+                    return '[![]({})]({})'.format(thumb_url, url)
+                return '![]({})'.format(url)
+            new_content = IMAGE_LINK_RE.sub(replacer, content)
+            if new_content != content:
+                atomic_write_text(md_path, new_content)
+                changed += 1
+            st = os.stat(md_path)
+            self.index['md'][os.path.relpath(md_path, self.root_folder)] = [st.st_mtime_ns, st.st_size, self.settings]
+            self.stats['md'] += 1
+        self.stats['md_changed'] += changed
+        return changed
+
+    def process_tree(self, batch_size=256):
+        """处理root_folder下所有md；上次处理后未修改的md直接跳过"""
+        todo = []
+        skipped = 0
+        for md_path, st in iter_md_files(self.root_folder):
+            entry = self.index['md'].get(os.path.relpath(md_path, self.root_folder))
+            if entry and entry == [st.st_mtime_ns, st.st_size, self.settings]:
+                skipped += 1
+                continue
+            todo.append(md_path)
+        for i in range(0, len(todo), batch_size):
+            self.process_md_files(todo[i:i + batch_size])
+            self.save()
+        return skipped
+
+    def save(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        atomic_write_text(os.path.join(self.store_dir, STORE_INDEX_FILENAME), json.dumps(self.index, ensure_ascii=False))
+
+    def report(self):
+        s = self.stats
+        saved = s['bytes_in'] - s['bytes_out']
+        print(f"md {s['md']} 个（改写 {s['md_changed']} 个），图片链接 {s['links']} 个，仓库中不重复图片 {len(self.index['images'])} 张，"
+              f"本次压缩 {s['processed']} 张，{s['bytes_in'] / 1048576:.1f}MB -> {s['bytes_out'] / 1048576:.1f}MB"
+              f"（节省 {saved / 1048576:.1f}MB），找不到的图片 {s['missing']} 个，处理失败 {s['failed']} 张")
+        metrics.emit('images.summary', unique_images=len(self.index['images']), **s)
+
+    def close(self):
+        self.save()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def remove_original_images(root_folder, store_dir):
+    """删除已进入仓库的原图（只删除索引中记录过哈希的文件）"""
+    with open(os.path.join(store_dir, STORE_INDEX_FILENAME), 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    removed = 0
+    for rel_path, (size, mtime_ns, sha) in index['hashes'].items():
+        path = os.path.join(root_folder, rel_path)
+        if sha in index['images'] and os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    print(f"已删除原图 {removed} 张")
+
+if __name__ == '__main__':
+    '''
+    python process_images.py --root-folder /Volumes/Seagate/work/robot/webcatalog/workspace --url-prefix http://xxxx/site2507/ --format webp --workers 8
+    '''
+    parser = argparse.ArgumentParser(description='marker图片后处理：去重、压缩为WebP/AVIF、生成缩略图并改写md中的图片链接')
+    parser.add_argument('--root-folder', required=True, help='marker输出根目录')
+    parser.add_argument('--url-prefix', required=True, help='图片url前缀（对应根目录）')
+    parser.add_argument('--store-dir', help='去重后图片的保存目录（需在根目录下），默认 <root-folder>/_images')
+    parser.add_argument('--format', choices=['webp', 'avif'], default='webp', help='压缩格式')
+    parser.add_argument('--quality', type=int, help='压缩质量，默认 webp 80 / avif 60')
+    parser.add_argument('--thumb-size', type=int, default=320, help='缩略图最长边像素，0表示不生成')
+    parser.add_argument('--link-thumbnails', action='store_true', help='md中显示缩略图，点击链接到原图')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='压缩图片的进程数')
+    parser.add_argument('--remove-originals', action='store_true', help='处理完成后删除已进入仓库的原图')
+    metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure_from_args(args)
+    with ImageStore(args.root_folder, args.url_prefix, args.store_dir, args.format, args.quality,
+                    args.thumb_size, args.workers, args.link_thumbnails) as store:
+        skipped = store.process_tree()
+        store.report()
+        print(f"未修改跳过 {skipped} 个md")
+    if args.remove_originals:
+        remove_original_images(args.root_folder, store.store_dir)
+    metrics.close()
@@ -0,0 +1,241 @@
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+import metrics
+
+# 视为临时性错误、可以重试的HTTP状态码
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# 表示被限流的状态码：降低并发，并遵守Retry-After
+THROTTLE_STATUSES = {429, 503}
+
+def parse_retry_after(value):
+    """
+    解析Retry-After头（秒数或HTTP日期）。
+    Returns:
+        float: 需要等待的秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class HostState:
+    """
+    单个主机的令牌桶 + AIMD并发控制。
+    - 令牌桶限制请求速率（rate个/秒，最多积攒burst个）
+    - 延迟正常时并发上限每个"窗口"加1；出错或被限流时减半
+    """
+
+    def __init__(self, rate, burst, initial_concurrency, min_concurrency, max_concurrency, latency_factor):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.limit = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.latency_factor = latency_factor
+        self.latency_ewma = None
+        self.latency_floor = None
+        self.active = 0
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+        self.stats = {'requests': 0, 'retries': 0, 'errors': 0, 'throttled': 0, 'throttled_time': 0.0}
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def acquire(self):
+        """等待并发名额和令牌，返回等待的秒数"""
+        started = time.monotonic()
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.active >= int(self.limit):
+                    wait = None
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate if self.rate > 0 else 0.1
+                else:
+                    self.tokens -= 1
+                    self.active += 1
+                    self.stats['requests'] += 1
+                    waited = now - started
+                    self.stats['throttled_time'] += waited
+                    return waited
+                self.cond.wait(wait)
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def on_success(self, latency):
+        with self.cond:
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+            self.latency_floor = self.latency_ewma if self.latency_floor is None else min(self.latency_floor, self.latency_ewma)
+            if self.latency_ewma <= self.latency_floor * self.latency_factor:
+                # 加性增长：大约每个并发窗口+1
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            else:
+                # 延迟明显变差，停止增长并轻微回落
+                self.limit = max(self.min_concurrency, self.limit * 0.9)
+            self.cond.notify_all()
+
+    def on_failure(self, throttled=False, retry_after=None):
+        with self.cond:
+            self.stats['errors'] += 1
+            if throttled:
+                self.stats['throttled'] += 1
+            # 乘性减小
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            if retry_after:
+                # Retry-After对该主机的所有请求生效
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.cond.notify_all()
+
+    def note_wait(self, seconds, retry=True):
+        with self.cond:
+            if retry:
+                self.stats['retries'] += 1
+            self.stats['throttled_time'] += seconds
+
+class RequestScheduler:
+    """
+    所有脚本共用的请求调度器：按主机限速、自适应并发、带抖动的指数退避重试，并遵守429/503的Retry-After。
+    并发名额在收到响应头后即释放；stream=True时正文的读取不占用名额。
+    """
+
+    def __init__(self, rate=10.0, burst=10, initial_concurrency=2, min_concurrency=1, max_concurrency=16,
+                 max_retries=4, backoff=0.5, max_backoff=60.0, latency_factor=2.0):
+        self.rate = rate
+        self.burst = burst
+        self.initial_concurrency = initial_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latency_factor = latency_factor
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host(self, url):
+        netloc = urlparse(url).netloc
+        with self._lock:
+            if netloc not in self._hosts:
+                self._hosts[netloc] = HostState(self.rate, self.burst, self.initial_concurrency,
+                                                self.min_concurrency, self.max_concurrency, self.latency_factor)
+            return self._hosts[netloc]
+
+    def backoff_delay(self, attempt):
+        """带完全抖动的指数退避"""
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def sleep_before_retry(self, url, attempt, retry_after=None):
+        """重试前等待（优先使用Retry-After），并计入该主机的统计"""
+        delay = retry_after if retry_after is not None else self.backoff_delay(attempt)
+        self.host(url).note_wait(delay)
+        time.sleep(delay)
+
+    def request(self, session, method, url, max_retries=None, **kwargs):
+        """
+        发送请求，遇到网络错误或可重试的状态码时自动重试。
+        最后一次仍失败时：网络错误抛出异常，错误状态码返回响应交给调用方处理。
+        Args:
+            session (requests.Session): 会话，None时使用requests模块
+            method (str): HTTP方法
+            url (str): URL
+            max_retries (int): 覆盖默认的最大重试次数
+        Returns:
+            requests.Response
+        """
+        http = session or requests
+        max_retries = self.max_retries if max_retries is None else max_retries
+        host = self.host(url)
+        for attempt in range(max_retries + 1):
+            host.acquire()
+            started = time.monotonic()
+            try:
+                resp = http.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                host.release()
+                metrics.observe('http.request', time.monotonic() - started, method=method, url=url,
+                                status=type(e).__name__, attempt=attempt)
+                host.on_failure()
+                if attempt == max_retries:
+                    raise
+                self.sleep_before_retry(url, attempt)
+                continue
+            host.release()
+            latency = time.monotonic() - started
+            metrics.observe('http.request', latency, method=method, url=url, status=resp.status_code, attempt=attempt)
+            if resp.status_code in RETRY_STATUSES:
+                retry_after = parse_retry_after(resp.headers.get('retry-after'))
+                host.on_failure(resp.status_code in THROTTLE_STATUSES, retry_after)
+                if attempt == max_retries:
+                    return resp
+                resp.close()
+                self.sleep_before_retry(url, attempt, retry_after)
+                continue
+            host.on_success(latency)
+            return resp
+
+    def summary(self):
+        """
+        Returns:
+            dict: {host: {"requests", "retries", "errors", "throttled", "throttled_time", "concurrency"}}
+        """
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {name: dict(state.stats, concurrency=round(state.limit, 2)) for name, state in hosts.items()}
+
+    def print_summary(self, file=None):
+        for name, stats in sorted(self.summary().items()):
+            metrics.emit('http.host_summary', host=name, **stats)
+            print(f"[{name}] 请求 {stats['requests']} 次, 重试 {stats['retries']} 次, 错误 {stats['errors']} 次, "
+                  f"限流 {stats['throttled']} 次, 等待 {stats['throttled_time']:.1f}s, 最终并发 {stats['concurrency']}", file=file)
+
+_default_scheduler = RequestScheduler()
+
+def get_scheduler():
+    return _default_scheduler
+
+def request(session, method, url, **kwargs):
+    """通过全局调度器发送请求"""
+    return _default_scheduler.request(session, method, url, **kwargs)
+
+def configure(rate=None, max_concurrency=None, max_retries=None):
+    """修改全局调度器的设置，未传的参数保持不变"""
+    if rate is not None:
+        _default_scheduler.rate = rate
+        _default_scheduler.burst = max(1, int(rate))
+    if max_concurrency is not None:
+        _default_scheduler.max_concurrency = max_concurrency
+    if max_retries is not None:
+        _default_scheduler.max_retries = max_retries
+
+def add_scheduler_arguments(parser):
+    """给命令行加上限速相关参数"""
+    parser.add_argument('--rate', type=float, help='每个主机每秒最多请求数，默认10')
+    parser.add_argument('--max-concurrency', type=int, help='每个主机自适应并发的上限，默认16')
+    parser.add_argument('--max-retries', type=int, help='临时错误的最大重试次数，默认4')
+
+def configure_from_args(args):
+    configure(args.rate, args.max_concurrency, args.max_retries)
+
+def print_summary(file=None):
+    _default_scheduler.print_summary(file)
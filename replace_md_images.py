@@ -1,39 +1,150 @@
 import os
 import re
+import json
+import time
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-def replace_image_links_in_md(md_path, url_prefix, root_folder):
+import metrics
+
+# 匹配 ![](...) 形式的图片引用
+IMAGE_LINK_RE = re.compile(r'!\[]\(([^)]+)\)')
+# 已经是绝对地址（http://、//、/ 开头等）的链接不再加前缀，保证重复运行结果不变
+ABSOLUTE_LINK_RE = re.compile(r'^(?:[a-zA-Z][a-zA-Z0-9+.-]*:|/)')
+INDEX_FILENAME = '.md_images_index.json'
+
+def rewrite_image_links(content, url_prefix, rel_dir):
+    """
+    把content中的相对图片引用替换为 url前缀/子文件夹/文件名。
+    Args:
+        content (str): markdown内容
+        url_prefix (str): 图片url前缀
+        rel_dir (str): md文件所在目录相对根目录的路径
+    Returns:
+        str: 替换后的内容
+    """
+    prefix = url_prefix.rstrip('/')
+    if rel_dir != '.':
+        prefix = '{}/{}'.format(prefix, rel_dir.strip('.'))
+
+    def replacer(match):
+        img_name = match.group(1)
+        # 已加过前缀的链接不再处理：绝对地址，或相对前缀（如static/img）开头的链接
+        if ABSOLUTE_LINK_RE.match(img_name) or img_name.startswith(prefix + '/'):
+            return match.group(0)
+        return '![]({}/{})'.format(prefix, img_name.lstrip('./'))
+    return IMAGE_LINK_RE.sub(replacer, content)
+
+def atomic_write_text(path, content):
+    """先写临时文件再改名，中途中断不会留下写了一半的md"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def replace_image_links_in_md(md_path, url_prefix, root_folder, verbose=True):
     """
     替换md文件中所有图片引用为指定url前缀+文件名
+    Returns:
+        bool: 文件内容是否有变化
     """
     with open(md_path, 'r', encoding='utf-8') as f:
         content = f.read()
-    # 匹配 ![](...) 形式的图片引用
-    def replacer(match):
-        img_name = match.group(1)
-        # 获取相对子文件夹路径
-        rel_dir = os.path.relpath(os.path.dirname(md_path), root_folder)
-        # 拼接子文件夹和图片文件名
-        img_url = '{}/{}/{}'.format(url_prefix.rstrip('/'), rel_dir.strip('.'), img_name.lstrip('./')) if rel_dir != '.' else '{}/{}'.format(url_prefix.rstrip('/'), img_name.lstrip('./'))
-        return '![]({})'.format(img_url)
-    new_content = re.sub(r'!\[]\(([^)]+)\)', replacer, content)
-    if new_content != content:
-        with open(md_path, 'w', encoding='utf-8') as f:
-            f.write(new_content)
-        print(f"已处理: {md_path}")
-    else:
-        print(f"无变化: {md_path}")
-
-def batch_replace_md_images(root_folder, url_prefix):
-    for subdir, dirs, files in os.walk(root_folder):
-        for file in files:
-            if file.endswith('.md'):
-                md_path = os.path.join(subdir, file)
-                replace_image_links_in_md(md_path, url_prefix, root_folder)
+    # 获取相对子文件夹路径
+    rel_dir = os.path.relpath(os.path.dirname(md_path), root_folder)
+    new_content = rewrite_image_links(content, url_prefix, rel_dir)
+    changed = new_content != content
+    if changed:
+        atomic_write_text(md_path, new_content)
+    if verbose:
+        print(f"已处理: {md_path}" if changed else f"无变化: {md_path}")
+    return changed
+
+def _rewrite_worker(md_path, url_prefix, root_folder):
+    """进程池中执行的改写任务，返回改写后的文件状态供主进程更新索引"""
+    started = time.monotonic()
+    changed = replace_image_links_in_md(md_path, url_prefix, root_folder, verbose=False)
+    st = os.stat(md_path)
+    return md_path, changed, st.st_mtime_ns, st.st_size, time.monotonic() - started
+
+def load_index(root_folder):
+    """读取改写索引 {相对路径: {"mtime_ns", "size", "url_prefix"}}"""
+    try:
+        with open(os.path.join(root_folder, INDEX_FILENAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_index(root_folder, index):
+    index_path = os.path.join(root_folder, INDEX_FILENAME)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, index_path)
+
+def iter_md_files(root_folder):
+    """用scandir遍历，顺带取得stat，避免额外的系统调用"""
+    stack = [root_folder]
+    while stack:
+        folder = stack.pop()
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.md') and entry.is_file():
+                    yield entry.path, entry.stat()
+
+def batch_replace_md_images(root_folder, url_prefix, workers=1):
+    """
+    批量替换root_folder下所有md文件的图片链接。
+    索引中记录了上次用同一url前缀改写后的mtime和大小，未变化的文件不再读取。
+    Args:
+        root_folder (str): 根目录
+        url_prefix (str): 图片url前缀
+        workers (int): 并行进程数
+    """
+    index = load_index(root_folder)
+    todo = []
+    skipped = 0
+    for md_path, st in iter_md_files(root_folder):
+        entry = index.get(os.path.relpath(md_path, root_folder))
+        if (entry and entry['url_prefix'] == url_prefix
+                and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size):
+            skipped += 1
+            continue
+        todo.append(md_path)
+    changed_count = 0
+
+    def record(md_path, changed, mtime_ns, size, seconds):
+        index[os.path.relpath(md_path, root_folder)] = {'mtime_ns': mtime_ns, 'size': size, 'url_prefix': url_prefix}
+        metrics.observe('rewrite.md', seconds, md_path=md_path, changed=changed)
+        print(f"已处理: {md_path}" if changed else f"无变化: {md_path}")
+        return changed
+
+    try:
+        if workers <= 1:
+            for md_path in todo:
+                changed_count += record(*_rewrite_worker(md_path, url_prefix, root_folder))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(_rewrite_worker, todo, [url_prefix] * len(todo), [root_folder] * len(todo),
+                                       chunksize=32)
+                for result in results:
+                    changed_count += record(*result)
+    finally:
+        # 中断时也保存已完成部分的索引，下次从剩余文件继续
+        save_index(root_folder, index)
+    print(f"共 {len(todo) + skipped} 个md，改写 {changed_count} 个，无变化 {len(todo) - changed_count} 个，索引跳过 {skipped} 个")
+    metrics.emit('rewrite.summary', files=len(todo) + skipped, changed=changed_count,
+                 unchanged=len(todo) - changed_count, skipped=skipped)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='批量替换md文件中的图片链接为指定url前缀')
     parser.add_argument('--root-folder', required=True, help='根目录，包含若干子文件夹，每个子文件夹下有md文件')
     parser.add_argument('--url-prefix', required=True, help='图片url前缀')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='并行进程数')
+    metrics.add_metrics_arguments(parser)
     args = parser.parse_args()
-    batch_replace_md_images(args.root_folder, args.url_prefix)
+    metrics.configure_from_args(args)
+    batch_replace_md_images(args.root_folder, args.url_prefix, args.workers)
+    metrics.close()
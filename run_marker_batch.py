@@ -1,40 +1,638 @@
 import os
 import re
+import json
+import time
+import heapq
+import shutil
 import subprocess
 import argparse
+from concurrent.futures import FIRST_COMPLETED, wait
 
-def run_marker_on_matched_pdfs(scan_folder, file_pattern, output_dir):
+import metrics
+
+from marker_worker import (MARKER_OPTIONS, MarkerSubprocessPool, MarkerWorkerPool, build_marker_cmd,
+                           default_threads_per_worker)
+from conversion_manifest import ConversionManifest, make_options_key
+from lease_queue import LeaseQueue, make_job_key, print_merged_status
+from page_cache import PageCache, format_page_range, output_depends_on_context, page_hashes
+
+# 没有历史转换记录时的每页耗时（秒）
+DEFAULT_SECONDS_PER_PAGE = 2.0
+# 转换时每页的预估内存(MB)，以及每个进程加载marker模型的预估内存(MB)
+DEFAULT_MEMORY_PER_PAGE_MB = 32
+DEFAULT_MODEL_MEMORY_MB = 3072
+# 读不出页数时，按文件大小估算页数
+BYTES_PER_PAGE_GUESS = 200 * 1024
+
+def find_matched_pdfs(scan_folder, file_pattern):
     """
-    扫描scan_folder下所有子文件夹，匹配PDF文件，依次运行marker_single命令。
+    扫描scan_folder下所有子文件夹，返回文件名匹配的PDF路径。
     Args:
         scan_folder (str): 根目录
         file_pattern (str): 文件名正则表达式
-        output_dir (str): marker_single输出目录
+    Returns:
+        list: [pdf_path, ...]
     """
+    pdf_paths = []
     for root, dirs, files in os.walk(scan_folder):
+        # 跳过 .blobs、.shards 等内部目录
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
         for f in files:
             if re.search(file_pattern, f):
-                pdf_path = os.path.join(root, f)
-                pdf_base = os.path.splitext(f)[0]
-                output_subdir = os.path.join(output_dir, pdf_base)
-                if os.path.exists(output_subdir):
-                    print(f"已存在输出目录，跳过: {output_subdir}")
-                    continue
-                cmd = [
-                    'marker_single',
-                    pdf_path,
-                    '--output_format', 'markdown',
-                    '--output_dir', output_dir,
-                    '--paginate_output',
-                    '--format_lines'
-                ]
-                print(f"运行: {' '.join(cmd)}")
+                pdf_paths.append(os.path.join(root, f))
+    return pdf_paths
+
+def select_pdfs_to_convert(pdf_paths, output_dir, manifest, options_key, adopt_existing=False):
+    """
+    根据转换清单挑出需要转换的PDF：新增、内容已变化、上次失败或中断的PDF。
+    Args:
+        pdf_paths (list): 候选PDF路径
+        output_dir (str): marker_single输出目录
+        manifest (ConversionManifest): 转换清单
+        options_key (str): 转换参数标识
+        adopt_existing (bool): 清单中没有记录但已有输出markdown时，直接登记为已完成
+    Returns:
+        list: [{"pdf_path", "sha256", "output_subdir", "reason", "duplicates"}, ...]
+        内容相同的PDF只生成一个任务，其余文件的输出目录记录在duplicates中，转换完成后直接复制。
+    """
+    jobs = []
+    jobs_by_sha = {}
+    for pdf_path in pdf_paths:
+        pdf_base = os.path.splitext(os.path.basename(pdf_path))[0]
+        output_subdir = os.path.join(output_dir, pdf_base)
+        sha256 = manifest.file_sha256(pdf_path)
+        if sha256 in jobs_by_sha:
+            job = jobs_by_sha[sha256]
+            if output_subdir != job['output_subdir'] and output_subdir not in job['duplicates']:
+                job['duplicates'].append(output_subdir)
+            print(f"内容重复，只转换一次: {pdf_path}")
+            continue
+        record = manifest.get(sha256, options_key)
+        if record and record['status'] == 'done' and os.path.exists(output_subdir):
+            print(f"已转换，跳过: {pdf_path}")
+            continue
+        if record and record['status'] == 'done' and os.path.exists(record['output_subdir']):
+            # 同样内容已以其他文件名转换过，复制输出即可
+            copy_converted_output(record['output_subdir'], output_subdir)
+            print(f"内容已转换，复制输出: {record['output_subdir']} => {output_subdir}")
+            continue
+        if record is None and adopt_existing and os.path.exists(os.path.join(output_subdir, f'{pdf_base}.md')):
+            manifest.mark_done(sha256, options_key, pdf_path, output_subdir)
+            print(f"登记已有输出: {output_subdir}")
+            continue
+        if record is None:
+            reason = 'changed' if manifest.has_other_version(pdf_path, sha256, options_key) else 'new'
+        else:
+            reason = {'failed': 'failed', 'running': 'interrupted'}.get(record['status'], 'output_missing')
+        job = {'pdf_path': pdf_path, 'sha256': sha256, 'output_subdir': output_subdir, 'reason': reason,
+               'duplicates': []}
+        jobs.append(job)
+        jobs_by_sha[sha256] = job
+    return jobs
+
+def copy_converted_output(src_subdir, dst_subdir):
+    """
+    把一个PDF的转换结果复制为另一个文件名的输出目录（<名>.md、<名>_meta.json随目录名改名）。
+    图片用硬链接节省空间，markdown和meta.json复制一份，以便后续单独改写。
+    """
+    src_base = os.path.basename(src_subdir)
+    dst_base = os.path.basename(dst_subdir)
+    tmp_dir = dst_subdir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name in os.listdir(src_subdir):
+        src_path = os.path.join(src_subdir, name)
+        if name in (f'{src_base}.md', f'{src_base}_meta.json'):
+            shutil.copy2(src_path, os.path.join(tmp_dir, dst_base + name[len(src_base):]))
+            continue
+        try:
+            os.link(src_path, os.path.join(tmp_dir, name))
+        except OSError:
+            shutil.copy2(src_path, os.path.join(tmp_dir, name))
+    if os.path.exists(dst_subdir):
+        shutil.rmtree(dst_subdir)
+    os.replace(tmp_dir, dst_subdir)
+
+def report_stale(jobs, manifest):
+    """打印待转换PDF的原因分布和清单统计，不做任何转换"""
+    reasons = {}
+    for job in jobs:
+        reasons.setdefault(job['reason'], []).append(job['pdf_path'])
+        for duplicate in job['duplicates']:
+            reasons.setdefault('duplicate', []).append(duplicate)
+    for reason, paths in sorted(reasons.items()):
+        print(f"{reason}: {len(paths)} 个")
+        for path in paths:
+            print(f"    {path}")
+    for status, row in sorted(manifest.summary().items()):
+        print(f"清单 {status}: {row['n']} 个, {row['pages']} 页, 累计耗时 {row['duration']:.1f}s")
+
+def get_pdf_page_count(pdf_path):
+    """用pypdfium2（marker自带的依赖）读取PDF页数"""
+    import pypdfium2
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+def safe_page_count(pdf_path):
+    """读取页数，PDF损坏或缺少pypdfium2时返回None"""
+    try:
+        return get_pdf_page_count(pdf_path)
+    except Exception:
+        return None
+
+def plan_page_shards(page_count, shard_pages):
+    """
+    把页码切分为marker的page_range分片（从0开始，闭区间）。
+    Returns:
+        list: ["0-19", "20-39", ...]
+    """
+    return ['{}-{}'.format(start, min(start + shard_pages, page_count) - 1)
+            for start in range(0, page_count, shard_pages)]
+
+def get_shard_root(output_dir, pdf_base):
+    """分片的临时输出目录"""
+    return os.path.join(output_dir, '.shards', pdf_base)
+
+def merge_shard_outputs(output_dir, pdf_base, shard_count):
+    """
+    把各分片的输出合并为一个与不分片转换相同的目录。
+    marker在page_range下保留原始页码，所以分页分隔符 {页码}---- 和图片文件名 _page_{页码}_... 本身就是全局唯一的，
+    只需按分片顺序拼接markdown、移动图片并合并meta.json中的列表字段。
+    Args:
+        output_dir (str): 输出根目录
+        pdf_base (str): PDF文件名（不含扩展名）
+        shard_count (int): 分片数量
+    Returns:
+        str: 合并后的输出子目录
+    """
+    shard_root = get_shard_root(output_dir, pdf_base)
+    merged_dir = os.path.join(shard_root, 'merged')
+    os.makedirs(merged_dir, exist_ok=True)
+    md_parts = []
+    meta = None
+    for i in range(shard_count):
+        shard_dir = os.path.join(shard_root, str(i), pdf_base)
+        for name in sorted(os.listdir(shard_dir)):
+            path = os.path.join(shard_dir, name)
+            if name == f'{pdf_base}.md':
+                with open(path, 'r', encoding='utf-8') as f:
+                    md_parts.append(f.read().strip())
+            elif name == f'{pdf_base}_meta.json':
+                with open(path, 'r', encoding='utf-8') as f:
+                    shard_meta = json.load(f)
+                if meta is None:
+                    meta = shard_meta
+                else:
+                    for key, value in shard_meta.items():
+                        if isinstance(value, list) and isinstance(meta.get(key), list):
+                            meta[key].extend(value)
+            else:
+                shutil.move(path, os.path.join(merged_dir, name))
+    with open(os.path.join(merged_dir, f'{pdf_base}.md'), 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(md_parts))
+    if meta is not None:
+        with open(os.path.join(merged_dir, f'{pdf_base}_meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=4)
+    # 合并完成后再整体改名，中途失败不会留下看似完整的输出目录
+    output_subdir = os.path.join(output_dir, pdf_base)
+    os.replace(merged_dir, output_subdir)
+    shutil.rmtree(shard_root, ignore_errors=True)
+    return output_subdir
+
+def run_marker_on_matched_pdfs(scan_folder, file_pattern, output_dir, workers=0, threads_per_worker=None,
+                               shard_pages=0, manifest_path=None, adopt_existing=False, report_only=False,
+                               memory_budget_mb=None, memory_per_page_mb=DEFAULT_MEMORY_PER_PAGE_MB,
+                               model_memory_mb=DEFAULT_MODEL_MEMORY_MB, queue_dir=None, node_id=None, lease_ttl=600,
+                               page_cache_dir=None, page_cache_max_mb=2048, max_attempts=3):
+    """
+    扫描scan_folder下所有子文件夹，匹配PDF文件并转换。
+    workers为0时依次运行marker_single命令；大于0时使用常驻worker进程池，模型只加载一次。
+    shard_pages大于0时，页数超过该值的PDF按页码范围分片并行转换，再合并为一个markdown。
+    转换状态记录在SQLite清单中（按PDF内容sha256+转换参数），只转换新增、变化、失败或中断的PDF。
+    PDF按页数预估耗时、从长到短调度；指定内存预算时，同时转换的PDF/分片按预估内存控制。
+    指定queue_dir时，多台机器可对同一批PDF同时运行：通过共享目录中的租约文件分配任务。
+    Args:
+        scan_folder (str): 根目录
+        file_pattern (str): 文件名正则表达式
+        output_dir (str): marker_single输出目录
+        workers (int): 常驻worker数量，0表示每个PDF单独运行marker_single
+        threads_per_worker (int): 每个worker的计算线程数，默认按CPU核数平均分配
+        shard_pages (int): 每个分片的页数，0表示不分片（需要workers大于0或指定内存预算）
+        manifest_path (str): 转换清单路径，默认 output_dir/.marker_manifest.sqlite
+        adopt_existing (bool): 把清单中没有记录的已有输出登记为已完成
+        report_only (bool): 只报告需要转换的PDF，不转换
+        memory_budget_mb (int): 内存预算(MB)，workers为0时按预算并行运行多个marker_single
+        memory_per_page_mb (int): 转换时每页的预估内存(MB)
+        model_memory_mb (int): 每个进程加载模型的预估内存(MB)
+        queue_dir (str): 共享队列目录（所有机器可见），指定后进入多机分担模式
+        node_id (str): 本节点标识，默认为 主机名-进程号
+        lease_ttl (int): 租约超时秒数，超过该时间没有心跳的节点的任务会被重新领取
+        page_cache_dir (str): 页面缓存目录，指定后改版的PDF只把内容变化的页交给marker（需要pypdf）
+        page_cache_max_mb (int): 页面缓存大小上限(MB)，超过后按最近使用时间淘汰
+        max_attempts (int): 多机分担模式下每个PDF最多转换几次，失败未达到该次数时之后的运行会重试
+    Returns:
+        list: 转换失败的PDF路径
+    """
+    if shard_pages > 0 and workers <= 0 and not memory_budget_mb:
+        raise ValueError('分片转换需要同时指定 --workers 或 --memory-budget')
+    lease_queue = None
+    if queue_dir and not report_only:
+        lease_queue = LeaseQueue(queue_dir, node_id, lease_ttl, max_attempts)
+        # SQLite不适合多台机器通过网络文件系统同时写入，每个节点使用自己的清单，完成状态以队列中的标记为准
+        manifest_path = manifest_path or os.path.join(queue_dir, 'manifests', f'{lease_queue.node_id}.sqlite')
+        print(f"多机分担模式，节点: {lease_queue.node_id}，队列: {queue_dir}")
+    manifest = ConversionManifest(manifest_path or os.path.join(output_dir, '.marker_manifest.sqlite'))
+    options_key = make_options_key(MARKER_OPTIONS)
+    page_cache = PageCache(page_cache_dir, page_cache_max_mb * 1024 * 1024) if page_cache_dir else None
+    try:
+        jobs = select_pdfs_to_convert(find_matched_pdfs(scan_folder, file_pattern), output_dir,
+                                      manifest, options_key, adopt_existing)
+        if report_only:
+            report_stale(jobs, manifest)
+            if queue_dir:
+                print_merged_status(queue_dir, lease_ttl)
+            return []
+        return convert_jobs(jobs, output_dir, manifest, options_key, workers, threads_per_worker, shard_pages,
+                            memory_budget_mb, memory_per_page_mb, model_memory_mb, lease_queue, page_cache)
+    finally:
+        manifest.close()
+        if page_cache is not None:
+            page_cache.close()
+        if lease_queue is not None:
+            lease_queue.close()
+            print_merged_status(queue_dir, lease_ttl)
+
+def prepare_job(job, manifest, options_key):
+    """
+    清理上次残留的输出目录，并在清单中标记为running。
+    用页面缓存拼接的任务保留原来的输出，拼接完成后才替换，失败时上次的结果仍然可用。
+    """
+    if os.path.exists(job['output_subdir']) and 'missing_pages' not in job:
+        shutil.rmtree(job['output_subdir'])
+    if 'page_count' not in job:
+        job['page_count'] = safe_page_count(job['pdf_path'])
+    manifest.mark_running(job['sha256'], options_key, job['pdf_path'], job['output_subdir'], job['page_count'])
+
+def claim_job(job, output_dir, manifest, options_key, lease_queue=None):
+    """
+    领取并准备一个任务。分布式模式下先取得租约，已完成或正由其他节点转换的任务返回False。
+    """
+    if lease_queue is not None:
+        job['lease_key'] = make_job_key(job['sha256'], options_key)
+        if not lease_queue.acquire(job['lease_key'], {'pdf_path': job['pdf_path']}):
+            print(f"已由其他节点处理，跳过: {job['pdf_path']}")
+            job['status'] = 'skipped'
+            return False
+    prepare_job(job, manifest, options_key)
+    if job.get('shard_count') or 'missing_pages' in job:
+        shutil.rmtree(get_shard_root(output_dir, os.path.basename(job['output_subdir'])), ignore_errors=True)
+    if job.get('missing_pages'):
+        print(f"只转换页面缓存中没有的 {len(job['missing_pages'])}/{job['page_count']} 页: {job['pdf_path']}")
+    elif job.get('shard_count'):
+        print(f"分片转换: {job['pdf_path']}，{job['page_count']} 页，{job['shard_count']} 个分片")
+    job['status'] = 'running'
+    return True
+
+def finish_job(job, manifest, options_key, status, duration, error=None, lease_queue=None):
+    """把转换结果写入清单；分布式模式下写入完成标记并释放租约"""
+    if status == 'done':
+        manifest.mark_done(job['sha256'], options_key, job['pdf_path'], job['output_subdir'],
+                           duration, job['page_count'])
+        copy_duplicates(job)
+    else:
+        manifest.mark_failed(job['sha256'], options_key, job['pdf_path'], job['output_subdir'], duration, error)
+    if lease_queue is not None:
+        lease_queue.complete(job['lease_key'], status, job['pdf_path'], duration, error)
+    job['status'] = status
+    metrics.observe('convert.pdf', duration or 0.0, pdf_path=job['pdf_path'], pages=job.get('page_count'),
+                    status=status, reason=job.get('reason'))
+
+def plan_page_cache(jobs, page_cache, options_key):
+    """
+    计算每个PDF的页面哈希，找出页面缓存中没有的页，记录在job['missing_pages']中。
+    没有任何页命中的PDF（新PDF）仍然整本转换，转换完成后再按页存入缓存。
+    """
+    for job in jobs:
+        hashes = page_hashes(job['pdf_path'], options_key)
+        if not hashes:
+            continue
+        job['page_hashes'] = hashes
+        job['page_count'] = len(hashes)
+        missing = page_cache.missing_pages(hashes)
+        page_cache.touch(hashes)
+        if len(missing) < len(hashes):
+            if not page_cache.context_free(hashes):
+                print(f"缓存的页依赖整本文档的上下文（标题、跨页表格或段落），整本转换: {job['pdf_path']}")
+                continue
+            job['missing_pages'] = missing
+            print(f"页面缓存命中 {len(hashes) - len(missing)}/{len(hashes)} 页: {job['pdf_path']}")
+
+def partial_output_context_free(job, output_dir):
+    """只转换了部分页时，检查新转换的页是否都不依赖整本文档的上下文"""
+    pdf_base = os.path.basename(job['output_subdir'])
+    shard_root = get_shard_root(output_dir, pdf_base)
+    page_count = len(job['page_hashes'])
+    return not any(output_depends_on_context(os.path.join(shard_root, str(i), pdf_base), pdf_base, page_count)
+                   for i in range(job.get('shard_count', 0)))
+
+def fall_back_to_full_conversion(job, output_dir):
+    """新转换的页依赖整本文档的上下文，不能与缓存拼接：丢弃部分页的输出，改为整本转换"""
+    shutil.rmtree(get_shard_root(output_dir, os.path.basename(job['output_subdir'])), ignore_errors=True)
+    for key in ('missing_pages', 'shard_count', 'pending_shards'):
+        job.pop(key, None)
+    if os.path.exists(job['output_subdir']):
+        shutil.rmtree(job['output_subdir'])
+    print(f"新转换的页依赖整本文档的上下文（标题、跨页表格或段落），改为整本转换: {job['pdf_path']}")
+
+def update_page_cache(job, output_dir, page_cache):
+    """
+    转换成功后更新页面缓存：整本转换的输出按页存入缓存；
+    只转换了部分页时，先存入新转换的页，再用缓存拼出完整的输出目录。
+    """
+    if page_cache is None or 'page_hashes' not in job:
+        return
+    pdf_base = os.path.basename(job['output_subdir'])
+    if 'missing_pages' in job:
+        shard_root = get_shard_root(output_dir, pdf_base)
+        for i in range(job.get('shard_count', 0)):
+            page_cache.store_output(os.path.join(shard_root, str(i), pdf_base), pdf_base, job['page_hashes'])
+        page_cache.assemble(job['output_subdir'], pdf_base, job['page_hashes'])
+        shutil.rmtree(shard_root, ignore_errors=True)
+    else:
+        page_cache.store_output(job['output_subdir'], pdf_base, job['page_hashes'])
+
+def evict_page_cache(page_cache):
+    """所有任务结束后再淘汰页面缓存，避免删掉运行中其他PDF拼接时要用的页"""
+    if page_cache is not None:
+        page_cache.evict()
+
+def report_job_totals(jobs, projected, started):
+    counts = {}
+    for job in jobs:
+        counts[job.get('status')] = counts.get(job.get('status'), 0) + 1
+    skipped = f"，其他节点处理 {counts['skipped']} 个" if counts.get('skipped') else ''
+    elapsed = time.monotonic() - started
+    print(f"共转换 {counts.get('done', 0)} 个，失败 {counts.get('failed', 0)} 个{skipped}，"
+          f"预计耗时 {projected:.1f}s，实际耗时 {elapsed:.1f}s")
+    metrics.emit('convert.summary', done=counts.get('done', 0), failed=counts.get('failed', 0),
+                 skipped=counts.get('skipped', 0), projected=projected, elapsed=elapsed,
+                 pages=sum(job.get('page_count') or 0 for job in jobs if job.get('status') == 'done'))
+
+def copy_duplicates(job):
+    """把转换结果复制到内容相同的其他PDF的输出目录"""
+    for duplicate in job['duplicates']:
+        copy_converted_output(job['output_subdir'], duplicate)
+        print(f"内容相同，复制输出: {job['output_subdir']} => {duplicate}")
+
+def estimate_job_costs(jobs, seconds_per_page):
+    """
+    在转换开始前读取每个PDF的页数和大小，估算耗时。
+    读不出页数时按文件大小估算页数。
+    """
+    for job in jobs:
+        if 'page_count' not in job:
+            job['page_count'] = safe_page_count(job['pdf_path'])
+        job['size'] = os.path.getsize(job['pdf_path'])
+        job['est_pages'] = job['page_count'] or max(1, job['size'] // BYTES_PER_PAGE_GUESS)
+        if 'missing_pages' in job:
+            job['est_pages'] = len(job['missing_pages'])
+        job['est_seconds'] = job['est_pages'] * seconds_per_page
+
+def plan_work_units(jobs, output_dir, shard_pages, seconds_per_page, memory_per_page_mb, unit_overhead_mb=0):
+    """
+    把任务拆成提交给进程池的工作单元（整本PDF或一个页码分片），按预计耗时从长到短排序，
+    最长的说明书最先开始，避免最后只剩一本大PDF单独运行。
+    Returns:
+        list: [{"job", "output_dir", "page_range", "est_seconds", "memory_mb"}, ...]
+    """
+    units = []
+    for job in jobs:
+        pages = job['est_pages']
+        if 'missing_pages' in job:
+            # 部分页已在页面缓存中：只转换缺少的页（超过shard_pages时继续分片）
+            shard_root = get_shard_root(output_dir, os.path.basename(job['output_subdir']))
+            missing = job['missing_pages']
+            step = shard_pages if shard_pages > 0 else len(missing)
+            chunks = [missing[i:i + step] for i in range(0, len(missing), step)]
+            ranges = [(os.path.join(shard_root, str(i)), format_page_range(chunk), len(chunk))
+                      for i, chunk in enumerate(chunks)]
+            job['pending_shards'] = job['shard_count'] = len(ranges)
+        elif shard_pages <= 0 or not job['page_count'] or job['page_count'] <= shard_pages:
+            ranges = [(output_dir, None, pages)]
+        else:
+            shard_root = get_shard_root(output_dir, os.path.basename(job['output_subdir']))
+            page_ranges = plan_page_shards(job['page_count'], shard_pages)
+            ranges = []
+            for i, page_range in enumerate(page_ranges):
+                first, last = map(int, page_range.split('-'))
+                ranges.append((os.path.join(shard_root, str(i)), page_range, last - first + 1))
+            job['pending_shards'] = job['shard_count'] = len(ranges)
+        for unit_output_dir, page_range, unit_pages in ranges:
+            units.append({
+                'job': job,
+                'output_dir': unit_output_dir,
+                'page_range': page_range,
+                'est_seconds': unit_pages * seconds_per_page,
+                'memory_mb': unit_overhead_mb + unit_pages * memory_per_page_mb,
+            })
+    units.sort(key=lambda unit: unit['est_seconds'], reverse=True)
+    return units
+
+def project_makespan(durations, slots):
+    """按从长到短依次分配给最先空闲的worker，预估总耗时"""
+    finish_times = [0.0] * max(1, slots)
+    for duration in sorted(durations, reverse=True):
+        heapq.heapreplace(finish_times, finish_times[0] + duration)
+    return max(finish_times)
+
+def convert_jobs(jobs, output_dir, manifest, options_key, workers=0, threads_per_worker=None, shard_pages=0,
+                 memory_budget_mb=None, memory_per_page_mb=DEFAULT_MEMORY_PER_PAGE_MB,
+                 model_memory_mb=DEFAULT_MODEL_MEMORY_MB, lease_queue=None, page_cache=None):
+    """
+    转换select_pdfs_to_convert挑出的PDF，并把结果写回清单。
+    转换前先读取所有PDF的页数，按预计耗时从长到短调度；指定memory_budget_mb时，
+    同时运行的工作单元按预估内存（模型 + 每页内存 × 页数）控制，不超过预算。
+    Args:
+        memory_budget_mb (int): 内存预算(MB)，不指定则只受worker数限制；workers为0时按预算并行运行多个marker_single
+        memory_per_page_mb (int): 转换时每页的预估内存(MB)
+        model_memory_mb (int): 每个worker或marker_single进程加载模型的预估内存(MB)
+        lease_queue (LeaseQueue): 多机分担时的共享队列，每个PDF开始转换前领取租约（可选）
+        page_cache (PageCache): 页面缓存，改版的PDF只转换内容变化的页（可选）
+    Returns:
+        list: 转换失败的PDF路径
+    """
+    failed = []
+    started = time.monotonic()
+    seconds_per_page = manifest.seconds_per_page(options_key) or DEFAULT_SECONDS_PER_PAGE
+    all_jobs = jobs
+    if page_cache is not None:
+        plan_page_cache(jobs, page_cache, options_key)
+        # 所有页都已缓存的PDF不需要marker，直接拼接
+        for job in [job for job in jobs if job.get('missing_pages') == []]:
+            if not claim_job(job, output_dir, manifest, options_key, lease_queue):
+                continue
+            try:
+                page_cache.assemble(job['output_subdir'], os.path.basename(job['output_subdir']), job['page_hashes'])
+                finish_job(job, manifest, options_key, 'done', 0.0, lease_queue=lease_queue)
+                print(f"所有页均来自页面缓存: {job['pdf_path']} => {job['output_subdir']}")
+            except Exception as e:
+                print(f"页面缓存拼接失败: {job['pdf_path']}, 错误: {e}")
+                finish_job(job, manifest, options_key, 'failed', 0.0, str(e), lease_queue)
+                failed.append(job['pdf_path'])
+        jobs = [job for job in jobs if job.get('missing_pages') != []]
+    estimate_job_costs(jobs, seconds_per_page)
+    jobs = sorted(jobs, key=lambda job: job['est_seconds'], reverse=True)
+    if workers <= 0 and not memory_budget_mb:
+        projected = sum(job['est_seconds'] for job in jobs)
+        print(f"待转换 {len(jobs)} 个PDF，共 {sum(job['est_pages'] for job in jobs)} 页，"
+              f"预计耗时 {projected:.1f}s（{seconds_per_page:.2f}s/页）")
+        for job in jobs:
+            if not claim_job(job, output_dir, manifest, options_key, lease_queue):
+                continue
+            if 'missing_pages' in job:
+                job['shard_count'] = 1
+                shard_dir = os.path.join(get_shard_root(output_dir, os.path.basename(job['output_subdir'])), '0')
+                cmd = build_marker_cmd(job['pdf_path'], shard_dir, format_page_range(job['missing_pages']))
+            else:
+                cmd = build_marker_cmd(job['pdf_path'], output_dir)
+            print(f"运行: {' '.join(cmd)}")
+            job_started = time.monotonic()
+            try:
                 subprocess.run(cmd, check=True)
+                if 'missing_pages' in job and not partial_output_context_free(job, output_dir):
+                    fall_back_to_full_conversion(job, output_dir)
+                    cmd = build_marker_cmd(job['pdf_path'], output_dir)
+                    print(f"运行: {' '.join(cmd)}")
+                    subprocess.run(cmd, check=True)
+                update_page_cache(job, output_dir, page_cache)
+                finish_job(job, manifest, options_key, 'done', time.monotonic() - job_started,
+                           lease_queue=lease_queue)
+            except Exception as e:
+                # marker失败，或页面缓存拼接失败
+                print(f"转换失败: {job['pdf_path']}, 错误: {e}")
+                finish_job(job, manifest, options_key, 'failed', time.monotonic() - job_started, str(e), lease_queue)
+                failed.append(job['pdf_path'])
+        evict_page_cache(page_cache)
+        report_job_totals(all_jobs, projected, started)
+        return failed
+
+    if workers > 0:
+        threads_per_worker = threads_per_worker or default_threads_per_worker(workers)
+        pool = MarkerWorkerPool(workers, threads_per_worker)
+        # 每个worker常驻一份模型，预算中先扣除
+        available_mb = memory_budget_mb - workers * model_memory_mb if memory_budget_mb else None
+        unit_overhead_mb = 0
+        print(f"启动 {workers} 个marker worker，每个 {threads_per_worker} 线程，待转换 {len(jobs)} 个PDF")
+    else:
+        # 每个marker_single子进程各自加载模型
+        slots = max(1, min(os.cpu_count() or 1, memory_budget_mb // model_memory_mb))
+        pool = MarkerSubprocessPool(slots)
+        available_mb = memory_budget_mb
+        unit_overhead_mb = model_memory_mb
+        print(f"按内存预算 {memory_budget_mb}MB 最多同时运行 {slots} 个marker_single，待转换 {len(jobs)} 个PDF")
+    if available_mb is not None and available_mb <= 0:
+        print(f"警告: 内存预算 {memory_budget_mb}MB 不足以容纳 {workers} 个worker的模型，将逐个转换")
+    for job in jobs:
+        job['duration'] = 0.0
+    units = plan_work_units(jobs, output_dir, shard_pages, seconds_per_page, memory_per_page_mb, unit_overhead_mb)
+    projected = project_makespan([unit['est_seconds'] for unit in units], pool.workers)
+    print(f"共 {sum(job['est_pages'] for job in jobs)} 页，{len(units)} 个工作单元，"
+          f"预计耗时 {projected:.1f}s（{seconds_per_page:.2f}s/页）")
+    with pool:
+        futures = {}  # future -> unit
+        in_flight_mb = 0
+        while units or futures:
+            # 从最长的开始提交，直到worker占满或内存预算用完；没有运行中的单元时至少提交一个
+            i = 0
+            while i < len(units) and len(futures) < pool.workers:
+                unit = units[i]
+                job = unit['job']
+                if job['pdf_path'] in failed or job.get('status') == 'skipped':
+                    units.pop(i)
+                    continue
+                if futures and available_mb is not None and in_flight_mb + unit['memory_mb'] > available_mb:
+                    i += 1
+                    continue
+                units.pop(i)
+                # 真正开始转换时才领取任务，多机运行时其他节点可以分走尚未开始的PDF
+                if 'status' not in job and not claim_job(job, output_dir, manifest, options_key, lease_queue):
+                    continue
+                futures[pool.submit(unit['job']['pdf_path'], unit['output_dir'], unit['page_range'])] = unit
+                in_flight_mb += unit['memory_mb']
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                unit = futures.pop(future)
+                in_flight_mb -= unit['memory_mb']
+                job = unit['job']
+                if job['pdf_path'] in failed:
+                    continue
+                try:
+                    _, duration = future.result()
+                    job['duration'] += duration
+                    if 'pending_shards' in job:
+                        job['pending_shards'] -= 1
+                        if job['pending_shards']:
+                            continue
+                        if 'missing_pages' in job and not partial_output_context_free(job, output_dir):
+                            # 整本重新排队，优先于尚未开始的单元
+                            fall_back_to_full_conversion(job, output_dir)
+                            page_count = len(job['page_hashes'])
+                            units.insert(0, {
+                                'job': job,
+                                'output_dir': output_dir,
+                                'page_range': None,
+                                'est_seconds': page_count * seconds_per_page,
+                                'memory_mb': unit_overhead_mb + page_count * memory_per_page_mb,
+                            })
+                            continue
+                        if 'missing_pages' not in job:
+                            merge_shard_outputs(output_dir, os.path.basename(job['output_subdir']), job['shard_count'])
+                    update_page_cache(job, output_dir, page_cache)
+                    finish_job(job, manifest, options_key, 'done', job['duration'], lease_queue=lease_queue)
+                    print(f"转换完成: {job['pdf_path']} => {job['output_subdir']}")
+                except Exception as e:
+                    print(f"转换失败: {job['pdf_path']}, 错误: {e}")
+                    finish_job(job, manifest, options_key, 'failed', job['duration'], str(e), lease_queue)
+                    failed.append(job['pdf_path'])
+    evict_page_cache(page_cache)
+    report_job_totals(all_jobs, projected, started)
+    return failed
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='批量处理PDF并运行marker_single命令')
     parser.add_argument('--scan-folder', required=True, help='待扫描的PDF根目录')
     parser.add_argument('--file-pattern', required=True, help='PDF文件名正则表达式')
     parser.add_argument('--output-dir', required=True, help='marker_single输出目录')
+    parser.add_argument('--workers', type=int, default=0, help='常驻marker worker数量，0表示每个PDF单独运行marker_single')
+    parser.add_argument('--threads-per-worker', type=int, help='每个worker的计算线程数，默认为CPU核数/worker数')
+    parser.add_argument('--shard-pages', type=int, default=0, help='页数超过该值的PDF按此页数分片并行转换，0表示不分片')
+    parser.add_argument('--manifest', help='转换清单(SQLite)路径，默认 <output-dir>/.marker_manifest.sqlite')
+    parser.add_argument('--adopt-existing', action='store_true', help='把清单中没有记录的已有输出目录登记为已完成')
+    parser.add_argument('--report', action='store_true', help='只报告新增/变化/失败的PDF，不转换')
+    parser.add_argument('--memory-budget', type=int, help='转换可用的内存(MB)，同时运行的PDF/分片按预估内存控制；'
+                                                          '不指定--workers时按预算并行运行多个marker_single')
+    parser.add_argument('--memory-per-page', type=int, default=DEFAULT_MEMORY_PER_PAGE_MB, help='每页的预估内存(MB)')
+    parser.add_argument('--model-memory', type=int, default=DEFAULT_MODEL_MEMORY_MB, help='每个进程加载模型的预估内存(MB)')
+    parser.add_argument('--queue-dir', help='多机分担模式的共享队列目录，各机器指定同一目录即可分担转换')
+    parser.add_argument('--node-id', help='本节点标识，默认为 主机名-进程号')
+    parser.add_argument('--lease-ttl', type=int, default=600, help='租约超时秒数，超时未续约的任务由其他节点接管')
+    parser.add_argument('--max-attempts', type=int, default=3, help='多机分担模式下每个PDF最多转换几次（失败后重试）')
+    parser.add_argument('--page-cache', help='页面缓存目录：按页内容哈希缓存转换结果，改版的PDF只转换变化的页（需要pypdf）')
+    parser.add_argument('--page-cache-max-mb', type=int, default=2048, help='页面缓存大小上限(MB)')
+    metrics.add_metrics_arguments(parser)
     args = parser.parse_args()
-    run_marker_on_matched_pdfs(args.scan_folder, args.file_pattern, args.output_dir)
+    metrics.configure_from_args(args)
+    failed = run_marker_on_matched_pdfs(args.scan_folder, args.file_pattern, args.output_dir,
+                                        args.workers, args.threads_per_worker, args.shard_pages,
+                                        args.manifest, args.adopt_existing, args.report,
+                                        args.memory_budget, args.memory_per_page, args.model_memory,
+                                        args.queue_dir, args.node_id, args.lease_ttl,
+                                        args.page_cache, args.page_cache_max_mb, args.max_attempts)
+    metrics.close()
+    if failed:
+        raise SystemExit(1)
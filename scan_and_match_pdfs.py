@@ -1,72 +1,115 @@
 import os
 import re
-import csv
-import requests
-from urllib.parse import urljoin
-from bs4 import BeautifulSoup
 
-def scan_and_match_pdfs(url, cartype, scan_folder, file_pattern, output_csv='output.csv'):
+import http_cache
+import metrics
+import rate_limiter
+from html_parser import iter_listing_entries
+from local_file_index import get_local_index
+from match_store import DEFAULT_DB_PATH, MatchStore, print_changes, print_summary
+
+def fetch_pdf_links(url, file_pattern):
+    """
+    获取网页中所有匹配file_pattern的PDF链接及其所在<li>的车辆名。
+    Returns:
+        list: [(car_name, href), ...]
+    """
+    resp = http_cache.fetch(url)
+    resp.raise_for_status()
+    regex = re.compile(file_pattern)
+    pdf_info_list = []  # [(car_name, href)]
+    for entry in iter_listing_entries(resp.text):
+        car_name = entry['car_name'] or ''
+        for href in entry['links']:
+            if regex.search(href):
+                pdf_info_list.append((car_name, href))
+    return pdf_info_list
+
+def scan_and_match_many(targets, scan_folder, file_pattern, output_csv=None, index_path=None, db_path=DEFAULT_DB_PATH):
+    """
+    一次检查多个列表页：本地文件夹只通过共享索引扫描一次，匹配结果按 (cartype, car_name, web_pdf_path) 写入匹配结果数据库。
+    重复运行只更新已有条目，并打印与上次相比新增、新匹配、新缺失和已从列表页移除的条目。
+    Args:
+        targets (list): [(url, cartype), ...]
+        scan_folder (str): 本地PDF文件夹
+        file_pattern (str): 文件名正则表达式
+        output_csv (str): 需要时把当前的匹配结果导出为CSV（整体覆盖）
+        index_path (str): 本地文件索引路径（可选）
+        db_path (str): 匹配结果数据库路径
+    Returns:
+        list: 本次运行的变化，格式同MatchStore.changes()
+    """
+    # 扫描本地文件夹及其所有子目录（增量索引），并记录文件名和父文件夹（车型名）
+    local_file_map = get_local_index(scan_folder, index_path).match(file_pattern)  # {(car_name, file_name): full_path}
+    store = MatchStore(db_path)
+    try:
+        run_id = store.begin_run(targets)
+        changes = []
+        for url, cartype in targets:
+            entries = []
+            for car_name, link in fetch_pdf_links(url, file_pattern):
+                matched_file = local_file_map.get((car_name, os.path.basename(link)))
+                entries.append((car_name, link, matched_file))
+            changes += store.record_listing(run_id, cartype, entries)
+        # 所有列表页都取得成功后，才把没有再出现的条目标记为已移除
+        changes += store.finish_run(run_id, [cartype for _, cartype in targets])
+        print_changes(changes)
+        print_summary(store)
+        kinds = {}
+        for change in changes:
+            kinds[change['change']] = kinds.get(change['change'], 0) + 1
+        metrics.emit('match.summary', run_id=run_id, cartypes=store.summary(), changes=kinds)
+        if output_csv:
+            n = store.export_csv(output_csv)
+            print(f'CSV已导出: {output_csv}, {n} 行')
+        return changes
+    finally:
+        store.close()
+
+def scan_and_match_pdfs(url, cartype, scan_folder, file_pattern, output_csv=None, db_path=DEFAULT_DB_PATH):
     """
-    扫描本地PDF文件夹，匹配给定网页中的PDF链接，将匹配信息输出到CSV。
+    扫描本地PDF文件夹，匹配给定网页中的PDF链接，将匹配信息写入匹配结果数据库。
+    本地文件夹通过持久化索引扫描，同一会话中多次调用共用一个索引。
     Args:
         url (str): 需要解析的网页URL
         cartype (str): 车型
         scan_folder (str): 本地PDF文件夹
         file_pattern (str): 文件名正则表达式
-        output_csv (str): 输出CSV文件名
+        output_csv (str): 需要时导出CSV
+        db_path (str): 匹配结果数据库路径
     """
-    # 获取网页内容
-    resp = requests.get(url, timeout=30)
-    resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, 'html.parser')
-    # 获取所有PDF链接及其所在<li>的车辆名
-    pdf_info_list = []  # [(car_name, href)]
-    for li in soup.find_all('li'):
-        name_div = li.find('div', class_='name')
-        car_name = name_div.get_text(strip=True) if name_div else ''
-        for a in li.find_all('a', href=True):
-            href = a['href']
-            if re.search(file_pattern, href):
-                pdf_info_list.append((car_name, href))
-    # 扫描本地文件夹及其所有子目录（递归），并记录文件名和父文件夹（车型名）
-    local_file_map = {}  # {(car_name, file_name): full_path}
-    for root, dirs, files in os.walk(scan_folder):
-        folder_car_name = os.path.basename(root)
-        for f in files:
-            if re.search(file_pattern, f):
-                local_file_map[(folder_car_name, f)] = os.path.join(root, f)
-    # 匹配并追加到CSV（追加模式）
-    file_exists = os.path.exists(output_csv)
-    written = set()  # 记录已写入的(web_pdf_path, car_name)避免重复
-    with open(output_csv, 'a', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        if not file_exists:
-            writer.writerow(['cartype', 'car_name', 'web_pdf_path', 'local_pdf_path', 'matched'])
-        for car_name, link in pdf_info_list:
-            key = (link, car_name)
-            if key in written:
-                continue  # 跳过重复
-            written.add(key)
-            local_file_name = os.path.basename(link)
-            matched_file = local_file_map.get((car_name, local_file_name))
-            writer.writerow([cartype, car_name, link, matched_file or '', bool(matched_file)])
-    print(f'CSV已追加: {output_csv}')
+    return scan_and_match_many([(url, cartype)], scan_folder, file_pattern, output_csv, db_path=db_path)
 
 if __name__ == '__main__':
     """
     python scan_and_match_pdfs.py --url https://xxxx/welcab/ --cartype '福祉車両' --scan-folder /Volumes/Seagate/work/robot/webcatalog/catalogs --file-pattern '^.+welcab.+\\.pdf$'
+    多个列表页一次检查：重复 --url/--cartype，按顺序一一对应
+    python scan_and_match_pdfs.py --url https://xxxx/welcab/ --cartype '福祉車両' --url https://xxxx/business/ --cartype 'ビジネスカー' --scan-folder /Volumes/Seagate/work/robot/webcatalog/catalogs --file-pattern '^.+\\.pdf$'
     """
     import argparse
-    parser = argparse.ArgumentParser(description='Scan PDF folder and match with web page, output to CSV')
-    parser.add_argument('--url', required=True, help='网页URL')
-    parser.add_argument('--cartype', required=True, help='车型')
+    parser = argparse.ArgumentParser(description='Scan PDF folder and match with web page, upsert results into the match store')
+    parser.add_argument('--url', required=True, action='append', help='网页URL（可重复）')
+    parser.add_argument('--cartype', required=True, action='append', help='车型（可重复，与--url一一对应）')
     parser.add_argument('--scan-folder', required=True, help='本地PDF文件夹')
     parser.add_argument('--file-pattern', required=True, help='文件名正则表达式')
-    parser.add_argument('--output-csv', default='output.csv', help='输出CSV文件名')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='匹配结果数据库路径（重复运行只更新，不追加）')
+    parser.add_argument('--output-csv', help='同时把匹配结果导出为CSV（整体覆盖）')
+    parser.add_argument('--index-path', help='本地文件索引路径，默认 ~/.cache/carmodel/scan_index_*.json')
+    http_cache.add_cache_arguments(parser)
+    rate_limiter.add_scheduler_arguments(parser)
+    metrics.add_metrics_arguments(parser)
     args = parser.parse_args()
+    http_cache.configure_from_args(args)
+    rate_limiter.configure_from_args(args)
+    metrics.configure_from_args(args)
+    if len(args.url) != len(args.cartype):
+        parser.error('--url 和 --cartype 的数量必须一致')
     # args.url = 'https://xxxx/welcab/'
     # args.cartype = 'ビジネスカー'
     # args.scan_folder = '/Volumes/Seagate/work/robot/webcatalog/catalogs'
     # args.file_pattern = '^.+welcab.+\\.pdf$'
     # args.output_csv = '/Volumes/Seagate/work/robot/webcatalog/output.csv'
-    scan_and_match_pdfs(args.url, args.cartype, args.scan_folder, args.file_pattern, args.output_csv)
+    scan_and_match_many(list(zip(args.url, args.cartype)), args.scan_folder, args.file_pattern,
+                        args.output_csv, args.index_path, args.db)
+    rate_limiter.print_summary()
+    metrics.close()
@@ -0,0 +1,66 @@
+import os
+import sys
+import json
+import hashlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+import run_marker_batch
+
+def stub_page_hashes(pdf_path, options_key):
+    """合成PDF没有真正的页面内容，按文件名、页码和改版号计算页面哈希"""
+    pages, revs = benchmark.read_stub_pdf(pdf_path)
+    base = os.path.basename(pdf_path)
+    return [hashlib.sha256(f'{options_key}-{base}-{i}-{revs[i]}'.encode()).hexdigest() for i in range(pages)]
+
+@pytest.fixture
+def stub_marker(tmp_path, monkeypatch):
+    """
+    把benchmark.py的marker_single替身放到PATH最前面（子进程也会使用），并替换页数、页面哈希的读取。
+    Returns:
+        function: 返回到目前为止替身的调用记录 [{"pdf_path", "output_dir", "page_range"}, ...]
+    """
+    for name in ('PATH', 'BENCH_MARKER_SECONDS_PER_PAGE', 'BENCH_MARKER_MB'):
+        monkeypatch.setenv(name, os.environ.get(name, ''))  # 测试结束后恢复
+    monkeypatch.delenv('BENCH_MARKER_HEADINGS', raising=False)
+    log_path = tmp_path / 'marker_calls.jsonl'
+    monkeypatch.setenv('BENCH_MARKER_LOG', str(log_path))
+    benchmark.install_stub_marker(str(tmp_path / 'bin'))
+    monkeypatch.setattr(run_marker_batch, 'page_hashes', stub_page_hashes)
+    monkeypatch.setattr(run_marker_batch, 'get_pdf_page_count', lambda pdf_path: benchmark.read_stub_pdf(pdf_path)[0])
+
+    def calls():
+        if not log_path.exists():
+            return []
+        with open(log_path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+    return calls
+
+def write_stub_pdf(path, pages, revs=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(benchmark.make_stub_pdf(pages, revs))
+
+def read_output(subdir):
+    """
+    读取一个marker输出目录，用于比较两次转换的结果。
+    Returns:
+        dict: {"md": markdown原文, "meta": 解析后的meta.json, "images": {文件名: 内容}}
+    """
+    pdf_base = os.path.basename(subdir)
+    output = {'images': {}}
+    for name in os.listdir(subdir):
+        path = os.path.join(subdir, name)
+        if name == f'{pdf_base}.md':
+            with open(path, 'rb') as f:
+                output['md'] = f.read()
+        elif name == f'{pdf_base}_meta.json':
+            with open(path, encoding='utf-8') as f:
+                output['meta'] = json.load(f)
+        else:
+            with open(path, 'rb') as f:
+                output['images'][name] = f.read()
+    return output
@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+from lease_queue import LeaseQueue, merge_status
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_three_nodes_convert_each_pdf_once(tmp_path, monkeypatch, stub_marker):
+    monkeypatch.setenv('BENCH_MARKER_SECONDS_PER_PAGE', '0.05')
+    pdf_paths = []
+    for i in range(12):
+        pdf_path = tmp_path / 'scan' / f'C{i}' / f'C{i}.pdf'
+        os.makedirs(pdf_path.parent)
+        with open(pdf_path, 'wb') as f:
+            f.write(benchmark.make_stub_pdf(2, body=f'C{i}'.encode()))  # 内容不同，不会被当作重复的PDF
+        pdf_paths.append(str(pdf_path))
+    queue_dir = str(tmp_path / 'queue')
+    nodes = [subprocess.Popen([sys.executable, os.path.join(ROOT, 'run_marker_batch.py'),
+                               '--scan-folder', str(tmp_path / 'scan'), '--file-pattern', r'.*\.pdf$',
+                               '--output-dir', str(tmp_path / 'out'), '--queue-dir', queue_dir,
+                               '--node-id', f'n{i}'],
+                              stdout=subprocess.DEVNULL)
+             for i in range(3)]
+    for node in nodes:
+        assert node.wait(timeout=120) == 0
+
+    converted = sorted(call['pdf_path'] for call in stub_marker())
+    assert converted == sorted(pdf_paths)
+    merged = merge_status(queue_dir)
+    assert (merged['done'], merged['failed'], merged['leased']) == (12, 0, 0)
+    assert sum(row['done'] for row in merged['nodes'].values()) == 12
+    for i in range(12):
+        assert os.path.exists(tmp_path / 'out' / f'C{i}' / f'C{i}.md')
+
+def test_expired_lease_is_taken_over(tmp_path):
+    queue_dir = str(tmp_path / 'queue')
+    a = LeaseQueue(queue_dir, 'a', lease_ttl=2)
+    b = LeaseQueue(queue_dir, 'b', lease_ttl=2)
+    try:
+        assert a.acquire('k', {'pdf_path': 'k.pdf'})
+        assert not b.acquire('k')  # 租约有效时不能领取
+
+        # a停止心跳，租约的mtime停在ttl之前
+        a._stop.set()
+        a._heartbeat.join()
+        lease_path = os.path.join(queue_dir, 'leases', 'k.lease')
+        stale = b.fs_now() - 10
+        os.utime(lease_path, (stale, stale))
+        assert merge_status(queue_dir, lease_ttl=2)['expired'] == 1
+
+        assert b.acquire('k')
+        assert not a.holds('k')
+        a.complete('k', 'done', duration=1.0)
+        assert not os.path.exists(os.path.join(queue_dir, 'done', 'k.json'))
+        assert os.path.exists(lease_path)  # a不能删除b的租约
+
+        b.complete('k', 'done', duration=1.0)
+        with open(os.path.join(queue_dir, 'done', 'k.json'), encoding='utf-8') as f:
+            assert json.load(f)['node_id'] == 'b'
+        assert not a.acquire('k')
+    finally:
+        a.close()
+        b.close()
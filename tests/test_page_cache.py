@@ -0,0 +1,146 @@
+import os
+import sys
+import hashlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import run_marker_batch
+from conversion_manifest import ConversionManifest, make_options_key
+from marker_worker import MARKER_OPTIONS
+from page_cache import PageCache
+from conftest import read_output, write_stub_pdf
+
+PAGES = 4
+
+def fake_page_hashes(pdf_path, options_key):
+    """测试用PDF的内容为 "<名称> <版本>"，只有第0页随版本变化"""
+    with open(pdf_path, encoding='utf-8') as f:
+        name, rev = f.read().split()
+    return [hashlib.sha256(f'{name}-{i}-{rev if i == 0 else 0}'.encode()).hexdigest() for i in range(PAGES)]
+
+def fake_marker(calls):
+    """按命令行参数写出与marker分页输出相同布局的markdown和图片"""
+    def run(cmd, check=True):
+        pdf_path = cmd[1]
+        output_dir = cmd[cmd.index('--output_dir') + 1]
+        page_ids = list(range(PAGES))
+        if '--page_range' in cmd:
+            page_ids = [int(p) for p in cmd[cmd.index('--page_range') + 1].split(',')]
+        calls.append((os.path.basename(pdf_path), page_ids))
+        with open(pdf_path, encoding='utf-8') as f:
+            name, rev = f.read().split()
+        base = os.path.splitext(os.path.basename(pdf_path))[0]
+        folder = os.path.join(output_dir, base)
+        os.makedirs(folder, exist_ok=True)
+        parts = []
+        for i in page_ids:
+            with open(os.path.join(folder, f'_page_{i}_Picture_0.jpeg'), 'wb') as f:
+                f.write(b'x' * 4096)
+            parts.append('{%d}' % i + '-' * 48 + f'\n\n{name} page {i} rev {rev if i == 0 else 0}\n\n'
+                         f'![](_page_{i}_Picture_0.jpeg)')
+        with open(os.path.join(folder, base + '.md'), 'w', encoding='utf-8') as f:
+            f.write('\n\n'.join(parts))
+    return run
+
+def write_pdfs(scan_folder, rev):
+    for name in ('A', 'B'):
+        os.makedirs(os.path.join(scan_folder, name), exist_ok=True)
+        with open(os.path.join(scan_folder, name, f'{name}.pdf'), 'w', encoding='utf-8') as f:
+            f.write(f'{name} {rev}')
+
+def convert(tmp_path, max_mb):
+    return run_marker_batch.run_marker_on_matched_pdfs(
+        str(tmp_path / 'scan'), r'.*\.pdf$', str(tmp_path / 'out'),
+        page_cache_dir=str(tmp_path / 'cache'), page_cache_max_mb=max_mb)
+
+def read_md(tmp_path, name):
+    with open(tmp_path / 'out' / name / f'{name}.md', encoding='utf-8') as f:
+        return f.read()
+
+def test_eviction_under_pressure_keeps_pages_needed_by_later_jobs(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(run_marker_batch, 'page_hashes', fake_page_hashes)
+    monkeypatch.setattr(run_marker_batch.subprocess, 'run', fake_marker(calls))
+    write_pdfs(tmp_path / 'scan', 1)
+    assert convert(tmp_path, 2048) == []
+    assert sorted(calls) == [('A.pdf', list(range(PAGES))), ('B.pdf', list(range(PAGES)))]
+
+    # 两本都只改了第0页；缓存上限为0，运行中淘汰会删掉另一本拼接要用的页
+    write_pdfs(tmp_path / 'scan', 2)
+    calls.clear()
+    assert convert(tmp_path, 0) == []
+    assert sorted(calls) == [('A.pdf', [0]), ('B.pdf', [0])]
+    for name in ('A', 'B'):
+        md = read_md(tmp_path, name)
+        assert f'{name} page 0 rev 2' in md
+        assert f'{name} page {PAGES - 1} rev 0' in md
+        assert os.path.exists(tmp_path / 'out' / name / f'_page_{PAGES - 1}_Picture_0.jpeg')
+
+    # 所有任务结束后才淘汰，超过上限的页全部删除
+    page_cache = PageCache(str(tmp_path / 'cache'), 0)
+    try:
+        for name in ('A', 'B'):
+            pdf_path = str(tmp_path / 'scan' / name / f'{name}.pdf')
+            assert page_cache.missing_pages(fake_page_hashes(pdf_path, None)) == list(range(PAGES))
+    finally:
+        page_cache.close()
+
+def test_assembly_error_marks_job_failed(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(run_marker_batch, 'page_hashes', fake_page_hashes)
+    monkeypatch.setattr(run_marker_batch.subprocess, 'run', fake_marker(calls))
+    write_pdfs(tmp_path / 'scan', 1)
+    assert convert(tmp_path, 2048) == []
+
+    def broken_assemble(self, dest_subdir, pdf_base, hashes):
+        raise FileNotFoundError(dest_subdir)
+
+    monkeypatch.setattr(PageCache, 'assemble', broken_assemble)
+    write_pdfs(tmp_path / 'scan', 2)
+    failed = convert(tmp_path, 2048)
+    assert sorted(os.path.basename(path) for path in failed) == ['A.pdf', 'B.pdf']
+    for name in ('A', 'B'):
+        assert f'{name} page 0 rev 1' in read_md(tmp_path, name)  # 拼接失败时保留上次的输出
+    manifest = ConversionManifest(str(tmp_path / 'out' / '.marker_manifest.sqlite'))
+    try:
+        options_key = make_options_key(MARKER_OPTIONS)
+        for path in failed:
+            assert manifest.get(manifest.file_sha256(path), options_key)['status'] == 'failed'
+    finally:
+        manifest.close()
+
+# BENCH_MARKER_HEADINGS -> 改版第2页后的转换：none 只转换第2页再拼接；all 缓存的页有标题，直接整本转换；
+# revised 缓存的页没有标题，但新转换的第2页有标题，转换后发现再整本转换
+@pytest.mark.parametrize('headings, page_ranges', [
+    ('none', ['2']),
+    ('all', [None]),
+    ('revised', ['2', None]),
+])
+@pytest.mark.parametrize('pool', [False, True], ids=['sequential', 'pool'])
+def test_cached_conversion_matches_full_conversion(tmp_path, monkeypatch, stub_marker, headings, page_ranges, pool):
+    monkeypatch.setenv('BENCH_MARKER_HEADINGS', headings)
+    options = {'memory_budget_mb': 8000, 'model_memory_mb': 1000} if pool else {}
+    pdf_path = str(tmp_path / 'scan' / 'A' / 'A.pdf')
+    write_stub_pdf(pdf_path, 5)
+
+    def convert_to(out, cache=None):
+        return run_marker_batch.run_marker_on_matched_pdfs(
+            str(tmp_path / 'scan'), r'.*\.pdf$', str(tmp_path / out),
+            page_cache_dir=str(tmp_path / cache) if cache else None, **options)
+
+    assert convert_to('out', 'cache') == []
+    write_stub_pdf(pdf_path, 5, [0, 0, 1, 0, 0])
+    calls_before = len(stub_marker())
+    assert convert_to('out', 'cache') == []
+    assert [call['page_range'] for call in stub_marker()[calls_before:]] == page_ranges
+    assert convert_to('full') == []
+
+    cached = read_output(str(tmp_path / 'out' / 'A'))
+    full = read_output(str(tmp_path / 'full' / 'A'))
+    assert '（改訂1）'.encode() in cached['md']
+    assert cached['md'] == full['md']
+    assert cached['meta'] == full['meta']
+    assert cached['images'] == full['images']
+    assert not os.path.exists(tmp_path / 'out' / '.shards' / 'A')
@@ -0,0 +1,30 @@
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import run_marker_batch
+from conftest import read_output, write_stub_pdf
+
+def test_sharded_conversion_matches_unsharded(tmp_path, stub_marker):
+    write_stub_pdf(str(tmp_path / 'scan' / 'A' / 'A.pdf'), 7)
+
+    def convert_to(out, shard_pages):
+        return run_marker_batch.run_marker_on_matched_pdfs(
+            str(tmp_path / 'scan'), r'.*\.pdf$', str(tmp_path / out), shard_pages=shard_pages,
+            memory_budget_mb=8000, model_memory_mb=1000)
+
+    assert convert_to('sharded', 2) == []
+    assert sorted(call['page_range'] for call in stub_marker()) == ['0-1', '2-3', '4-5', '6-6']
+    assert convert_to('whole', 0) == []
+    assert stub_marker()[-1]['page_range'] is None
+
+    sharded = read_output(str(tmp_path / 'sharded' / 'A'))
+    whole = read_output(str(tmp_path / 'whole' / 'A'))
+    assert re.findall(rb'\{(\d+)\}-{48}', sharded['md']) == [str(i).encode() for i in range(7)]
+    assert sharded['md'] == whole['md']
+    assert sharded['meta'] == whole['meta']
+    assert sorted(sharded['images']) == [f'_page_{i}_Picture_0.jpeg' for i in range(7)]
+    assert sharded['images'] == whole['images']
+    assert not os.path.exists(tmp_path / 'sharded' / '.shards' / 'A')